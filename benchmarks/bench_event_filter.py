@@ -0,0 +1,81 @@
+"""Interpreted (EventFilter.filter) vs compiled (EventFilter.compile) evaluation of template rules, and
+find_template with and without memoization
+
+Run with: python benchmarks/bench_event_filter.py [template-rules.yaml] [number]
+"""
+
+import sys
+import timeit
+
+import yaml
+
+from eth_pretty_events.event_filter import (
+    TemplateRuleSet,
+    find_template,
+    read_template_rules,
+)
+from eth_pretty_events.types import (
+    Address,
+    Block,
+    Chain,
+    Event,
+    Hash,
+    Tx,
+    make_abi_namedtuple,
+)
+
+TRANSFER_ABI = [
+    {"indexed": True, "name": "from", "type": "address"},
+    {"indexed": True, "name": "to", "type": "address"},
+    {"indexed": False, "name": "value", "type": "uint256"},
+]
+APPROVAL_ABI = [
+    {"indexed": True, "name": "owner", "type": "address"},
+    {"indexed": True, "name": "spender", "type": "address"},
+    {"indexed": False, "name": "value", "type": "uint256"},
+]
+
+
+def sample_events():
+    block = Block(hash=Hash("0x" + "11" * 32), timestamp=1722853708, number=100000, chain=Chain(id=137, name="Polygon"))
+    tx = Tx(hash=Hash("0x" + "22" * 32), index=1, block=block)
+    token = Address("0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174")
+    some_addr = Address("0xD74A28274C4B1a116aDd9857FC0E8F5e8fAC2497")
+    transfer_args = make_abi_namedtuple("Transfer", TRANSFER_ABI)
+    approval_args = make_abi_namedtuple("Approval", APPROVAL_ABI)
+    return [
+        Event(address=token, args=transfer_args(some_addr, token, 10**6), tx=tx, name="Transfer", log_index=0),
+        Event(address=token, args=approval_args(some_addr, token, 10**6), tx=tx, name="Approval", log_index=1),
+    ]
+
+
+def main(rules_file: str, number: int):
+    rules = read_template_rules(yaml.load(open(rules_file), yaml.SafeLoader))
+    events = sample_events()
+
+    def interpreted():
+        for evt in events:
+            for rule in rules:
+                rule.match.filter(evt)
+
+    def compiled():
+        for evt in events:
+            for rule in rules:
+                rule.matches(evt)
+
+    evaluations = number * len(events) * len(rules)
+    for name, fn in [("interpreted", interpreted), ("compiled", compiled)]:
+        elapsed = timeit.timeit(fn, number=number)
+        print(f"{name:<12} {evaluations / elapsed:>14,.0f} rule evaluations/s")
+
+    not_memoized = TemplateRuleSet(rules, memo_size=0)
+    for name, rule_set in [("find", not_memoized), ("find (memo)", rules)]:
+        elapsed = timeit.timeit(lambda: [find_template(rule_set, evt) for evt in events], number=number)
+        print(f"{name:<12} {number * len(events) / elapsed:>14,.0f} events/s")
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1] if len(sys.argv) > 1 else "samples/template-rules.yaml",
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100000,
+    )
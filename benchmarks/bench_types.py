@@ -0,0 +1,36 @@
+"""Construction throughput of eth_pretty_events.types.Hash for each input type
+
+Run with: python benchmarks/bench_types.py [number]
+"""
+
+import sys
+import timeit
+
+from hexbytes import HexBytes
+
+from eth_pretty_events.types import Hash
+
+SOME_HASH = "0x37a50ac80e26cbf0005469713177e3885800188d80b92134f150685e931aa4bf"
+
+
+def main(number: int):
+    bytes_value = bytes.fromhex(SOME_HASH[2:])
+    hexbytes_value = HexBytes(SOME_HASH)
+    hash_value = Hash(SOME_HASH)
+    inputs = {
+        "str (lowercase)": (Hash, SOME_HASH),
+        "str (mixed case)": (Hash, SOME_HASH[:2] + SOME_HASH[2:].upper()),
+        "str (no prefix)": (Hash, SOME_HASH[2:]),
+        "Hash": (Hash, hash_value),
+        "bytes": (Hash, bytes_value),
+        "HexBytes": (Hash, hexbytes_value),
+        "bytes (from_bytes32)": (Hash.from_bytes32, bytes_value),
+        "HexBytes (from_bytes32)": (Hash.from_bytes32, hexbytes_value),
+    }
+    for name, (constructor, value) in inputs.items():
+        elapsed = timeit.timeit(lambda: constructor(value), number=number)
+        print(f"{name:<25} {number / elapsed:>14,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
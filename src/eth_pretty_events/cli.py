@@ -1,5 +1,6 @@
 import argparse
 import asyncio
+import functools
 import heapq
 import itertools
 import json
@@ -28,12 +29,32 @@ try:
     from . import pubsub  # noqa - To load the pubsub output
 except ImportError:
     pass
-from . import __version__, address_book, decode_events, render
+from . import (
+    __version__,
+    address_book,
+    decode_events,
+    metrics,
+    queues,
+    rainbow,
+    render,
+    token_metadata,
+)
 from .block_tree import BlockTree
-from .event_filter import TemplateRule, read_template_rules
+from .event_filter import (
+    TemplateRuleSet,
+    format_rules_profile,
+    read_template_rules,
+    rules_profile_metrics,
+)
 from .event_parser import EventDefinition
-from .event_subscriptions import load_subscriptions
-from .outputs import DecodedTxLogs, OutputBase
+from .event_subscriptions import (
+    SubscriptionPlan,
+    load_subscriptions,
+    plan_subscriptions,
+)
+from .outputs import DecodedTxLogs, OutputBase, name_outputs, share_render_cache
+from .render_stage import RenderStage
+from .tx_enrichment import TxEnricher, enrich_by_block
 from .types import Address, Block, Chain, Hash, Tx
 
 __author__ = "Guillermo M. Narvaja"
@@ -63,8 +84,9 @@ class RenderingEnv:
     jinja_env: "jinja2.Environment"
     w3: Optional[Web3]
     chain: Chain
-    template_rules: Sequence[TemplateRule]
+    template_rules: TemplateRuleSet
     args: Any
+    tx_enricher: Optional[TxEnricher] = None
 
 
 def _setup_web3(args) -> Optional[Web3]:
@@ -94,8 +116,7 @@ def _setup_address_book(args, _: Optional[Web3]):
 def _env_globals(args, w3_chain_id):
     ret = {}
     if args.bytes32_rainbow:
-        ret["b32_rainbow"] = json.load(open(args.bytes32_rainbow))
-        # TODO: process hashes or invert the dict
+        ret["b32_rainbow"] = rainbow.load_rainbow(args.bytes32_rainbow, args.cache_dir)
     else:
         ret["b32_rainbow"] = {}
 
@@ -126,6 +147,50 @@ def _env_globals(args, w3_chain_id):
     return ret
 
 
+_rules_profile_collector = None
+
+
+def _export_rules_profile(template_rules):
+    """Exports the profile of the rules as metrics, replacing the ones of a previous setup"""
+    global _rules_profile_collector
+    if _rules_profile_collector is not None:
+        metrics.remove_collector(_rules_profile_collector)
+    _rules_profile_collector = functools.partial(rules_profile_metrics, template_rules)
+    metrics.add_collector(_rules_profile_collector)
+
+
+def _token_metadata_file(args) -> Optional[str]:
+    return os.path.join(args.cache_dir, "token-metadata.json") if args.cache_dir else None
+
+
+def _setup_token_metadata(args):
+    if not args.token_metadata:
+        return
+    filename = _token_metadata_file(args)
+    if filename is not None and os.path.exists(filename):
+        cache = token_metadata.TokenMetadataCache.load(filename)
+    else:
+        cache = token_metadata.TokenMetadataCache()
+    token_metadata.setup_default(cache)
+
+
+def _save_token_metadata(args):
+    filename = _token_metadata_file(args)
+    cache = token_metadata.get_default()
+    if filename is not None and cache.dirty:
+        os.makedirs(args.cache_dir, exist_ok=True)
+        cache.save(filename)
+
+
+def _enrich_block(renv: RenderingEnv, decoded_tx_logs: List[DecodedTxLogs]):
+    """Fetches the data of the block needed to render it (transactions details and token metadata)"""
+    if renv.tx_enricher is not None:
+        renv.tx_enricher.enrich_tx_logs(decoded_tx_logs)
+    if renv.args.token_metadata and renv.w3 is not None:
+        token_metadata.get_default().prefetch(renv.w3, renv.chain.id, token_metadata.event_addresses(decoded_tx_logs))
+        _save_token_metadata(renv.args)
+
+
 def setup_rendering_env(args) -> RenderingEnv:
     """Sets up the rendering environment"""
     EventDefinition.load_all_events(args.abi_paths)
@@ -134,16 +199,62 @@ def setup_rendering_env(args) -> RenderingEnv:
     chain = env_globals["chain"]
 
     _setup_address_book(args, w3)
+    _setup_token_metadata(args)
 
-    jinja_env = render.init_environment(args.template_paths, env_globals)
+    render_budget = None
+    if args.render_budget_ms:
+        render_budget = render.RenderBudget(
+            args.render_budget_ms / 1000, args.render_quarantine_after, args.render_quarantine_seconds
+        )
+    jinja_env = render.init_environment(
+        args.template_paths,
+        env_globals,
+        args.templates_cache_dir,
+        auto_reload=args.templates_auto_reload,
+        render_budget=render_budget,
+    )
 
-    template_rules = read_template_rules(yaml.load(open(args.template_rules), yaml.SafeLoader))
+    template_rules = read_template_rules(
+        yaml.load(open(args.template_rules), yaml.SafeLoader), profile=args.profile_rules
+    )
+    if args.profile_rules:
+        _export_rules_profile(template_rules)
+    if args.precompile_templates:
+        template_names = {rule.template for rule in template_rules}
+        if args.on_error_template:
+            template_names.add(args.on_error_template)
+        loaded = render.precompile(jinja_env, sorted(template_names))
+        _logger.info(f"{loaded} templates precompiled")
+    if not args.templates_auto_reload:
+        render.resolve_templates(jinja_env, template_rules, args.on_error_template)
     return RenderingEnv(
         w3=w3,
         jinja_env=jinja_env,
         template_rules=template_rules,
         chain=chain,
         args=args,
+        tx_enricher=TxEnricher(w3, args.tx_enrichment) if args.tx_enrichment != "off" and w3 is not None else None,
+    )
+
+
+def _worker_rendering_env(args, chain_id: int) -> RenderingEnv:
+    """Rendering environment of the render pool processes (without RPC connection)"""
+    worker_args = argparse.Namespace(
+        **{**vars(args), "rpc_url": None, "chain_id": chain_id, "profile_rules": False, "precompile_templates": False}
+    )
+    return setup_rendering_env(worker_args)
+
+
+def build_render_stage(renv: RenderingEnv, outputs: List[OutputBase]) -> Optional[RenderStage]:
+    if not renv.args.render_workers:
+        return None
+    return RenderStage(
+        renv,
+        [output.template_rules for output in outputs if output.uses_template_rules],
+        renv.args.render_workers,
+        renv.args.render_pool,
+        renv_factory=_worker_rendering_env,
+        renv_factory_args=(renv.args, renv.chain.id),
     )
 
 
@@ -153,6 +264,7 @@ async def _do_listen_events(
     renv: RenderingEnv,
     subscriptions: list,
     raw_logs: asyncio.Queue[Tuple[Block, List[web3types.LogReceipt]]],
+    subscription_plan: Optional[SubscriptionPlan] = None,
 ):
     block_headers_sub_id = await w3.eth.subscribe("newHeads")
     _logger.info(f"Block Headers Subscription: {block_headers_sub_id}")
@@ -191,6 +303,8 @@ async def _do_listen_events(
             # Block tree cleanup, needed to release memory and to drop forked logs
             if blocks_seen % renv.args.block_tree_cleanup == 0:
                 block_tree.clean(renv.args.block_tree_cleanup)
+                if subscription_plan is not None:
+                    _logger.info(subscription_plan.summary())
 
             # Pushes to the queue the logs that have enough confirmations
             for block in sorted(waitlist_logs.keys(), key=lambda x: x.number):
@@ -209,6 +323,8 @@ async def _do_listen_events(
                     await raw_logs.put((block, [pl["result"] for pl in payloads]))
         else:
             raw_log: web3types.LogReceipt = payload["result"]
+            if subscription_plan is not None:
+                subscription_plan.observe([raw_log])
             block_hash = Hash(raw_log["blockHash"])
             timestamp = timestamp_cache.get(block_hash, None)
             block = Block(block_hash, timestamp, raw_log["blockNumber"], renv.chain)
@@ -218,22 +334,42 @@ async def _do_listen_events(
 
 
 async def parse_raw_events(
-    renv: RenderingEnv, raw_logs: asyncio.Queue, processed_logs: List[asyncio.Queue[DecodedTxLogs]]
+    renv: RenderingEnv,
+    raw_logs: asyncio.Queue,
+    processed_logs: List[asyncio.Queue[DecodedTxLogs]],
+    render_stage: Optional[RenderStage] = None,
 ):
     """Processes the raw logs, enrichs them (decoding) and groups by TX"""
-    while True:
-        block: Block
-        logs: List[web3types.LogReceipt]
-        block, logs = await raw_logs.get()
-
-        for tx_hash, tx_logs in itertools.groupby(logs, key=lambda x: x["transactionHash"]):
-            tx_logs = list(tx_logs)
-            tx = Tx(Hash(tx_hash), tx_logs[0]["transactionIndex"], block)
-            decoded_events = list(decode_events.decode_events_from_raw_logs(block, tx, tx_logs))
-            decoded_log = DecodedTxLogs(tx, tx_logs, decoded_events)
-            for queue in processed_logs:
-                await queue.put(decoded_log)
-        raw_logs.task_done()
+    if render_stage is not None:
+        # Rendered in parallel, up to the window of the stage, and forwarded to the outputs in order
+        in_flight = asyncio.Queue(render_stage.window)
+        forwarder = asyncio.create_task(render_stage.forward_rendered(in_flight, processed_logs))
+    try:
+        while True:
+            block: Block
+            logs: List[web3types.LogReceipt]
+            block, logs = await raw_logs.get()
+
+            decoded_logs = []
+            for tx_hash, tx_logs in itertools.groupby(logs, key=lambda x: x["transactionHash"]):
+                tx_logs = list(tx_logs)
+                tx = Tx(Hash(tx_hash), tx_logs[0]["transactionIndex"], block)
+                decoded_events = list(decode_events.decode_events_from_raw_logs(block, tx, tx_logs))
+                decoded_logs.append(DecodedTxLogs(tx, tx_logs, decoded_events))
+            if renv.tx_enricher is not None or (renv.args.token_metadata and renv.w3 is not None):
+                # Fetched for the whole block before rendering any of its events
+                await asyncio.get_running_loop().run_in_executor(None, _enrich_block, renv, decoded_logs)
+
+            for decoded_log in decoded_logs:
+                if render_stage is not None:
+                    await in_flight.put((decoded_log, render_stage.submit(decoded_log)))
+                    continue
+                for queue in processed_logs:
+                    await queue.put(decoded_log)
+            raw_logs.task_done()
+    finally:
+        if render_stage is not None:
+            forwarder.cancel()
 
 
 async def _websocket_loop(ws_url, do_stuff_fn):
@@ -259,19 +395,25 @@ async def _websocket_loop(ws_url, do_stuff_fn):
 
 def build_outputs(renv: RenderingEnv) -> List[OutputBase]:
     output_urls = renv.args.outputs or ["print://"]
-    return [OutputBase.build_output(output_url, renv) for output_url in output_urls]
+    outputs = [OutputBase.build_output(output_url, renv) for output_url in output_urls]
+    name_outputs(outputs)
+    share_render_cache(outputs, renv.args.render_cache_size)
+    return outputs
 
 
-def setup_outputs(renv: RenderingEnv) -> Tuple[List[asyncio.Queue], List[asyncio.Task]]:
-    outputs = build_outputs(renv)
+def setup_outputs(
+    renv: RenderingEnv, outputs: Optional[List[OutputBase]] = None
+) -> Tuple[List[asyncio.Queue], List[asyncio.Task]]:
+    if outputs is None:
+        outputs = build_outputs(renv)
 
     output_queues = []
     workers = []
 
     for output in outputs:
-        output_queue: asyncio.Queue[DecodedTxLogs] = asyncio.Queue()
+        output_queue: asyncio.Queue[DecodedTxLogs] = output.build_queue()
         output_queues.append(output_queue)
-        workers.append(output.run(output_queue))
+        workers.append(output.run_workers(output_queue))
 
     return output_queues, workers
 
@@ -295,14 +437,40 @@ async def listen_events(args):
     subscriptions_file = yaml.load(open(args.subscriptions), yaml.SafeLoader)
     ab = address_book.get_default()
     subscriptions = load_subscriptions(subscriptions_file.get("subscriptions", subscriptions_file.get("hooks", {})), ab)
+    outputs = build_outputs(renv)
+    subscriptions, subscription_plan = _plan_subscriptions(renv, outputs, subscriptions)
     subscriptions = list(subscriptions)
 
-    raw_logs = asyncio.Queue()
-    output_queues, output_workers = setup_outputs(renv)
+    # Bounded to apply backpressure to the listener when the decoding falls behind
+    raw_logs = queues.MeteredQueue("raw_logs", args.raw_logs_queue_size)
+    output_queues, output_workers = setup_outputs(renv, outputs)
+
+    parse_worker = parse_raw_events(renv, raw_logs, output_queues, build_render_stage(renv, outputs))
+    listen_worker = _websocket_loop(
+        ws_url, lambda w3: _do_listen_events(w3, block_tree, renv, subscriptions, raw_logs, subscription_plan)
+    )
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    await asyncio.gather(listen_worker, parse_worker, metrics.monitor_loop_lag(), *output_workers)
 
-    parse_worker = parse_raw_events(renv, raw_logs, output_queues)
-    listen_worker = _websocket_loop(ws_url, lambda w3: _do_listen_events(w3, block_tree, renv, subscriptions, raw_logs))
-    await asyncio.gather(listen_worker, parse_worker, *output_workers)
+
+def _plan_subscriptions(
+    renv: RenderingEnv, outputs: List[OutputBase], subscriptions: Iterable
+) -> Tuple[Iterable, Optional[SubscriptionPlan]]:
+    """Applies the --subscriptions-planner mode.
+
+    Returns the subscriptions to use and the plan to report about (only in report mode)
+    """
+    mode = renv.args.subscriptions_planner
+    if mode == "off":
+        return subscriptions, None
+    if not all(output.uses_template_rules for output in outputs):
+        _logger.warning("Subscription planner disabled, some of the outputs don't use the template rules")
+        return subscriptions, None
+    plan = SubscriptionPlan.from_rules(itertools.chain.from_iterable(output.template_rules for output in outputs))
+    if mode == "apply":
+        return plan_subscriptions(subscriptions, plan), None
+    return subscriptions, plan
 
 
 def _block_to_int(w3: Web3, block: str) -> int:
@@ -355,6 +523,7 @@ def render_events(renv: RenderingEnv, input: str):
       int: Number of events found
     """
     outputs = build_outputs(renv)
+    subscription_plan = None
 
     if renv.args.subscriptions_resume_file:
         resume = ResumeFile(renv.args.subscriptions_resume_file)
@@ -370,6 +539,7 @@ def render_events(renv: RenderingEnv, input: str):
         subscriptions = load_subscriptions(
             subscriptions_file.get("subscriptions", subscriptions_file.get("hooks", {})), ab
         )
+        subscriptions, subscription_plan = _plan_subscriptions(renv, outputs, subscriptions)
         block_from = _block_to_int(renv.w3, renv.args.subscriptions_block_from)
         if resume is not None:
             block_from = resume.get(block_from)
@@ -385,6 +555,8 @@ def render_events(renv: RenderingEnv, input: str):
                 for sub in subscriptions
             )
         )
+        if subscription_plan is not None:
+            decoded_tx_logs = subscription_plan.observe_tx_logs(decoded_tx_logs)
     elif input.startswith("0x") and len(input) == 66:
         if renv.w3 is None:
             raise argparse.ArgumentTypeError("Missing --rpc-url parameter")
@@ -410,11 +582,65 @@ def render_events(renv: RenderingEnv, input: str):
     else:
         raise argparse.ArgumentTypeError(f"Unknown input '{input}'")
 
-    for output in outputs:
-        if resume is None:
-            output.run_sync(decoded_tx_logs)
-        else:
-            output.run_sync(resume.wrap(decoded_tx_logs))
+    if renv.tx_enricher is not None:
+        decoded_tx_logs = enrich_by_block(renv.tx_enricher, decoded_tx_logs)
+    if renv.args.token_metadata and renv.w3 is not None:
+        decoded_tx_logs = token_metadata.prefetch_by_block(
+            token_metadata.get_default(), renv.w3, renv.chain.id, decoded_tx_logs
+        )
+
+    render_stage = build_render_stage(renv, outputs)
+    if render_stage is not None:
+        decoded_tx_logs = render_stage.render(decoded_tx_logs)
+
+    # The input is read once, each chunk goes to all the outputs before reading the next one. With a shared render
+    # cache, the chunks fit in it, so each event is rendered once for all the outputs
+    render_cache = next((output.render_cache for output in outputs if output.render_cache is not None), None)
+    last_block = None
+    for chunk in _block_chunks(decoded_tx_logs, max_events=render_cache.maxsize if render_cache else None):
+        block = chunk[0].tx.block.number
+        if resume is not None and last_block is not None and block != last_block:
+            resume.set(last_block)
+        for output in outputs:
+            output.run_sync(chunk)
+        if render_cache is not None:
+            render_cache.clear()
+        last_block = block
+    if resume is not None and last_block is not None:
+        resume.set(last_block)
+
+    if render_stage is not None:
+        render_stage.close()
+    if renv.args.token_metadata:
+        _save_token_metadata(renv.args)
+
+    if subscription_plan is not None:
+        _logger.info(subscription_plan.summary())
+    if renv.args.profile_rules:
+        print(format_rules_profile(renv.template_rules), file=sys.stderr)
+
+
+def _block_chunks(
+    decoded_tx_logs: Iterable[DecodedTxLogs], max_txs: int = 100, max_events: Optional[int] = None
+) -> Iterator[List[DecodedTxLogs]]:
+    """Groups the transactions in lists of the same block, with at most `max_txs` transactions and `max_events`
+    events (unless a single transaction has more)"""
+    chunk: List[DecodedTxLogs] = []
+    events = 0
+    for tx_logs in decoded_tx_logs:
+        tx_events = len(tx_logs.raw_logs)
+        if chunk and (
+            len(chunk) >= max_txs
+            or (max_events and events + tx_events > max_events)
+            or chunk[0].tx.block.number != tx_logs.tx.block.number
+        ):
+            yield chunk
+            chunk = []
+            events = 0
+        chunk.append(tx_logs)
+        events += tx_events
+    if chunk:
+        yield chunk
 
 
 class ResumeFile:
@@ -431,14 +657,6 @@ class ResumeFile:
         with open(self.filename, "w") as f:
             f.write(f"{block_number + 1}\n")
 
-    def wrap(self, logs: Iterable[DecodedTxLogs]) -> Iterator[DecodedTxLogs]:
-        last_block = None
-        for log in logs:
-            yield log
-            if log.tx.block.number != last_block:
-                self.set(log.tx.block.number)
-            last_block = log.tx.block.number
-
 
 # ---- CLI ----
 # The functions defined in this section are wrappers around the main Python
@@ -534,6 +752,45 @@ def parse_args(args):
         help="JSON file with mapping of hashes (b32 to name or name to b32 or list of names)",
         default=os.environ.get("BYTES32_RAINBOW"),
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory to cache the data derived from the input files (like the processed --bytes32-rainbow)",
+        default=os.environ.get("CACHE_DIR"),
+    )
+    parser.add_argument(
+        "--tx-enrichment",
+        type=str,
+        choices=["off", "batch", "block"],
+        help="Fetch the transaction details (evt.tx.details: from_, to, value, gas...) of each block with a batch "
+        "of eth_getTransactionByHash or with one eth_getBlockByHash with full transactions",
+        default=os.environ.get("TX_ENRICHMENT", "off"),
+    )
+    parser.add_argument(
+        "--token-metadata",
+        action="store_true",
+        help="Fetch the decimals and symbol of the tokens (for the token_amount and token_symbol filters), stored "
+        "in --cache-dir",
+        default=os.environ.get("TOKEN_METADATA", "").lower() in ("true", "1"),
+    )
+    parser.add_argument(
+        "--templates-cache-dir",
+        type=str,
+        help="Directory to store the compiled templates, shared between processes",
+        default=os.environ.get("TEMPLATES_CACHE_DIR"),
+    )
+    parser.add_argument(
+        "--templates-auto-reload",
+        action="store_true",
+        help="Check the template files for changes on each render (by default they are loaded once)",
+        default=os.environ.get("TEMPLATES_AUTO_RELOAD", "").lower() in ("true", "1"),
+    )
+    parser.add_argument(
+        "--precompile-templates",
+        action="store_true",
+        help="Compile the templates used by the rules at startup, instead of on the first render",
+        default=os.environ.get("PRECOMPILE_TEMPLATES", "").lower() in ("true", "1"),
+    )
     parser.add_argument(
         "--template-rules",
         metavar="<template_rules>",
@@ -555,6 +812,59 @@ def parse_args(args):
         default=os.environ.get("ON_ERROR_TEMPLATE"),
     )
 
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        help="Number of workers rendering the events before sending them to the outputs (0 renders in the outputs)",
+        default=_env_int("RENDER_WORKERS", 0),
+    )
+    parser.add_argument(
+        "--render-pool",
+        type=str,
+        choices=["process", "thread"],
+        help="Kind of workers of the render stage",
+        default=os.environ.get("RENDER_POOL", "process"),
+    )
+    parser.add_argument(
+        "--render-budget-ms",
+        type=int,
+        help="Time budget of each render, the ones that exceed it use --on-error-template instead (0 disables it)",
+        default=_env_int("RENDER_BUDGET_MS", 0),
+    )
+    parser.add_argument(
+        "--render-quarantine-after",
+        type=int,
+        help="Consecutive budget overruns after which the template is quarantined (replaced by the fallback)",
+        default=_env_int("RENDER_QUARANTINE_AFTER", 3),
+    )
+    parser.add_argument(
+        "--render-quarantine-seconds",
+        type=int,
+        help="Time the templates that overrun the render budget stay quarantined",
+        default=_env_int("RENDER_QUARANTINE_SECONDS", 300),
+    )
+    parser.add_argument(
+        "--render-cache-size",
+        type=int,
+        help="Rendered events kept to reuse them between outputs that render the same template (0 disables it)",
+        default=_env_int("RENDER_CACHE_SIZE", 1024),
+    )
+    parser.add_argument(
+        "--profile-rules",
+        action="store_true",
+        help="Record evaluations, matches and time of each template rule (dumped by render_events, exposed in "
+        "the /metrics endpoint)",
+        default=os.environ.get("PROFILE_RULES", "").lower() in ("true", "1"),
+    )
+    parser.add_argument(
+        "--subscriptions-planner",
+        type=str,
+        choices=["off", "report", "apply"],
+        help="Narrow the log subscriptions to the events the template rules can match (apply), or just log how "
+        "many logs would be skipped (report)",
+        default=os.environ.get("SUBSCRIPTIONS_PLANNER", "off"),
+    )
+
     subparsers = parser.add_subparsers(dest="command", required=True, help="sub-command to run")
 
     load_events = subparsers.add_parser("load_events")
@@ -644,6 +954,18 @@ def parse_args(args):
         help="Yaml file with the address and topics to subscribe to",
         default=os.environ.get("SUBSCRIPTIONS"),
     )
+    listen_events.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Port to serve the metrics (at /metrics), including the event loop lag",
+        default=_env_int("METRICS_PORT", 0),
+    )
+    listen_events.add_argument(
+        "--raw-logs-queue-size",
+        type=int,
+        help="Maximum number of blocks waiting to be decoded, the listener waits when full (0 = unbounded)",
+        default=_env_int("RAW_LOGS_QUEUE_SIZE", 1000),
+    )
     listen_events.add_argument(
         "outputs",
         type=str,
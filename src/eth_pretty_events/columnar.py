@@ -0,0 +1,186 @@
+"""Columnar batches of decoded events, for bulk consumers (analytics outputs, aggregations)"""
+
+import re
+from dataclasses import dataclass, field
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+import numpy as np
+from eth_typing import ABIComponent
+
+from .outputs import DecodedTxLogs
+from .types import Address, ArgsTuple, Event
+
+INT_TYPE_REGEX = re.compile(r"(u?)int(\d+)$")
+
+
+@dataclass
+class AddressColumn:
+    """Interned column of addresses: each row is an index (`codes`) into the unique `values`"""
+
+    codes: np.ndarray
+    values: List[Address]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> Address:
+        return self.values[self.codes[i]]
+
+    def to_list(self) -> List[Address]:
+        return [self.values[code] for code in self.codes]
+
+    def mask(self, address: str) -> np.ndarray:
+        """Returns a boolean array that is True for the rows equal to `address`"""
+        try:
+            code = self.values.index(address)
+        except ValueError:
+            return np.zeros(len(self.codes), dtype=np.bool_)
+        return self.codes == code
+
+
+Column = Union[np.ndarray, AddressColumn]
+
+
+@dataclass
+class EventBatch:
+    """A batch of events of the same type (same name and ABI), stored by columns.
+
+    Struct arguments are flattened using dotted names (e.g. `policy.payout`), the same paths used by the `arg`
+    filters.
+    """
+
+    name: str
+    components: Sequence[ABIComponent]
+    block_number: np.ndarray
+    tx_index: np.ndarray
+    log_index: np.ndarray
+    tx_hash: np.ndarray
+    address: AddressColumn
+    args: Dict[str, Column]
+
+    def __len__(self) -> int:
+        return len(self.log_index)
+
+
+def _int_dtype(type_: str) -> Optional[np.dtype]:
+    match = INT_TYPE_REGEX.match(type_)
+    if match is None:
+        return None
+    bits = int(match.group(2))
+    for width in (8, 16, 32, 64):
+        if bits <= width:
+            return np.dtype(f"{match.group(1)}int{width}")
+    return None
+
+
+def _int_column(type_: str, values: list) -> np.ndarray:
+    dtype = _int_dtype(type_)
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    # Wider than 64 bits (uint256 and friends): use a fixed width type if all the values fit, otherwise keep
+    # the python ints in an object array to avoid overflows
+    dtype = np.dtype("uint64") if type_.startswith("uint") else np.dtype("int64")
+    info = np.iinfo(dtype)
+    if info.min <= min(values) and max(values) <= info.max:
+        return np.array(values, dtype=dtype)
+    return np.array(values, dtype=object)
+
+
+def _address_column(values: list) -> AddressColumn:
+    interned: Dict[str, int] = {}
+    codes = np.fromiter((interned.setdefault(value, len(interned)) for value in values), dtype=np.int32)
+    return AddressColumn(codes=codes, values=list(interned))
+
+
+def _object_column(values: list) -> np.ndarray:
+    ret = np.empty(len(values), dtype=object)
+    ret[:] = values
+    return ret
+
+
+def _build_column(type_: str, values: list) -> Column:
+    if type_ == "address":
+        return _address_column(values)
+    if type_ == "bool":
+        return np.array(values, dtype=np.bool_)
+    if INT_TYPE_REGEX.match(type_):
+        return _int_column(type_, values)
+    return _object_column(values)
+
+
+def _flat_components(components: Sequence[ABIComponent], prefix: str = "") -> Iterator[Tuple[str, str]]:
+    for component in components:
+        name = prefix + component["name"]
+        if component["type"] == "tuple":
+            yield from _flat_components(component["components"], name + ".")
+        else:
+            yield name, component["type"]
+
+
+@dataclass
+class _BatchBuilder:
+    name: str
+    components: Sequence[ABIComponent]
+    paths: List[Tuple[str, str]]
+    rows: List[Event] = field(default_factory=list)
+
+    @classmethod
+    def for_args(cls, name: str, args_type: Type[ArgsTuple]) -> "_BatchBuilder":
+        components = args_type._components
+        return cls(name=name, components=components, paths=list(_flat_components(components)))
+
+    def build(self) -> EventBatch:
+        args_values: Dict[str, list] = {path: [] for path, _ in self.paths}
+        split_paths = [(path, path.split(".")) for path, _ in self.paths]
+        for evt in self.rows:
+            for path, steps in split_paths:
+                value = evt.args[steps[0]]
+                for step in steps[1:]:
+                    value = value[step]
+                args_values[path].append(value)
+
+        return EventBatch(
+            name=self.name,
+            components=self.components,
+            block_number=np.fromiter((evt.tx.block.number for evt in self.rows), dtype=np.int64),
+            tx_index=np.fromiter((evt.tx.index for evt in self.rows), dtype=np.int32),
+            log_index=np.fromiter((evt.log_index for evt in self.rows), dtype=np.int32),
+            tx_hash=_object_column([evt.tx.hash for evt in self.rows]),
+            address=_address_column([evt.address for evt in self.rows]),
+            args={path: _build_column(type_, args_values[path]) for path, type_ in self.paths},
+        )
+
+
+def to_columnar(decoded_tx_logs: Iterable[DecodedTxLogs], batch_size: int = 10000) -> Iterator[EventBatch]:
+    """Groups the decoded events by type and yields them as columnar batches of at most `batch_size` rows.
+
+    A batch is yielded as soon as it's full, the remaining ones are yielded at the end. Unrecognized logs
+    (decoded as None) are skipped.
+    """
+    builders: Dict[Tuple[str, type], _BatchBuilder] = {}
+    for tx_logs in decoded_tx_logs:
+        for evt in tx_logs.decoded_logs:
+            if evt is None:
+                continue
+            key = (evt.name, type(evt.args))
+            builder = builders.get(key)
+            if builder is None:
+                builder = builders[key] = _BatchBuilder.for_args(evt.name, type(evt.args))
+            builder.rows.append(evt)
+            if len(builder.rows) >= batch_size:
+                yield builder.build()
+                builder.rows = []
+
+    for builder in builders.values():
+        if builder.rows:
+            yield builder.build()
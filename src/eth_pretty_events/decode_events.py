@@ -41,11 +41,11 @@ def decode_events_from_tx(tx_hash: str, w3: Web3, chain: Chain) -> DecodedTxLogs
     receipt = w3.eth.get_transaction_receipt(tx_hash)
     block = Block(
         chain=chain,
-        hash=Hash(receipt.blockHash),
+        hash=Hash.from_bytes32(receipt.blockHash),
         number=receipt.blockNumber,
         timestamp=w3.eth.get_block(receipt.blockNumber).timestamp,
     )
-    tx = Tx(block=block, hash=Hash(receipt.transactionHash), index=receipt.transactionIndex)
+    tx = Tx(block=block, hash=Hash.from_bytes32(receipt.transactionHash), index=receipt.transactionIndex)
     return DecodedTxLogs(
         tx=tx, raw_logs=receipt.logs, decoded_logs=decode_events_from_raw_logs(block, tx, receipt.logs)
     )
@@ -57,10 +57,12 @@ def decode_events_from_raw_logs(block: Block, tx: Tx, logs: Sequence[web3types.L
 
 def decode_events_from_block(block_number: int, w3: Web3, chain: Chain) -> Iterable[DecodedTxLogs]:
     w3_block = w3.eth.get_block(block_number)
-    block = Block(chain=chain, number=block_number, timestamp=w3_block["timestamp"], hash=Hash(w3_block["hash"]))
+    block = Block(
+        chain=chain, number=block_number, timestamp=w3_block["timestamp"], hash=Hash.from_bytes32(w3_block["hash"])
+    )
 
     for w3_tx in w3_block.transactions:
-        tx_hash = Hash(w3_tx)
+        tx_hash = Hash.from_bytes32(w3_tx)
         receipt = w3.eth.get_transaction_receipt(w3_tx)
         tx = Tx(block=block, hash=tx_hash, index=receipt.transactionIndex)
         yield DecodedTxLogs(
@@ -88,12 +90,12 @@ def fetch_logs(w3, chain: Chain, log_filter: dict, block_from: int, block_to: in
     for (block_hash, block_number), logs_for_block in itertools.groupby(resp, itemgetter("blockHash", "blockNumber")):
         block = Block(
             chain=chain,
-            hash=Hash(block_hash),
+            hash=Hash.from_bytes32(block_hash),
             number=block_number,
             timestamp=w3.eth.get_block(block_number).timestamp,
         )
         for (tx_hash, tx_index), logs_for_tx in itertools.groupby(
             logs_for_block, itemgetter("transactionHash", "transactionIndex")
         ):
-            tx = Tx(block=block, hash=Hash(tx_hash), index=tx_index)
+            tx = Tx(block=block, hash=Hash.from_bytes32(tx_hash), index=tx_index)
             yield block, tx, list(logs_for_tx)
@@ -3,23 +3,25 @@ import json
 import logging
 import os
 import time
-from typing import Iterable, List
+from typing import Iterable, List, Optional
 from urllib.parse import ParseResult, parse_qs
 
 import aiohttp
 import requests
 
-from .event_filter import find_template
+from .event_filter import TemplateRuleSet, rules_for_tags
 from .outputs import DecodedTxLogs, OutputBase
-from .render import render
+from .render import RenderCache, render_rule
 
 _logger = logging.getLogger(__name__)
 
 
 @OutputBase.register("discord")
 class DiscordOutput(OutputBase):
+    uses_template_rules = True
+
     def __init__(self, url: ParseResult, renv):
-        super().__init__(url)
+        super().__init__(url, renv)
         # Read the discord_url from an environment variable in the hostname
         query_params = parse_qs(url.query)
         if "from_env" in query_params:
@@ -30,7 +32,6 @@ class DiscordOutput(OutputBase):
         if discord_url is None:
             raise RuntimeError(f"Must define the Discord URL in {env_var} env variable")
         self.discord_url = discord_url
-        self.renv = renv
 
         self.max_attempts = int(query_params.get("max_attempts", [3])[0])
         self.retry_time = float(query_params.get("retry_time", [5])[0])
@@ -40,7 +41,20 @@ class DiscordOutput(OutputBase):
             session = session
             while True:
                 log = await queue.get()
-                messages = build_transaction_messages(self.renv, log.tx, log.decoded_logs, log.raw_logs, self.tags)
+                # Rendered outside of the event loop
+                messages = await self.offload(
+                    lambda: list(
+                        build_transaction_messages(
+                            self.renv,
+                            log.tx,
+                            log.decoded_logs,
+                            log.raw_logs,
+                            template_rules=self.template_rules,
+                            rendered=log.rendered,
+                            render_cache=self.render_cache,
+                        )
+                    )
+                )
                 for message in messages:
                     for attempt in range(self.max_attempts):
                         async with session.post(self.discord_url, json=message) as response:
@@ -67,7 +81,15 @@ class DiscordOutput(OutputBase):
     def run_sync(self, logs: Iterable[DecodedTxLogs]):
         session = requests.Session()
         for log in logs:
-            messages = build_transaction_messages(self.renv, log.tx, log.decoded_logs, log.raw_logs, self.tags)
+            messages = build_transaction_messages(
+                self.renv,
+                log.tx,
+                log.decoded_logs,
+                log.raw_logs,
+                template_rules=self.template_rules,
+                rendered=log.rendered,
+                render_cache=self.render_cache,
+            )
             for message in messages:
                 for attempt in range(self.max_attempts):
                     response = session.post(self.discord_url, json=message)
@@ -94,13 +116,20 @@ class DiscordOutput(OutputBase):
         raise NotImplementedError()  # Shouldn't be called
 
 
-def build_transaction_messages(renv, tx, tx_events, tx_raw_logs, tags: List[str] = None) -> Iterable[dict]:
+def build_transaction_messages(
+    renv,
+    tx,
+    tx_events,
+    tx_raw_logs,
+    tags: List[str] = None,
+    template_rules: Optional[TemplateRuleSet] = None,
+    rendered: Optional[dict] = None,
+    render_cache: Optional[RenderCache] = None,
+) -> Iterable[dict]:
     current_batch = []
     current_batch_size = 0
-    if tags is not None:
-        template_rules = [tr for tr in renv.template_rules if any(tag in tr.tags for tag in tags)]
-    else:
-        template_rules = renv.template_rules
+    if template_rules is None:
+        template_rules = rules_for_tags(renv.template_rules, tags)
     for event, raw_event in zip(tx_events, tx_raw_logs):
         if event is None:
             _logger.warning(
@@ -108,29 +137,27 @@ def build_transaction_messages(renv, tx, tx_events, tx_raw_logs, tags: List[str]
                 f"index: {raw_event.logIndex}, block: {tx.block.number}"
             )
             continue
-        template = find_template(template_rules, event)
-        if template is None:
-            continue
-        description = render(renv.jinja_env, event, [template, renv.args.on_error_template])
-        original_description_length = len(description)
-        if original_description_length > 4096:
-            description = description[
-                : 4096 - 100
-            ]  # Truncate description so it does not exceed 4096 Discord limit description.
-            _logger.info(
-                f"Truncated description for event in tx: {tx.hash}, index: {event.log_index} "
-                f"(original length: {original_description_length}, new length: {len(description)})"
-            )
-        embed = {"description": description}
-        embed_size = len(json.dumps(embed))
-
-        if current_batch_size + embed_size > 5000 or len(current_batch) == 9:
-            yield {"embeds": current_batch}
-            current_batch = []
-            current_batch_size = 0
-
-        current_batch.append(embed)
-        current_batch_size += embed_size
+        for rule in template_rules.find_all(event):
+            description = render_rule(renv.jinja_env, event, rule, renv.args.on_error_template, rendered, render_cache)
+            original_description_length = len(description)
+            if original_description_length > 4096:
+                description = description[
+                    : 4096 - 100
+                ]  # Truncate description so it does not exceed 4096 Discord limit description.
+                _logger.info(
+                    f"Truncated description for event in tx: {tx.hash}, index: {event.log_index} "
+                    f"(original length: {original_description_length}, new length: {len(description)})"
+                )
+            embed = {"description": description}
+            embed_size = len(json.dumps(embed))
+
+            if current_batch_size + embed_size > 5000 or len(current_batch) == 9:
+                yield {"embeds": current_batch}
+                current_batch = []
+                current_batch_size = 0
+
+            current_batch.append(embed)
+            current_batch_size += embed_size
 
     if current_batch:
         yield {"embeds": current_batch}
@@ -1,15 +1,31 @@
+import heapq
 import operator
 import re
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
 from collections.abc import Sequence
 from dataclasses import dataclass, field
 from decimal import Decimal
-from typing import Any, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 from eth_utils import keccak
 
+from eth_pretty_events import metrics
 from eth_pretty_events.address_book import get_default as get_addr_book
-from eth_pretty_events.types import Address, Event, Hash
+from eth_pretty_events.event_parser import EventDefinition
+from eth_pretty_events.types import Address, Bytes, Event, Hash
 
 
 class EventFilter(ABC):
@@ -19,6 +35,25 @@ class EventFilter(ABC):
     @abstractmethod
     def filter(self, evt: Event) -> bool: ...
 
+    def compile(self) -> Callable[[Event], bool]:
+        """Returns a function equivalent to `filter`, with the whole filter tree inlined in a single expression.
+
+        `filter` is kept as the interpreted version, useful for debugging.
+        """
+        namespace = {"get_addr_book": get_addr_book}
+        expr, _ = self._compile_expr(namespace)
+        return eval(f"lambda evt: {expr}", namespace)
+
+    def _compile_expr(self, namespace: dict) -> Tuple[str, bool]:
+        """Returns a python expression (on `evt`) equivalent to filter(evt) and if it always evaluates to a bool
+
+        The filters that can be inlined implement `_expr`. Subclasses that don't redefine it (and might redefine
+        `filter`) are called through their `filter` method.
+        """
+        if "_expr" in vars(type(self)):
+            return self._expr(namespace)
+        return f"{_constant(namespace, self.filter)}(evt)", False
+
     @classmethod
     def from_config(cls, config: dict) -> "EventFilter":
         if "filter_type" in config:
@@ -56,6 +91,16 @@ class EventFilter(ABC):
         return decorator
 
 
+def _constant(namespace: dict, value: Any) -> str:
+    name = f"_c{len(namespace)}"
+    namespace[name] = value
+    return name
+
+
+def _arg_expr(arg_path: Sequence[str]) -> str:
+    return "evt.args" + "".join(f"[{step!r}]" for step in arg_path)
+
+
 def _str_to_addr(value: str) -> Address:
     try:
         return Address(value)
@@ -120,6 +165,9 @@ class AddressEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return evt.address == self.value
 
+    def _expr(self, namespace):
+        return f"evt.address == {_constant(namespace, self.value)}", True
+
 
 @EventFilter.register("known_address")
 class InAddressBookEventFilter(EventFilter):
@@ -131,6 +179,9 @@ class InAddressBookEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return get_addr_book().has_addr(evt.address) == self.is_known
 
+    def _expr(self, namespace):
+        return f"get_addr_book().has_addr(evt.address) == {_constant(namespace, self.is_known)}", True
+
 
 @EventFilter.register("name")
 class NameEventFilter(EventFilter):
@@ -142,6 +193,9 @@ class NameEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return evt.name == self.value
 
+    def _expr(self, namespace):
+        return f"evt.name == {_constant(namespace, self.value)}", True
+
 
 @EventFilter.register("topic")
 class TopicEventFilter(EventFilter):
@@ -157,6 +211,9 @@ class TopicEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return evt.topic == self.value
 
+    def _expr(self, namespace):
+        return f"evt.topic == {_constant(namespace, self.value)}", True
+
 
 @EventFilter.register("arg")
 class ArgEventFilter(EventFilter):
@@ -168,16 +225,18 @@ class ArgEventFilter(EventFilter):
         "ge": operator.ge,
         "ne": operator.ne,
     }
+    OPERATOR_SYMBOLS = {"eq": "==", "lt": "<", "gt": ">", "le": "<=", "ge": ">=", "ne": "!="}
 
     def __init__(self, arg_name: str, arg_value: Any = None, operator: str = "eq", transform: str = None):
         self.arg_name = arg_name
+        self.arg_path = arg_name.split(".")
         self.arg_value = TRANSFORMS[transform](arg_value) if transform is not None else arg_value
+        self.operator_name = operator
         self.operator = self.OPERATORS[operator]
 
     def _get_arg(self, evt: Event):
-        arg_path = self.arg_name.split(".")
-        ret = evt.args[arg_path[0]]
-        for arg_step in arg_path[1:]:
+        ret = evt.args[self.arg_path[0]]
+        for arg_step in self.arg_path[1:]:
             ret = ret[arg_step]
         return ret
 
@@ -185,19 +244,23 @@ class ArgEventFilter(EventFilter):
         arg_value = self._get_arg(evt)
         return self.operator(arg_value, self.arg_value)
 
+    def _expr(self, namespace):
+        symbol = self.OPERATOR_SYMBOLS[self.operator_name]
+        return f"{_arg_expr(self.arg_path)} {symbol} {_constant(namespace, self.arg_value)}", True
+
 
 @EventFilter.register("arg_exists")
 class ArgExistsEventFilter(EventFilter):
     def __init__(self, arg_name: str):
         self.arg_name = arg_name
+        self.arg_path = arg_name.split(".")
 
     def _get_arg(self, evt: Event):
-        arg_path = self.arg_name.split(".")
         try:
-            ret = evt.args[arg_path[0]]
+            ret = evt.args[self.arg_path[0]]
         except KeyError:
             return None
-        for arg_step in arg_path[1:]:
+        for arg_step in self.arg_path[1:]:
             try:
                 ret = ret[arg_step]
             except KeyError:
@@ -207,12 +270,18 @@ class ArgExistsEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return self._get_arg(evt) is not None
 
+    def _expr(self, namespace):
+        return f"{_constant(namespace, self._get_arg)}(evt) is not None", True
+
 
 @EventFilter.register("known_address_arg")
 class InAddressBookArgEventFilter(ArgEventFilter):
     def filter(self, evt: Event) -> bool:
         return get_addr_book().has_addr(self._get_arg(evt)) == self.arg_value
 
+    def _expr(self, namespace):
+        return f"get_addr_book().has_addr({_arg_expr(self.arg_path)}) == {_constant(namespace, self.arg_value)}", True
+
 
 @EventFilter.register("not")
 class NotEventFilter(EventFilter):
@@ -224,6 +293,10 @@ class NotEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return not self.negated_filter.filter(evt)
 
+    def _expr(self, namespace):
+        expr, _ = self.negated_filter._compile_expr(namespace)
+        return f"not ({expr})", True
+
 
 @EventFilter.register("and")
 class AndEventFilter(EventFilter):
@@ -235,6 +308,141 @@ class AndEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return not any(f.filter(evt) is False for f in self.filters)
 
+    def _expr(self, namespace):
+        if not self.filters:
+            return "True", True
+        exprs = []
+        for f in self.filters:
+            expr, is_bool = f._compile_expr(namespace)
+            # Only an explicit False makes the AND fail
+            exprs.append(f"({expr})" if is_bool else f"(({expr}) is not False)")
+        return " and ".join(exprs), True
+
+
+class AdaptiveAndEventFilter(AndEventFilter):
+    """AndEventFilter that reorders its side-effect-free children using runtime statistics, so the cheapest and
+    most rejecting ones run first.
+
+    Every `sample_every` evaluations the pure children are all evaluated and timed, and every `reorder_every`
+    evaluations they are sorted by cost per rejection. Pure filters are never moved across impure ones (custom
+    filters), which keep being called as in config order. If an evaluation in the adapted order raises, the event
+    is evaluated again in config order, so the result is the same except for events where the config order
+    raises before reaching the rejecting filter. The sampled evaluations return the same as the unsampled ones.
+    """
+
+    def __init__(self, filters: Sequence[EventFilter], sample_every: int = 64, reorder_every: int = 1024):
+        super().__init__(filters)
+        self.sample_every = sample_every
+        self.reorder_every = reorder_every
+        self._compiled = [f.compile() for f in filters]
+        self._pure = [_is_pure(f) for f in filters]
+        self._config_order = self._order = tuple(range(len(filters)))
+        self._evaluations = 0
+        self._samples = [0] * len(filters)
+        self._rejections = [0] * len(filters)
+        self._cost = [0] * len(filters)
+
+    @property
+    def order(self) -> Sequence[EventFilter]:
+        """The children in the current evaluation order"""
+        return [self.filters[i] for i in self._order]
+
+    def filter(self, evt: Event) -> bool:
+        self._evaluations += 1
+        if self._evaluations % self.reorder_every == 0:
+            self._reorder()
+        if self._evaluations % self.sample_every == 0:
+            return self._sample(evt)
+        try:
+            for i in self._order:
+                if self._compiled[i](evt) is False:
+                    return False
+            return True
+        except Exception:
+            if self._order is self._config_order:
+                raise
+            return not any(f(evt) is False for f in self._compiled)
+
+    def _sample(self, evt: Event) -> bool:
+        outcomes: List[Any] = [None] * len(self._compiled)
+        for i, f in enumerate(self._compiled):
+            if not self._pure[i]:
+                continue
+            start = time.perf_counter_ns()
+            try:
+                outcomes[i] = f(evt) is not False
+            except Exception as err:
+                outcomes[i] = err
+            self._cost[i] += time.perf_counter_ns() - start
+            self._samples[i] += 1
+            if outcomes[i] is not True:
+                self._rejections[i] += 1
+
+        # Same result as the unsampled evaluation: replays the outcomes in the current order, falling back to the
+        # config order if it raises. The impure filters are called only if reached
+        try:
+            return self._replay(evt, outcomes, self._order)
+        except Exception:
+            if self._order is self._config_order:
+                raise
+            return self._replay(evt, outcomes, self._config_order)
+
+    def _replay(self, evt: Event, outcomes: List[Any], order: Sequence[int]) -> bool:
+        for i in order:
+            if outcomes[i] is None:
+                outcomes[i] = self._compiled[i](evt) is not False
+            if isinstance(outcomes[i], Exception):
+                raise outcomes[i]
+            if not outcomes[i]:
+                return False
+        return True
+
+    def _rank(self, i: int) -> float:
+        if not self._samples[i]:
+            return 0.0
+        reject_rate = self._rejections[i] / self._samples[i]
+        return (self._cost[i] / self._samples[i]) / max(reject_rate, 1e-6)
+
+    def _reorder(self):
+        order: List[int] = []
+        segment: List[int] = []
+        for i in self._config_order:
+            if self._pure[i]:
+                segment.append(i)
+                continue
+            order.extend(sorted(segment, key=self._rank))
+            order.append(i)
+            segment = []
+        order.extend(sorted(segment, key=self._rank))
+        if order != list(self._order):
+            self._order = tuple(order)
+        # Halves the statistics, to follow the changes in the event mix
+        self._samples = [n // 2 for n in self._samples]
+        self._rejections = [n // 2 for n in self._rejections]
+        self._cost = [n // 2 for n in self._cost]
+
+
+def _is_pure(event_filter: EventFilter) -> bool:
+    """The builtin filters (the ones that can be inlined) don't have side effects"""
+    if isinstance(event_filter, (AndEventFilter, OrEventFilter)):
+        return type(event_filter) in (AndEventFilter, OrEventFilter, AdaptiveAndEventFilter) and all(
+            _is_pure(f) for f in event_filter.filters
+        )
+    if type(event_filter) is NotEventFilter:
+        return _is_pure(event_filter.negated_filter)
+    return "_expr" in vars(type(event_filter))
+
+
+def make_adaptive(event_filter: EventFilter, **kwargs) -> EventFilter:
+    """Returns the filter with the AndEventFilter nodes replaced by AdaptiveAndEventFilter"""
+    if type(event_filter) is NotEventFilter:
+        return NotEventFilter(make_adaptive(event_filter.negated_filter, **kwargs))
+    if type(event_filter) is OrEventFilter:
+        return OrEventFilter([make_adaptive(f, **kwargs) for f in event_filter.filters])
+    if type(event_filter) is AndEventFilter and len(event_filter.filters) > 1:
+        return AdaptiveAndEventFilter([make_adaptive(f, **kwargs) for f in event_filter.filters], **kwargs)
+    return event_filter
+
 
 @EventFilter.register("or")
 class OrEventFilter(EventFilter):
@@ -246,23 +454,289 @@ class OrEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return any(f.filter(evt) for f in self.filters)
 
+    def _expr(self, namespace):
+        if not self.filters:
+            return "False", True
+        exprs = []
+        for f in self.filters:
+            expr, is_bool = f._compile_expr(namespace)
+            exprs.append(f"({expr})" if is_bool else f"bool({expr})")
+        return " or ".join(exprs), True
+
 
 @EventFilter.register("true")
 class TrueEventFilter(EventFilter):
     def filter(self, evt: Event) -> bool:
         return True
 
+    def _expr(self, namespace):
+        return "True", True
+
+
+@dataclass
+class RuleStats:
+    evaluations: int = 0
+    matches: int = 0
+    time_ns: int = 0
+    first_match_block: Optional[int] = None
+    last_match_block: Optional[int] = None
+
+    def record(self, evt: Event, matched: bool, elapsed_ns: int):
+        self.evaluations += 1
+        self.time_ns += elapsed_ns
+        if matched:
+            self.matches += 1
+            block = evt.tx.block.number
+            if self.first_match_block is None or block < self.first_match_block:
+                self.first_match_block = block
+            if self.last_match_block is None or block > self.last_match_block:
+                self.last_match_block = block
+
 
 @dataclass
 class TemplateRule:
     template: str
     match: EventFilter
     tags: List[str] = field(default_factory=list)
+    # If true, after matching this rule the following ones are also tried by find_all
+    continue_: bool = False
+    matches: Callable[[Event], bool] = field(init=False, repr=False, compare=False)
+    # Only when profiling, see TemplateRuleSet
+    stats: Optional[RuleStats] = field(default=None, init=False, repr=False, compare=False)
+    # The template and the on-error fallback, resolved by render.resolve_templates
+    resolved_templates: Optional[Tuple[Any, ...]] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.matches = self.match.compile()
+
+    def templates_to_render(self, on_error_template: Optional[str]) -> Sequence[Any]:
+        """The templates (resolved or names) to try, in order, when rendering with this rule"""
+        if self.resolved_templates is not None:
+            return self.resolved_templates
+        return [self.template, on_error_template]
 
 
-def read_template_rules(template_rules: dict) -> Sequence[TemplateRule]:
+def _topic_event_name(topic: Hash) -> Optional[str]:
+    try:
+        return EventDefinition.get_by_topic(topic).name
+    except KeyError:
+        return None
+
+
+def _required_discriminators(event_filter: EventFilter) -> Tuple[Optional[str], Optional[Address]]:
+    """Returns the event name and address an event must have to match the filter (None if not required)"""
+    filters = event_filter.filters if isinstance(event_filter, AndEventFilter) else [event_filter]
+    name = address = None
+    for f in filters:
+        if type(f) is NameEventFilter and name is None:
+            name = f.value
+        elif type(f) is TopicEventFilter and name is None:
+            # The topic is the hash of the signature, so it implies the event name
+            name = _topic_event_name(f.value)
+        elif type(f) is AddressEventFilter and address is None:
+            address = f.value
+    return name, address
+
+
+_MISSING = object()
+
+
+def _read_arg(args, path: Tuple[str, ...]):
+    try:
+        value = args[path[0]]
+        for step in path[1:]:
+            value = value[step]
+        return value
+    except Exception:
+        return _MISSING
+
+
+def _memo_value(value):
+    # The raw bytes, hashing Bytes would hex-encode them
+    return value._buffer.tobytes() if type(value) is Bytes else value
+
+
+def _read_arg_paths(event_filter: EventFilter) -> Optional[FrozenSet[Tuple[str, ...]]]:
+    """Returns the arg paths read by the filter, None for unknown filters that might read anything.
+
+    Besides those args, the builtin filters only read the name, the address and the topic of the event (that
+    depends on the name and the type of the args).
+    """
+    filter_type = type(event_filter)
+    if filter_type in (ArgEventFilter, ArgExistsEventFilter, InAddressBookArgEventFilter):
+        return frozenset([tuple(event_filter.arg_path)])
+    if filter_type in (AndEventFilter, AdaptiveAndEventFilter, OrEventFilter, NotEventFilter):
+        children = [event_filter.negated_filter] if filter_type is NotEventFilter else event_filter.filters
+        paths: FrozenSet[Tuple[str, ...]] = frozenset()
+        for child in children:
+            child_paths = _read_arg_paths(child)
+            if child_paths is None:
+                return None
+            paths |= child_paths
+        return paths
+    if filter_type in (
+        AddressEventFilter,
+        InAddressBookEventFilter,
+        NameEventFilter,
+        TopicEventFilter,
+        TrueEventFilter,
+    ):
+        return frozenset()
+    return None
+
+
+class TemplateRuleSet(Sequence):
+    """Ordered sequence of TemplateRule, indexed by the event name and address required by each rule.
+
+    Only the rules that can match a given event (by name, by address or with no discriminator at all) are
+    evaluated, keeping the first-match-wins order of the rules.
+
+    With `profile=True`, `find` records the evaluations, matches and time of each rule in `rule.stats`.
+
+    The results of `find` are memoized (LRU of `memo_size` entries) by the event shape (name, address and type of
+    the args) and the values of the args read by the candidate rules. It assumes the address book doesn't change
+    and it's disabled if any rule has custom filters.
+    """
+
+    def __init__(self, rules: Iterable[TemplateRule], profile: bool = False, memo_size: int = 4096):
+        self._rules: Tuple[TemplateRule, ...] = tuple(rules)
+        self.profile = profile
+        self.memo_size = memo_size
+        self._rule_paths = [_read_arg_paths(rule.match) for rule in self._rules]
+        self._memo: Optional[OrderedDict] = None
+        if memo_size and None not in self._rule_paths:
+            self._memo = OrderedDict()
+        self._shape_paths: Dict[tuple, Tuple[Tuple[str, ...], ...]] = {}
+        self._memo_lock = threading.Lock()
+        self._by_name: Dict[str, List[int]] = defaultdict(list)
+        self._by_address: Dict[Address, List[int]] = defaultdict(list)
+        self._fallback: List[int] = []
+        self._tagged: Dict[Tuple[str, ...], "TemplateRuleSet"] = {}
+        for i, rule in enumerate(self._rules):
+            if profile and rule.stats is None:
+                rule.stats = RuleStats()
+            name, address = _required_discriminators(rule.match)
+            if name is not None:
+                self._by_name[name].append(i)
+            elif address is not None:
+                self._by_address[address].append(i)
+            else:
+                self._fallback.append(i)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def __getitem__(self, index):
+        return self._rules[index]
+
+    def __repr__(self) -> str:
+        return f"TemplateRuleSet({list(self._rules)!r})"
+
+    def with_tags(self, tags: Optional[Sequence[str]]) -> "TemplateRuleSet":
+        """Returns the rules that have any of the tags (all the rules if tags is None).
+
+        The subsets are cached, the rule set is immutable so they never get stale.
+        """
+        if tags is None:
+            return self
+        key = tuple(tags)
+        ret = self._tagged.get(key)
+        if ret is None:
+            ret = self._tagged[key] = TemplateRuleSet(
+                (rule for rule in self._rules if any(tag in rule.tags for tag in tags)),
+                profile=self.profile,
+                memo_size=self.memo_size,
+            )
+        return ret
+
+    def candidates(self, event: Event) -> Iterator[TemplateRule]:
+        """Yields, in order, the rules that might match the event"""
+        return (self._rules[i] for i in self._candidate_indexes(event))
+
+    def _candidate_indexes(self, event: Event) -> Iterable[int]:
+        indexes = [
+            rule_indexes
+            for rule_indexes in (
+                self._by_name.get(event.name),
+                self._by_address.get(event.address),
+                self._fallback,
+            )
+            if rule_indexes
+        ]
+        if len(indexes) == 1:
+            return indexes[0]
+        return heapq.merge(*indexes)
+
+    def find(self, event: Event) -> Optional[TemplateRule]:
+        """Returns the first rule that matches the event"""
+        if self._memo is not None and not self.profile:
+            return self._find_memoized(event, self._find)
+        return self._find(event)
+
+    def find_all(self, event: Event) -> Tuple[TemplateRule, ...]:
+        """Returns the rules that match the event, in order, up to the first one without `continue_`"""
+        if self._memo is not None and not self.profile:
+            return self._find_memoized(event, self._find_all)
+        return self._find_all(event)
+
+    def _matching(self, event: Event) -> Iterator[TemplateRule]:
+        if self.profile:
+            for rule in self.candidates(event):
+                start = time.perf_counter_ns()
+                matched = rule.matches(event)
+                rule.stats.record(event, matched, time.perf_counter_ns() - start)
+                if matched:
+                    yield rule
+        else:
+            for rule in self.candidates(event):
+                if rule.matches(event):
+                    yield rule
+
+    def _find(self, event: Event) -> Optional[TemplateRule]:
+        return next(self._matching(event), None)
+
+    def _find_all(self, event: Event) -> Tuple[TemplateRule, ...]:
+        ret = []
+        for rule in self._matching(event):
+            ret.append(rule)
+            if not rule.continue_:
+                break
+        return tuple(ret)
+
+    def _find_memoized(self, event: Event, find_fn: Callable[[Event], Any]):
+        shape = (event.name, event.address, type(event.args))
+        paths = self._shape_paths.get(shape)
+        if paths is None:
+            if len(self._shape_paths) >= self.memo_size:
+                self._shape_paths.clear()
+            paths = self._shape_paths[shape] = tuple(
+                sorted(set().union(*(self._rule_paths[i] for i in self._candidate_indexes(event))))
+            )
+        key = (find_fn.__name__, shape, tuple(_memo_value(_read_arg(event.args, path)) for path in paths))
+        try:
+            with self._memo_lock:
+                ret = self._memo[key]
+                self._memo.move_to_end(key)
+            return ret
+        except KeyError:
+            pass
+        except TypeError:  # Unhashable arg values (arrays)
+            return find_fn(event)
+
+        ret = find_fn(event)
+        with self._memo_lock:
+            self._memo[key] = ret
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return ret
+
+
+def read_template_rules(template_rules: dict, profile: bool = False) -> TemplateRuleSet:
     rules = template_rules["rules"]
-    ret: Sequence[TemplateRule] = []
+    ret: List[TemplateRule] = []
+    # Opt-in: true or a dict with the AdaptiveAndEventFilter parameters
+    adaptive = template_rules.get("adaptive_filters", False)
+    memo_size = template_rules.get("memo_size", 4096)
 
     for rule in rules:
         filters = [EventFilter.from_config(f) for f in rule["match"]]
@@ -270,13 +744,94 @@ def read_template_rules(template_rules: dict) -> Sequence[TemplateRule]:
             filter = filters[0]
         else:
             filter = AndEventFilter(filters)
+        if adaptive:
+            filter = make_adaptive(filter, **(adaptive if isinstance(adaptive, dict) else {}))
         tags = rule.get("tags", [])
-        ret.append(TemplateRule(template=rule["template"], match=filter, tags=tags))
+        ret.append(
+            TemplateRule(template=rule["template"], match=filter, tags=tags, continue_=rule.get("continue", False))
+        )
+    return TemplateRuleSet(ret, profile=profile, memo_size=memo_size)
+
+
+def format_rules_profile(template_rules: Sequence[TemplateRule]) -> str:
+    """Formats the stats of the profiled rules as a table"""
+    header = ("#", "template", "evaluations", "matches", "match %", "total ms", "avg us", "first block", "last block")
+    rows = []
+    for i, rule in enumerate(template_rules):
+        stats = rule.stats or RuleStats()
+        rows.append(
+            (
+                str(i),
+                rule.template,
+                str(stats.evaluations),
+                str(stats.matches),
+                f"{100 * stats.matches / stats.evaluations:.1f}" if stats.evaluations else "-",
+                f"{stats.time_ns / 1e6:.3f}",
+                f"{stats.time_ns / 1e3 / stats.evaluations:.2f}" if stats.evaluations else "-",
+                str(stats.first_match_block) if stats.first_match_block is not None else "-",
+                str(stats.last_match_block) if stats.last_match_block is not None else "-",
+            )
+        )
+    widths = [max(len(row[col]) for row in [header] + rows) for col in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        # Left aligned template name, right aligned numbers
+        lines.append(
+            "  ".join(
+                value.ljust(width) if col == 1 else value.rjust(width)
+                for col, (value, width) in enumerate(zip(row, widths))
+            )
+        )
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def rules_profile_metrics(template_rules: Sequence[TemplateRule]) -> List[str]:
+    """Metrics collector (see metrics.add_collector) with the stats of the profiled rules"""
+    labelnames = ("rule", "template")
+    evaluations = metrics.Counter(
+        "eth_pretty_events_rule_evaluations_total", "Times the rule was evaluated", labelnames
+    )
+    matches = metrics.Counter("eth_pretty_events_rule_matches_total", "Times the rule matched", labelnames)
+    seconds = metrics.Counter(
+        "eth_pretty_events_rule_evaluation_seconds_total", "Time spent evaluating the rule", labelnames
+    )
+    first_block = metrics.Gauge("eth_pretty_events_rule_first_match_block", "First block matched", labelnames)
+    last_block = metrics.Gauge("eth_pretty_events_rule_last_match_block", "Last block matched", labelnames)
+    for i, rule in enumerate(template_rules):
+        if rule.stats is None:
+            continue
+        labels = {"rule": i, "template": rule.template}
+        evaluations.inc(rule.stats.evaluations, **labels)
+        matches.inc(rule.stats.matches, **labels)
+        seconds.inc(rule.stats.time_ns / 1e9, **labels)
+        if rule.stats.first_match_block is not None:
+            first_block.set(rule.stats.first_match_block, **labels)
+            last_block.set(rule.stats.last_match_block, **labels)
+    ret = []
+    for metric in (evaluations, matches, seconds, first_block, last_block):
+        ret.extend(metric.collect())
     return ret
 
 
+def rules_for_tags(template_rules: Sequence[TemplateRule], tags: Optional[Sequence[str]]) -> TemplateRuleSet:
+    if not isinstance(template_rules, TemplateRuleSet):
+        template_rules = TemplateRuleSet(template_rules)
+    return template_rules.with_tags(tags)
+
+
+def find_templates(template_rules: Sequence[TemplateRule], event: Event) -> List[str]:
+    """Returns all the templates for the event (see `TemplateRuleSet.find_all`)"""
+    if not isinstance(template_rules, TemplateRuleSet):
+        template_rules = TemplateRuleSet(template_rules, memo_size=0)
+    return [rule.template for rule in template_rules.find_all(event)]
+
+
 def find_template(template_rules: Sequence[TemplateRule], event: Event) -> Optional[str]:
+    if isinstance(template_rules, TemplateRuleSet):
+        rule = template_rules.find(event)
+        return rule.template if rule is not None else None
     for rule in template_rules:
-        if rule.match.filter(event):
+        if rule.matches(event):
             return rule.template
     return None
@@ -2,7 +2,7 @@ import json
 import logging
 import os
 from dataclasses import dataclass
-from typing import ClassVar, Dict, Optional, Sequence, Type
+from typing import ClassVar, Dict, List, Optional, Sequence, Type
 
 from eth_utils.abi import event_abi_to_log_topic
 from eth_utils.address import to_checksum_address
@@ -109,6 +109,10 @@ class EventDefinition:
     def get_by_topic(cls, topic: str) -> "EventDefinition":
         return cls._registry[topic]
 
+    @classmethod
+    def get_topics_by_name(cls, name: str) -> List[str]:
+        return [topic for topic, evt in cls._registry.items() if evt.name == name]
+
     @classmethod
     def from_abi(cls, abi):
         topic = add_0x_prefix(event_abi_to_log_topic(abi).hex())
@@ -1,7 +1,25 @@
+import logging
+from dataclasses import dataclass
+from typing import FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
 from eth_utils.crypto import keccak
+from web3 import types as web3types
 
+from .event_filter import (
+    AddressEventFilter,
+    AndEventFilter,
+    EventFilter,
+    NameEventFilter,
+    OrEventFilter,
+    TemplateRule,
+    TopicEventFilter,
+)
+from .event_parser import EventDefinition
+from .outputs import DecodedTxLogs
 from .types import Address, Hash
 
+_logger = logging.getLogger(__name__)
+
 
 class TopicTransforms:
     @classmethod
@@ -50,3 +68,138 @@ def load_subscriptions(subscriptions_config, address_book):
 
         topics = [TopicTransforms.do_transform(v, address_book) for v in filters.get("topics", [])]
         yield name, addresses, topics
+
+
+Subscription = Tuple[str, List[Address], list]
+Constraint = Tuple[Optional[FrozenSet[Hash]], Optional[FrozenSet[Address]]]
+
+
+def _intersect(a: Optional[FrozenSet], b: Optional[FrozenSet]) -> Optional[FrozenSet]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a & b
+
+
+def _union(a: Optional[FrozenSet], b: Optional[FrozenSet]) -> Optional[FrozenSet]:
+    if a is None or b is None:
+        return None
+    return a | b
+
+
+def filter_constraint(event_filter: EventFilter) -> Constraint:
+    """Returns the topic0 and address sets a log must belong to for matching the filter (None if unconstrained)"""
+    if type(event_filter) is NameEventFilter:
+        # The same name might have several signatures (overloaded events)
+        return frozenset(map(Hash, EventDefinition.get_topics_by_name(event_filter.value))), None
+    if type(event_filter) is TopicEventFilter:
+        return frozenset([event_filter.value]), None
+    if type(event_filter) is AddressEventFilter:
+        return None, frozenset([event_filter.value])
+    if isinstance(event_filter, AndEventFilter):
+        topics = addresses = None
+        for f in event_filter.filters:
+            f_topics, f_addresses = filter_constraint(f)
+            topics, addresses = _intersect(topics, f_topics), _intersect(addresses, f_addresses)
+        return topics, addresses
+    if type(event_filter) is OrEventFilter:
+        topics = addresses = frozenset()
+        for f in event_filter.filters:
+            f_topics, f_addresses = filter_constraint(f)
+            topics, addresses = _union(topics, f_topics), _union(addresses, f_addresses)
+        return topics, addresses
+    return None, None
+
+
+@dataclass
+class SubscriptionPlan:
+    """Topic0 and address sets of the logs that might match any of the template rules.
+
+    Since the node filters are an address list AND a topic0 list, the plan is the tightest filter of that shape
+    that includes all the rules, not the exact union of them.
+    """
+
+    topics: Optional[FrozenSet[Hash]]
+    addresses: Optional[FrozenSet[Address]]
+    seen: int = 0
+    skipped: int = 0
+
+    @classmethod
+    def from_rules(cls, template_rules: Iterable[TemplateRule]) -> "SubscriptionPlan":
+        topics: Optional[FrozenSet[Hash]] = frozenset()
+        addresses: Optional[FrozenSet[Address]] = frozenset()
+        for rule in template_rules:
+            rule_topics, rule_addresses = filter_constraint(rule.match)
+            topics, addresses = _union(topics, rule_topics), _union(addresses, rule_addresses)
+        return cls(topics=topics, addresses=addresses)
+
+    def narrow(self, subscription: Subscription) -> Optional[Subscription]:
+        """Returns the subscription restricted to the logs that might match the rules, None if none can match"""
+        name, addresses, topics = subscription
+        if self.topics == frozenset() or self.addresses == frozenset():
+            # Empty lists in the subscription mean "any", not "none"
+            _logger.warning(f"No template rule can match any log (unknown event names?), dropping {name}")
+            return None
+        if self.addresses is not None:
+            if addresses:
+                addresses = [address for address in addresses if address in self.addresses]
+                if not addresses:
+                    return None
+            else:
+                addresses = sorted(self.addresses)
+
+        if self.topics is not None:
+            topic0 = topics[0] if topics else None
+            if topic0 is None:
+                topic0 = sorted(self.topics)
+            else:
+                values = topic0 if isinstance(topic0, list) else [topic0]
+                try:
+                    values = [value for value in values if Hash(value) in self.topics]
+                except ValueError:
+                    # Not a hash (raw value in the config), can't reason about it
+                    values = topic0 if isinstance(topic0, list) else [topic0]
+                if not values:
+                    return None
+                topic0 = values if isinstance(topic0, list) else values[0]
+            topics = [topic0] + list(topics[1:])
+
+        return name, addresses, topics
+
+    def allows(self, raw_log: web3types.LogReceipt) -> bool:
+        if self.topics is not None and (not raw_log["topics"] or Hash(raw_log["topics"][0]) not in self.topics):
+            return False
+        if self.addresses is not None and Address(raw_log["address"]) not in self.addresses:
+            return False
+        return True
+
+    def observe(self, raw_logs: Iterable[web3types.LogReceipt]):
+        for raw_log in raw_logs:
+            self.seen += 1
+            if not self.allows(raw_log):
+                self.skipped += 1
+
+    def observe_tx_logs(self, decoded_tx_logs: Iterable[DecodedTxLogs]) -> Iterator[DecodedTxLogs]:
+        for tx_logs in decoded_tx_logs:
+            self.observe(tx_logs.raw_logs)
+            yield tx_logs
+
+    def summary(self) -> str:
+        ratio = self.skipped / self.seen if self.seen else 0
+        return (
+            f"Subscription plan: {self.skipped} of {self.seen} logs ({ratio:.1%}) can't match any template rule "
+            "and would be skipped by narrowing the subscriptions"
+        )
+
+
+def plan_subscriptions(subscriptions: Iterable[Subscription], plan: SubscriptionPlan) -> Iterator[Subscription]:
+    """Narrows the subscriptions using the plan, dropping the ones that can't match any rule"""
+    for subscription in subscriptions:
+        narrowed = plan.narrow(subscription)
+        if narrowed is None:
+            _logger.info(f"Subscription {subscription[0]} dropped, no template rule can match its logs")
+        else:
+            if narrowed != subscription:
+                _logger.info(f"Subscription {subscription[0]} narrowed to {narrowed[1:]}")
+            yield narrowed
@@ -7,8 +7,9 @@ from typing import List
 
 from flask import Flask, request
 
+from . import metrics
 from .decode_events import decode_events_from_tx, decode_from_alchemy_input
-from .outputs import OutputBase
+from .outputs import OutputBase, share_render_cache
 from .types import Hash
 
 app = Flask("eth-pretty-events")
@@ -42,7 +43,9 @@ def check_alchemy_signature(wrapped):
 
 def build_outputs(renv) -> List[OutputBase]:
     output_urls = renv.args.outputs or ["print://"]
-    return [OutputBase.build_output(output_url, renv) for output_url in output_urls]
+    outputs = [OutputBase.build_output(output_url, renv) for output_url in output_urls]
+    share_render_cache(outputs)
+    return outputs
 
 
 def send_to_outputs(outputs, decoded_tx_logs):
@@ -81,7 +84,8 @@ def alchemy_webhook():
     if os.environ.get("ALCHEMY_VERBOSE_MODE", "False").lower() in ("true", "1"):
         app.logger.info("Alchemy webhook: %s", json.dumps(request.json))
 
-    decoded_logs = decode_from_alchemy_input(payload, renv.chain)
+    # Materialized, all the outputs go through the same transactions
+    decoded_logs = list(decode_from_alchemy_input(payload, renv.chain))
     outputs = build_outputs(renv)
     ok_count, failed_count = send_to_outputs(outputs, decoded_logs)
     # TODO: do we want to fail if any of the messages fails? Probably not as it will cause a flood of repeated messages
@@ -100,5 +104,10 @@ def render_tx(tx_hash: str):
     return {"status": "OK", "ok_count": ok_count, "failed_count": failed_count}
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
 if __name__ == "__main__":
     raise RuntimeError("This isn't prepared to be called as a module")
@@ -1,9 +1,12 @@
+import functools
 from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Dict
 
 from jinja2 import Environment, pass_environment
 from web3.constants import ADDRESS_ZERO
 
+from . import token_metadata
 from .address_book import get_default as get_addr_book
 from .types import ABITupleMixin, Address, Hash
 
@@ -36,8 +39,16 @@ def unhash(env, value: Hash):
     return value
 
 
+def explorer_urls(chains: dict) -> Dict[int, str]:
+    """Base URL of the (first) explorer of each chain"""
+    return {chain_id: (chain.get("explorers") or [{"url": ""}])[0]["url"] for chain_id, chain in chains.items()}
+
+
 def _explorer_url(env):
     chain_id = env.globals["chain_id"]
+    urls = env.globals.get("explorer_urls")
+    if urls is not None and chain_id in urls:
+        return urls[chain_id]
     try:
         chain = env.globals["chains"][chain_id]
     except KeyError:
@@ -78,15 +89,17 @@ def block_link(env, value: int):
     return f"[{value}]({link})"
 
 
+def _address_link(address: Address, address_text: str, url: str):
+    if address_text == ADDRESS_ZERO:
+        return f"[{address_text}]"
+    return f"[{address_text}]({url}/address/{address})"
+
+
 @pass_environment
 def address_link(env, address: Address):
     if address == ADDRESS_ZERO:
         return "0x0"
-    address_text = _address(address)
-    if address_text == ADDRESS_ZERO:
-        return f"[{address_text}]"
-    link = address_explorer_link(env, address)
-    return f"[{address_text}]({link})"
+    return _address_link(address, _address(address), _explorer_url(env))
 
 
 def is_struct(value):
@@ -101,7 +114,7 @@ def autoformat_arg(env, arg_value, arg_abi):
     field_name = arg_abi.get("name", "")
 
     if arg_abi["type"] == "address":
-        return address_link(env, arg_value)
+        return env.filters.get("address_link", address_link)(env, arg_value)
     if arg_abi["type"] == "bytes32" and field_name == "role":
         return role(env, arg_value)
     if arg_abi["type"] == "bytes32":
@@ -135,6 +148,23 @@ def amount(value, decimals="auto"):
     return str(Decimal(value) / Decimal(10**decimals))
 
 
+@pass_environment
+def token_amount(env, value, token: Address):
+    """Formats the amount with the decimals of the token (see token_metadata), guessing them if unknown"""
+    metadata = token_metadata.get_default().get(env.globals["chain_id"], token)
+    if metadata is None or metadata.decimals is None:
+        return amount(value)
+    return amount(value, metadata.decimals)
+
+
+@pass_environment
+def token_symbol(env, token: Address):
+    metadata = token_metadata.get_default().get(env.globals["chain_id"], token)
+    if metadata is None or not metadata.symbol:
+        return _address(token)
+    return metadata.symbol
+
+
 def add_filters(env: Environment):
     for fn in [
         amount,
@@ -150,10 +180,57 @@ def add_filters(env: Environment):
         tx_explorer_link,
         block_explorer_link,
         address_explorer_link,
+        token_amount,
+        token_symbol,
     ]:
         env.filters[fn.__name__] = fn
 
 
+def bind_link_filters(env: Environment, address_cache_size: int = 4096):
+    """Replaces the link filters with versions bound to the explorer URL of the environment chain, resolved once.
+
+    The `address_link` results are cached by address (and address book, as the names don't change unless the
+    default address book is replaced).
+    """
+    try:
+        url = _explorer_url(env)
+    except (KeyError, RuntimeError):
+        return  # Keeps the generic filters, that fail when rendering
+
+    @pass_environment
+    def tx_explorer_link(env, value: Hash):
+        return f"{url}/tx/{value}"
+
+    @pass_environment
+    def block_explorer_link(env, value: int):
+        return f"{url}/block/{value}"
+
+    @pass_environment
+    def address_explorer_link(env, address: Address):
+        return f"{url}/address/{address}"
+
+    @pass_environment
+    def tx_link(env, value: Hash):
+        return f"[{value}]({url}/tx/{value})"
+
+    @pass_environment
+    def block_link(env, value: int):
+        return f"[{value}]({url}/block/{value})"
+
+    @functools.lru_cache(maxsize=address_cache_size)
+    def cached_address_link(addr_book, address: Address):
+        if address == ADDRESS_ZERO:
+            return "0x0"
+        return _address_link(address, addr_book.addr_to_name(address), url)
+
+    @pass_environment
+    def address_link(env, address: Address):
+        return cached_address_link(get_addr_book(), address)
+
+    for fn in [tx_explorer_link, block_explorer_link, address_explorer_link, tx_link, block_link, address_link]:
+        env.filters[fn.__name__] = fn
+
+
 def add_tests(env: Environment):
     for test_name, fn in {"struct": is_struct}.items():
         env.tests[test_name] = fn
@@ -0,0 +1,160 @@
+"""Minimal in-process metrics, exposed in the Prometheus text format"""
+
+import asyncio
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+_logger = logging.getLogger(__name__)
+
+
+def _format_labels(names: Sequence[str], values: LabelValues) -> str:
+    if not names:
+        return ""
+    labels = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + labels + "}"
+
+
+class Metric:
+    type_: str
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        super().inc(amount, **labels)
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, class_, name: str, help: str, labelnames: Sequence[str]):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = class_(name, help, labelnames)
+            elif type(metric) is not class_ or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered as {metric.type_} {metric.labelnames}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]):
+        """Adds a function that returns metric lines (in text format) computed at scrape time"""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[str]]):
+        self._collectors.remove(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        for collector in list(self._collectors):
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+add_collector = REGISTRY.add_collector
+remove_collector = REGISTRY.remove_collector
+render = REGISTRY.render
+
+
+async def monitor_loop_lag(interval: float = 0.5, warn_threshold: float = 1.0):
+    """Measures how late the event loop wakes up from a sleep, that is the time it was blocked"""
+    lag = gauge("eth_pretty_events_event_loop_lag_seconds", "Delay of the last event loop wake up")
+    max_lag = gauge("eth_pretty_events_event_loop_lag_max_seconds", "Max delay of the event loop wake ups")
+    total_lag = counter("eth_pretty_events_event_loop_lag_seconds_total", "Accumulated delay of the event loop")
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        delay = max(loop.time() - start - interval, 0)
+        lag.set(delay)
+        total_lag.inc(delay)
+        if delay > max_lag.get():
+            max_lag.set(delay)
+        if delay > warn_threshold:
+            _logger.warning(f"Event loop blocked for {delay:.3f} seconds")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+def start_http_server(port: int, host: str = "", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serves the metrics at /metrics from a daemon thread (for the commands without the flask app)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
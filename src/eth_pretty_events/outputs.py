@@ -1,12 +1,17 @@
 import asyncio
+import functools
 import pprint
 from abc import ABC, abstractmethod
+from collections import Counter
 from dataclasses import dataclass
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from urllib.parse import ParseResult, parse_qs, urlparse
 
 from web3 import types as web3types
 
+from . import queues
+from .event_filter import TemplateRuleSet, rules_for_tags
+from .render import RenderCache
 from .types import Event, Tx
 
 
@@ -15,31 +20,160 @@ class DecodedTxLogs:
     tx: Tx
     raw_logs: List[web3types.LogReceipt]
     decoded_logs: List[Optional[Event]]
+    # Rendered events by (log_index, template), filled by the render stage (see render_stage)
+    rendered: Optional[Dict[Tuple[int, str], str]] = None
+
+
+def _dump_tx_logs(log: DecodedTxLogs):
+    # The decoded events aren't picklable (ABI types), they are decoded again when loaded
+    return log.tx, log.raw_logs, log.rendered
+
+
+def _load_tx_logs(dumped) -> DecodedTxLogs:
+    from .decode_events import decode_events_from_raw_logs
+
+    tx, raw_logs, rendered = dumped
+    return DecodedTxLogs(tx, raw_logs, decode_events_from_raw_logs(tx.block, tx, raw_logs), rendered)
 
 
 class OutputBase(ABC):
     OUTPUT_REGISTRY = {}
+    # True if the output only sends the events that match its template rules
+    uses_template_rules = False
+    # Shared with the other outputs of the pipeline (see share_render_cache)
+    render_cache: Optional[RenderCache] = None
+    ORDERINGS = ("tx", "block", "key")
 
-    def __init__(self, url: ParseResult):
+    def __init__(self, url: ParseResult, renv=None):
         query_params = parse_qs(url.query)
         tags = query_params.get("tags", [None])[0]
         self.tags: Optional[List[str]] = [tag.strip() for tag in tags.split(",")] if tags else None
+        self.renv = renv
+        self._rules_source = None
+        self._template_rules: Optional[TemplateRuleSet] = None
+        # Batching of the async mode (see run), disabled with batch_max_items=1
+        self.batch_max_items = int(query_params.get("batch_max_items", [1])[0])
+        self.batch_max_bytes = int(query_params.get("batch_max_bytes", [0])[0])  # 0 = unlimited
+        self.batch_linger = float(query_params.get("batch_linger", [0])[0])
+        # Bound of the queue of the async mode (see build_queue), 0 = unbounded
+        self.type = url.scheme
+        self.name: Optional[str] = query_params.get("name", [None])[0]  # See name_outputs
+        self.max_queue = int(query_params.get("max_queue", [0])[0])
+        self.queue_policy = query_params.get("queue_policy", ["block"])[0]
+        self.spill_dir = query_params.get("spill_dir", [None])[0]
+        if self.queue_policy not in queues.POLICIES:
+            raise RuntimeError(f"Invalid queue_policy '{self.queue_policy}', must be one of {queues.POLICIES}")
+        # Concurrent consumers of the queue (see run_workers)
+        self.workers = int(query_params.get("workers", [1])[0])
+        self.ordering = query_params.get("ordering", ["tx"])[0]
+        if self.ordering not in self.ORDERINGS:
+            raise RuntimeError(f"Invalid ordering '{self.ordering}', must be one of {self.ORDERINGS}")
+
+    @property
+    def template_rules(self) -> TemplateRuleSet:
+        """The template rules of the rendering environment that apply to this output (filtered by tags).
+
+        Resolved once and rebuilt only if the rules of the rendering environment change.
+        """
+        rules = self.renv.template_rules
+        if rules is not self._rules_source:
+            self._template_rules = rules_for_tags(rules, self.tags)
+            self._rules_source = rules
+        return self._template_rules
+
+    def build_queue(self) -> asyncio.Queue:
+        """The queue that feeds `run`, bounded by max_queue, with the overflow policy queue_policy"""
+        return queues.build_queue(
+            self.name or self.type, self.max_queue, self.queue_policy, _dump_tx_logs, _load_tx_logs, self.spill_dir
+        )
+
+    async def run_workers(self, queue: asyncio.Queue[DecodedTxLogs]):
+        """Runs `workers` consumers of the queue. The events of a transaction are always sent in order (a
+        transaction is handled by one worker), the ordering between transactions depends on `ordering`:
+
+        - tx: none, any worker takes the next transaction.
+        - block: the transactions of the same block are sent in order.
+        - key: the transactions with the same `ordering_key` are sent in order.
+
+        With block or key ordering, the transactions are sharded by the key between sub-queues, one per worker.
+        """
+        if self.workers <= 1:
+            return await self.run(queue)
+        if self.ordering == "tx":
+            return await asyncio.gather(*(self.run(queue) for _ in range(self.workers)))
+        shards = [queues.ShardQueue(queue, max(self.batch_max_items, 1)) for _ in range(self.workers)]
+        await asyncio.gather(self._dispatch(queue, shards), *(self.run(shard) for shard in shards))
+
+    async def _dispatch(self, queue: asyncio.Queue[DecodedTxLogs], shards: List[asyncio.Queue]):
+        key_fn = self.ordering_key if self.ordering == "key" else (lambda log: log.tx.block.hash)
+        while True:
+            log = await queue.get()
+            # Completed in `queue` when the shard worker calls task_done
+            await shards[hash(key_fn(log)) % len(shards)].put(log)
+
+    def ordering_key(self, log: DecodedTxLogs):
+        """Key of the `key` ordering. By default the address of the contract that emitted the first event"""
+        return log.raw_logs[0].get("address") if log.raw_logs else None
 
     def run_sync(self, logs: Iterable[DecodedTxLogs]):
         for log in logs:
             self.send_to_output_sync(log)
 
     async def run(self, queue: asyncio.Queue[DecodedTxLogs]):
+        if self.batch_max_items > 1:
+            return await self._run_batches(queue)
         while True:
             log = await queue.get()
             await self.send_to_output(log)
             queue.task_done()
 
+    async def _run_batches(self, queue: asyncio.Queue[DecodedTxLogs]):
+        while True:
+            batch = await self._next_batch(queue)
+            await self.send_batch(batch)
+            for _ in batch:
+                queue.task_done()
+
+    async def _next_batch(self, queue: asyncio.Queue[DecodedTxLogs]) -> List[DecodedTxLogs]:
+        """Waits for a transaction and collects more until the batch is full (by items or bytes) or `batch_linger`
+        seconds pass. Without linger, takes only the transactions that are already in the queue."""
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        size = self.batch_item_size(batch[0])
+        deadline = loop.time() + self.batch_linger
+        while len(batch) < self.batch_max_items and not (self.batch_max_bytes and size >= self.batch_max_bytes):
+            timeout = deadline - loop.time()
+            try:
+                if timeout <= 0:
+                    log = queue.get_nowait()
+                else:
+                    log = await asyncio.wait_for(queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            batch.append(log)
+            size += self.batch_item_size(log)
+        return batch
+
+    def batch_item_size(self, log: DecodedTxLogs) -> int:
+        """Estimated size of the transaction in the output, for batch_max_bytes"""
+        return sum(len(raw_log.get("data", "")) + 32 * len(raw_log.get("topics", [])) for raw_log in log.raw_logs)
+
+    async def send_batch(self, logs: List[DecodedTxLogs]):
+        """Sends the transactions of a batch (see run). By default one by one, the outputs that can amortize the I/O
+        between several transactions override it"""
+        for log in logs:
+            await self.send_to_output(log)
+
     @abstractmethod
     def send_to_output_sync(self, log: DecodedTxLogs): ...
 
     async def send_to_output(self, log: DecodedTxLogs):
-        return self.send_to_output_sync(log)
+        return await self.offload(self.send_to_output_sync, log)
+
+    @staticmethod
+    async def offload(fn, *args, **kwargs):
+        """Runs blocking work (like rendering) in the default executor, to keep the event loop responsive"""
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
 
     @classmethod
     def register(cls, type: str):
@@ -60,10 +194,34 @@ class OutputBase(ABC):
         return subclass(parsed_url, renv=renv)
 
 
+def share_render_cache(outputs: Iterable[OutputBase], maxsize: int = 1024) -> Optional[RenderCache]:
+    """Sets a render cache shared by the outputs that render the template rules, when there is more than one"""
+    rendering_outputs = [output for output in outputs if output.uses_template_rules]
+    if maxsize <= 0 or len(rendering_outputs) < 2:
+        return None
+    cache = RenderCache(maxsize)
+    for output in rendering_outputs:
+        output.render_cache = cache
+    return cache
+
+
+def name_outputs(outputs: Sequence[OutputBase]):
+    """Names the outputs without `name` (used in the queue metrics and spill files) by type, adding the position
+    when there are several outputs of the same type"""
+    types = Counter(output.type for output in outputs if output.name is None)
+    for i, output in enumerate(outputs):
+        if output.name is None:
+            output.name = output.type if types[output.type] == 1 else f"{output.type}-{i}"
+    names = Counter(output.name for output in outputs)
+    duplicated = [name for name, count in names.items() if count > 1]
+    if duplicated:
+        raise RuntimeError(f"Duplicate output names {duplicated}, set a different ?name= to each output")
+
+
 @OutputBase.register("dummy")
 class DummyOutput(OutputBase):
     def __init__(self, url: ParseResult, renv=None):
-        super().__init__(url)
+        super().__init__(url, renv)
 
     def send_to_output_sync(self, log: DecodedTxLogs):
         pprint.pprint(log)
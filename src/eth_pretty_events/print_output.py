@@ -1,28 +1,26 @@
 import logging
 import sys
+from typing import List
 from urllib.parse import parse_qs
 
-from .event_filter import find_template
 from .outputs import DecodedTxLogs, OutputBase
-from .render import render
+from .render import render_rule
 
 _logger = logging.getLogger(__name__)
 
 
 @OutputBase.register("print")
 class PrintOutput(OutputBase):
+    uses_template_rules = True
+
     def __init__(self, url, renv):
-        super().__init__(url)
+        super().__init__(url, renv)
         query_params = parse_qs(url.query)
         self.filename = query_params.get("file", [None])[0]
         self.output_file = open(self.filename, "w") if self.filename else sys.stdout
-        self.renv = renv
 
     def send_to_output_sync(self, log: DecodedTxLogs):
-        if self.tags is not None:
-            template_rules = [tr for tr in self.renv.template_rules if any(tag in tr.tags for tag in self.tags)]
-        else:
-            template_rules = self.renv.template_rules
+        template_rules = self.template_rules
         for raw_event, event in zip(log.raw_logs, log.decoded_logs):
             if event is None:
                 _logger.warning(
@@ -30,10 +28,18 @@ class PrintOutput(OutputBase):
                     f"index: {raw_event.logIndex}, block: {log.tx.block.number}"
                 )
                 continue
-            template_name = find_template(template_rules, event)
-            if template_name is None:
-                continue
-            rendered_event = render(self.renv.jinja_env, event, [template_name, self.renv.args.on_error_template])
+            for rule in template_rules.find_all(event):
+                rendered_event = render_rule(
+                    self.renv.jinja_env, event, rule, self.renv.args.on_error_template, log.rendered, self.render_cache
+                )
+
+                print(rendered_event, file=self.output_file)
+                print("--------------------------", file=self.output_file)
+
+    async def send_batch(self, logs: List[DecodedTxLogs]):
+        await self.offload(self._send_batch_sync, logs)
 
-            print(rendered_event, file=self.output_file)
-            print("--------------------------", file=self.output_file)
+    def _send_batch_sync(self, logs: List[DecodedTxLogs]):
+        for log in logs:
+            self.send_to_output_sync(log)
+        self.output_file.flush()
@@ -1,18 +1,40 @@
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
 import json
 import logging
+import random
+import threading
+import time
+from abc import abstractmethod
+from typing import Callable, Iterable, List, Optional
 from urllib.parse import ParseResult, parse_qs
 
 from google.cloud import pubsub_v1
 from web3._utils.encoding import Web3JsonEncoder
 
+from . import metrics
 from .outputs import DecodedTxLogs, OutputBase
+from .types import Bytes
 
 _logger = logging.getLogger(__name__)
 
+_publish_failures = metrics.counter(
+    "eth_pretty_events_pubsub_publish_failures_total", "Messages that failed to publish after the retries", ["topic"]
+)
+
+
+class JsonEncoder(Web3JsonEncoder):
+    def default(self, obj):
+        if isinstance(obj, Bytes):
+            return obj.hex()
+        return super().default(obj)
+
 
 class PubSubOutputBase(OutputBase):
     def __init__(self, url: ParseResult, renv):
-        super().__init__(url)
+        super().__init__(url, renv)
 
         query_params = parse_qs(url.query)
         self.dry_run = query_params.get("dry_run", ["false"])[0].lower() == "true"
@@ -22,26 +44,132 @@ class PubSubOutputBase(OutputBase):
         if not self.project_id or not self.topic:
             raise RuntimeError("Both 'project_id' and 'topic' must be specified in the query string")
 
+        # The messages of a batch are published without waiting for each other (see publish_messages), the client
+        # batches them and `publish` blocks when there are max_outstanding_messages / max_outstanding_bytes not
+        # acknowledged
+        self.publish_retries = int(query_params.get("publish_retries", [3])[0])
+        # Exponential, with jitter: backoff * 2^(attempt-1) * [0.5, 1), up to max_backoff
+        self.retry_backoff = float(query_params.get("publish_retry_backoff", [0.5])[0])
+        self.retry_max_backoff = float(query_params.get("publish_retry_max_backoff", [10])[0])
+        self._retries = RetryScheduler(f"pubsub-retry-{self.topic}")
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=int(query_params.get("publish_batch_messages", [100])[0]),
+            max_bytes=int(query_params.get("publish_batch_bytes", [1000000])[0]),
+            max_latency=float(query_params.get("publish_batch_latency", [0.01])[0]),
+        )
+        flow_control = pubsub_v1.types.PublishFlowControl(
+            message_limit=int(query_params.get("max_outstanding_messages", [1000])[0]),
+            byte_limit=int(query_params.get("max_outstanding_bytes", [10 * 1024 * 1024])[0]),
+            limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+        )
+
         if self.dry_run:
             _logger.info("Dry run mode activated.")
             self.publisher = PrintToScreenPublisher(self.project_id, self.topic)
             self.topic_path = f"projects/{self.project_id}/topics/{self.topic}"
         else:
             _logger.info("Production mode activated. Using Pub/Sub PublisherClient.")
-            self.publisher = pubsub_v1.PublisherClient()
+            self.publisher = pubsub_v1.PublisherClient(
+                batch_settings=batch_settings,
+                publisher_options=pubsub_v1.types.PublisherOptions(flow_control=flow_control),
+            )
             self.topic_path = self.publisher.topic_path(self.project_id, self.topic)
 
+    def _publish(self, data: bytes, publishes: "Publishes", attempt: int = 0):
+        future = self.publisher.publish(self.topic_path, data)
+        future.add_done_callback(lambda future: self._on_published(future, data, publishes, attempt))
+
+    def _on_published(self, future: concurrent.futures.Future, data: bytes, publishes: "Publishes", attempt: int):
+        try:
+            message_id = future.result()
+        except Exception as err:
+            if attempt < self.publish_retries:
+                _logger.warning(
+                    f"Failed to publish to Pub/Sub ({err}), retrying ({attempt + 1}/{self.publish_retries})"
+                )
+                # Not from the client's thread, that may be needed to release the flow control
+                self._retries.schedule(self._retry_delay(attempt + 1), self._retry, data, publishes, attempt + 1)
+                return
+            _logger.error(f"Failed to publish to Pub/Sub ({err}) after {attempt} retries")
+            _publish_failures.inc(topic=self.topic)
+            publishes.done(failed=True)
+        else:
+            _logger.info(f"Published message to Pub/Sub with ID: {message_id}")
+            publishes.done()
+
+    def _retry_delay(self, attempt: int) -> float:
+        return min(self.retry_max_backoff, self.retry_backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+
+    def _retry(self, data: bytes, publishes: "Publishes", attempt: int):
+        try:
+            self._publish(data, publishes, attempt)
+        except Exception:
+            _logger.exception("Failed to publish to Pub/Sub")
+            _publish_failures.inc(topic=self.topic)
+            publishes.done(failed=True)
+
+    def _publish_message(self, message: dict, publishes: "Publishes"):
+        publishes.add()
+        try:
+            self._publish(json.dumps(message, cls=JsonEncoder).encode("utf-8"), publishes)
+        except Exception:
+            publishes.done()
+            raise
+
+    def publish_messages(self, messages: Iterable[dict]):
+        """Publishes all the messages without waiting for each acknowledgement, so the client batches them, and
+        then waits for all of them (including the retries). Raises if any of them failed"""
+        publishes = Publishes()
+        try:
+            for message in messages:
+                self._publish_message(message, publishes)
+        finally:
+            # Also when building or publishing a message fails, for the ones already published
+            failed = publishes.wait()
+        if failed:
+            raise RuntimeError(f"Failed to publish {failed} messages to {self.topic_path}")
+
     def publish_message(self, message):
-        formatted_message = json.dumps(message, cls=Web3JsonEncoder)
-        publish = self.publisher.publish(self.topic_path, formatted_message.encode("utf-8"))
-        message_id = publish.result()
-        _logger.info(f"Published message to Pub/Sub with ID: {message_id}")
+        self.publish_messages([message])
+
+    def run_sync(self, logs: Iterable[DecodedTxLogs]):
+        self.publish_messages(self.build_message(log) for log in logs)
+
+    async def run(self, queue: asyncio.Queue[DecodedTxLogs]):
+        """Publishes the transactions as they arrive, without waiting for the acknowledgements (`publish` blocks
+        when there are too many outstanding, see the flow control). Each transaction is done in the queue when its
+        message is acknowledged or failed after the retries. After a failure, raises on the next transaction"""
+        if self.batch_max_items > 1:
+            return await super().run(queue)
+        loop = asyncio.get_running_loop()
+        failures = []
+
+        def on_done(failed: bool):
+            if failed:
+                failures.append(failed)
+            loop.call_soon_threadsafe(queue.task_done)
+
+        publishes = Publishes(on_done)
+        while True:
+            log = await queue.get()
+            if failures:
+                raise RuntimeError(f"Failed to publish {len(failures)} messages to {self.topic_path}")
+            await self.offload(lambda: self._publish_message(self.build_message(log), publishes))
+
+    @abstractmethod
+    def build_message(self, log: DecodedTxLogs) -> dict: ...
+
+    def send_to_output_sync(self, log: DecodedTxLogs):
+        self.publish_message(self.build_message(log))
+
+    async def send_batch(self, logs: List[DecodedTxLogs]):
+        await self.offload(lambda: self.publish_messages([self.build_message(log) for log in logs]))
 
 
 @OutputBase.register("pubsubrawlogs")
 class PubSubRawLogsOutput(PubSubOutputBase):
-    def send_to_output_sync(self, log: DecodedTxLogs):
-        message = {
+    def build_message(self, log: DecodedTxLogs) -> dict:
+        return {
             "transactionHash": log.tx.hash,
             "blockHash": log.tx.block.hash,
             "blockNumber": log.tx.block.number,
@@ -58,13 +186,12 @@ class PubSubRawLogsOutput(PubSubOutputBase):
                 for raw_log in log.raw_logs
             ],
         }
-        self.publish_message(message)
 
 
 @OutputBase.register("pubsubdecodedlogs")
 class PubSubDecodedLogsOutput(PubSubOutputBase):
-    def send_to_output_sync(self, log: DecodedTxLogs):
-        message = {
+    def build_message(self, log: DecodedTxLogs) -> dict:
+        return {
             "transactionHash": log.tx.hash,
             "blockHash": log.tx.block.hash,
             "blockNumber": log.tx.block.number,
@@ -83,7 +210,64 @@ class PubSubDecodedLogsOutput(PubSubOutputBase):
                 if decoded_log
             ],
         }
-        self.publish_message(message)
+
+
+class RetryScheduler:
+    """Runs the scheduled calls after their delay, in a single thread (started on the first call)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._scheduled = []
+        self._sequence = itertools.count()  # Tie-breaker, the calls aren't comparable
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay: float, fn, *args):
+        with self._changed:
+            heapq.heappush(self._scheduled, (time.monotonic() + delay, next(self._sequence), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._changed.notify()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._scheduled or self._scheduled[0][0] > time.monotonic():
+                    self._changed.wait(self._scheduled[0][0] - time.monotonic() if self._scheduled else None)
+                _, _, fn, args = heapq.heappop(self._scheduled)
+            try:
+                fn(*args)
+            except Exception:
+                _logger.exception(f"{self.name} failed")
+
+
+class Publishes:
+    """Tracks the messages published together, to wait for their acknowledgements or failures"""
+
+    def __init__(self, on_done: Optional[Callable[[bool], None]] = None):
+        self.pending = 0
+        self.failed = 0
+        self.on_done = on_done  # Called with `failed` when each message is done, from the client's threads
+        self._changed = threading.Condition()
+
+    def add(self):
+        with self._changed:
+            self.pending += 1
+
+    def done(self, failed=False):
+        with self._changed:
+            self.pending -= 1
+            self.failed += failed
+            self._changed.notify_all()
+        if self.on_done is not None:
+            self.on_done(failed)
+
+    def wait(self) -> int:
+        """Waits for all the messages, returns the number of failures"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.pending == 0)
+            return self.failed
 
 
 class PrintToScreenPublisher:
@@ -105,6 +289,7 @@ class PrintToScreenPublisher:
         return DryRunFuture()
 
 
-class DryRunFuture:
-    def result(self):
-        return "dry-run-message-id"
+class DryRunFuture(concurrent.futures.Future):
+    def __init__(self):
+        super().__init__()
+        self.set_result("dry-run-message-id")
@@ -0,0 +1,149 @@
+"""Bounded asyncio queues for the pipeline, with overflow policies:
+
+- block: `put` waits until there is room (backpressure to the producer).
+- drop_oldest: `put` never waits, the oldest item is discarded to make room.
+- spill: `put` never waits, the items that don't fit in memory are stored in a temporary file (in order) and read
+  back as the queue drains.
+
+All of them export the queue depth, drops and spills as metrics, labeled by queue name.
+"""
+
+import asyncio
+import pickle
+import tempfile
+from collections import deque
+from typing import Any, Callable, Optional
+
+from . import metrics
+
+POLICIES = ("block", "drop_oldest", "spill")
+
+_depth = metrics.gauge("eth_pretty_events_queue_depth", "Items waiting in the queue", ["queue"])
+_drops = metrics.counter("eth_pretty_events_queue_drops_total", "Items discarded because the queue was full", ["queue"])
+_spills = metrics.counter(
+    "eth_pretty_events_queue_spilled_total", "Items stored on disk because the queue was full", ["queue"]
+)
+
+
+class MeteredQueue(asyncio.Queue):
+    """Queue that exports its depth. With the `block` policy, `maxsize` is the asyncio.Queue one"""
+
+    def __init__(self, name: str, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.name = name
+        _depth.set(0, queue=name)
+
+    def _put(self, item):
+        super()._put(item)
+        _depth.set(self.qsize(), queue=self.name)
+
+    def _get(self):
+        item = super()._get()
+        _depth.set(self.qsize(), queue=self.name)
+        return item
+
+
+class DropOldestQueue(MeteredQueue):
+    def __init__(self, name: str, limit: int):
+        super().__init__(name)
+        self.limit = limit
+
+    def _put(self, item):
+        if len(self._queue) >= self.limit:
+            self._queue.popleft()
+            _drops.inc(queue=self.name)
+            self.task_done()  # The dropped item won't be processed
+        super()._put(item)
+
+
+class SpillQueue(MeteredQueue):
+    """Keeps up to `limit` items in memory and the rest in a temporary file in `spill_dir`.
+
+    The items are stored with `dump(item)` (must return something picklable) and restored with `load`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        dump: Callable[[Any], Any] = lambda item: item,
+        load: Callable[[Any], Any] = lambda item: item,
+        spill_dir: Optional[str] = None,
+    ):
+        super().__init__(name)
+        self.limit = limit
+        self.dump = dump
+        self.load = load
+        self.spill_dir = spill_dir
+        self._spill_file = None
+        self._spill_offsets = deque()  # Positions of the items in the spill file, in order
+        self._write_pos = 0
+
+    def qsize(self):
+        return len(self._queue) + len(self._spill_offsets)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _put(self, item):
+        if self._spill_offsets or len(self._queue) >= self.limit:
+            self._spill(item)
+            _depth.set(self.qsize(), queue=self.name)
+        else:
+            super()._put(item)
+
+    def _get(self):
+        if not self._queue:
+            self._unspill()
+        item = self._queue.popleft()
+        if self._spill_offsets and len(self._queue) < self.limit:
+            self._unspill()
+        _depth.set(self.qsize(), queue=self.name)
+        return item
+
+    def _spill(self, item):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir, prefix=f"{self.name}-spill-")
+        self._spill_file.seek(self._write_pos)
+        pickle.dump(self.dump(item), self._spill_file)
+        self._spill_offsets.append(self._write_pos)
+        self._write_pos = self._spill_file.tell()
+        _spills.inc(queue=self.name)
+
+    def _unspill(self):
+        self._spill_file.seek(self._spill_offsets.popleft())
+        self._queue.append(self.load(pickle.load(self._spill_file)))
+        if not self._spill_offsets:
+            # All read, the file is reused from the start
+            self._spill_file.truncate(0)
+            self._write_pos = 0
+
+
+class ShardQueue(asyncio.Queue):
+    """Sub-queue fed from `parent`: processing an item (task_done) also completes it in the parent, so
+    `parent.join()` waits for the items that are in the shards"""
+
+    def __init__(self, parent: asyncio.Queue, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.parent = parent
+
+    def task_done(self):
+        super().task_done()
+        self.parent.task_done()
+
+
+def build_queue(
+    name: str,
+    maxsize: int = 0,
+    policy: str = "block",
+    dump: Callable[[Any], Any] = lambda item: item,
+    load: Callable[[Any], Any] = lambda item: item,
+    spill_dir: Optional[str] = None,
+) -> asyncio.Queue:
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown queue policy '{policy}', must be one of {POLICIES}")
+    if not maxsize or policy == "block":
+        return MeteredQueue(name, maxsize)
+    if policy == "drop_oldest":
+        return DropOldestQueue(name, maxsize)
+    return SpillQueue(name, maxsize, dump, load, spill_dir)
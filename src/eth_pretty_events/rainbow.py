@@ -0,0 +1,77 @@
+"""Bytes32 rainbow table (hash -> name), used by the `unhash` and `role` filters.
+
+The input file can be a list of names, a name -> hash or a hash -> name mapping (or a mix of the last two). The
+names without hash are hashed in bulk (in several processes for big lists) and the resulting table can be cached
+on disk, keyed by the hash of the input file.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from eth_utils import keccak
+
+from .types import Hash
+
+_logger = logging.getLogger(__name__)
+
+# Lists of names shorter than this are hashed in the current process
+PARALLEL_MIN_NAMES = 50000
+CHUNK_SIZE = 10000
+
+
+def _keccak_chunk(names: List[str]) -> List[Tuple[str, str]]:
+    return [("0x" + keccak(text=name).hex(), name) for name in names]
+
+
+def hash_names(names: Iterable[str], workers: Optional[int] = None) -> Dict[str, str]:
+    """Returns the hash -> name mapping of the names. Hashed in a process pool when there are many names"""
+    names = list(dict.fromkeys(names))
+    if len(names) < PARALLEL_MIN_NAMES or workers == 1:
+        return dict(_keccak_chunk(names))
+    chunks = [names[i : i + CHUNK_SIZE] for i in range(0, len(names), CHUNK_SIZE)]
+    ret = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for hashed in executor.map(_keccak_chunk, chunks):
+            ret.update(hashed)
+    return ret
+
+
+def build_rainbow(data: Union[list, dict], workers: Optional[int] = None) -> Dict[str, str]:
+    """Normalizes the data (list of names, name -> hash or hash -> name) to a hash -> name mapping"""
+    if isinstance(data, list):
+        return hash_names(data, workers)
+    ret = {}
+    for key, value in data.items():
+        try:
+            ret[Hash(key)] = value
+        except ValueError:
+            ret[Hash(value)] = key
+    return ret
+
+
+def load_rainbow(path: str, cache_dir: Optional[str] = None, workers: Optional[int] = None) -> Dict[str, str]:
+    """Reads the rainbow table from a JSON file. With `cache_dir`, the normalized table is stored there and reused
+    while the input file doesn't change"""
+    with open(path, "rb") as f:
+        content = f.read()
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, f"b32-rainbow-{hashlib.sha256(content).hexdigest()}.json")
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                return json.load(f)
+
+    ret = build_rainbow(json.loads(content), workers)
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(ret, f)
+        os.replace(tmp_file, cache_file)
+        _logger.info(f"Rainbow table with {len(ret)} hashes cached in {cache_file}")
+    return ret
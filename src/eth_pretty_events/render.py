@@ -1,36 +1,258 @@
+import concurrent.futures
 import logging
 import os
-from typing import Sequence
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    Template,
+    select_autoescape,
+)
 
-from . import jinja2_ext
+from . import jinja2_ext, metrics
 from .types import Event
 
 _logger = logging.getLogger(__name__)
 
+_cache_lookups = metrics.counter(
+    "eth_pretty_events_render_cache_lookups_total", "Lookups in the render caches shared by outputs", ["result"]
+)
+_budget_overruns = metrics.counter(
+    "eth_pretty_events_render_budget_overruns_total", "Renders aborted for exceeding the time budget", ["template"]
+)
+_quarantines = metrics.counter(
+    "eth_pretty_events_render_quarantines_total", "Times the template was quarantined", ["template"]
+)
+_quarantine_skips = metrics.counter(
+    "eth_pretty_events_render_quarantine_skips_total",
+    "Renders that used the fallback because the template was quarantined",
+    ["template"],
+)
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderBudget:
+    """Time budget for each render. The render is streamed (Template.generate) and aborted when it goes over the
+    budget, so the next template (the --on-error-template) is used instead.
+
+    Templates that overrun `quarantine_after` times in a row are quarantined (replaced by the fallback) for
+    `quarantine_seconds`.
+    """
+
+    def __init__(self, seconds: float, quarantine_after: int = 3, quarantine_seconds: float = 300):
+        self.seconds = seconds
+        self.quarantine_after = quarantine_after
+        self.quarantine_seconds = quarantine_seconds
+        self._overruns: Dict[str, int] = {}
+        self._quarantined_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_quarantined(self, template_name: str) -> bool:
+        until = self._quarantined_until.get(template_name)
+        if until is None:
+            return False
+        if time.monotonic() < until:
+            return True
+        with self._lock:
+            self._quarantined_until.pop(template_name, None)
+        return False
+
+    def _record_overrun(self, template_name: str):
+        _budget_overruns.inc(template=template_name)
+        with self._lock:
+            overruns = self._overruns[template_name] = self._overruns.get(template_name, 0) + 1
+            if overruns < self.quarantine_after:
+                return
+            self._overruns[template_name] = 0
+            self._quarantined_until[template_name] = time.monotonic() + self.quarantine_seconds
+        _quarantines.inc(template=template_name)
+        _logger.warning(f"Template '{template_name}' quarantined for {self.quarantine_seconds} seconds")
+
+    def render(self, template: Template, event: Event) -> str:
+        deadline = time.perf_counter() + self.seconds
+        chunks = []
+        for chunk in template.generate(evt=event):
+            chunks.append(chunk)
+            if time.perf_counter() > deadline:
+                self._record_overrun(template.name)
+                raise RenderTimeout(f"Render with template '{template.name}' exceeded {self.seconds} seconds")
+        if self._overruns.get(template.name):
+            with self._lock:
+                self._overruns[template.name] = 0
+        return "".join(chunks)
+
 
 def init_environment(
     search_path: str | os.PathLike | Sequence[str | os.PathLike],
     env_globals: dict,
+    bytecode_cache_dir: Optional[str | os.PathLike] = None,
+    auto_reload: bool = False,
+    render_budget: Optional[RenderBudget] = None,
 ) -> Environment:
+    """Creates the jinja environment. With `bytecode_cache_dir` the compiled templates are stored in that directory
+    and reused by other processes (as long as the template source doesn't change).
+
+    With `auto_reload` the template files are checked for changes each time a template is requested.
+
+    The explorer URLs of the chains are resolved here, and the link filters bound to the one of `chain_id`.
+
+    The `render_budget` (see RenderBudget) applies to the renders of `render` with this environment.
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
     env = Environment(
         loader=FileSystemLoader(search_path),
         autoescape=select_autoescape(),
+        bytecode_cache=bytecode_cache,
+        auto_reload=auto_reload,
     )
+    env.extend(render_budget=render_budget)
     env.globals.update(env_globals)
+    if "chains" in env.globals:
+        env.globals["explorer_urls"] = jinja2_ext.explorer_urls(env.globals["chains"])
     jinja2_ext.add_filters(env)
+    jinja2_ext.bind_link_filters(env)
     jinja2_ext.add_tests(env)
     return env
 
 
+def precompile(env: Environment, template_names: Iterable[str]) -> int:
+    """Loads (compiling them or reading them from the bytecode cache) the templates, to avoid doing it on the first
+    render. Returns the number of templates loaded."""
+    loaded = 0
+    for template_name in template_names:
+        try:
+            env.get_template(template_name)
+            loaded += 1
+        except Exception:
+            _logger.warning(f"Failed to precompile template '{template_name}'", exc_info=True)
+    return loaded
+
+
+def resolve_templates(env: Environment, template_rules: Iterable, on_error_template: Optional[str]):
+    """Stores in each rule the Template objects to render (the rule template and the on-error fallback), to skip the
+    environment lookups on each render. The templates that fail to load are kept by name."""
+    resolved = {}
+
+    def resolve(template_name):
+        if template_name not in resolved:
+            try:
+                resolved[template_name] = env.get_template(template_name)
+            except Exception:
+                _logger.warning(f"Failed to load template '{template_name}'", exc_info=True)
+                resolved[template_name] = template_name
+        return resolved[template_name]
+
+    on_error = resolve(on_error_template) if on_error_template is not None else None
+    for rule in template_rules:
+        rule.resolved_templates = (resolve(rule.template), on_error)
+
+
+class RenderCache:
+    """Bounded (LRU) cache of rendered events by (tx hash, log index, template name), shared by the outputs of the
+    same pipeline so each event is rendered once per template. Concurrent lookups of a key being rendered wait for
+    that render instead of rendering again"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Tuple[str, int, str], str] = OrderedDict()
+        self._in_flight: Dict[Tuple[str, int, str], concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_render(self, event: Event, template_name: str, render_fn: Callable[[], str]) -> str:
+        key = (event.tx.hash, event.log_index, template_name)
+        rendering = None
+        with self._lock:
+            ret = self._entries.get(key)
+            if ret is not None:
+                self._entries.move_to_end(key)
+            else:
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    rendering = self._in_flight[key] = concurrent.futures.Future()
+        if ret is not None:
+            _cache_lookups.inc(result="hit")
+            return ret
+        if rendering is None:
+            _cache_lookups.inc(result="hit")
+            return in_flight.result()  # Raises like the render of the first caller
+        _cache_lookups.inc(result="miss")
+        try:
+            ret = render_fn()
+        except BaseException as err:
+            with self._lock:
+                del self._in_flight[key]
+            rendering.set_exception(err)
+            raise
+        with self._lock:
+            self._entries[key] = ret
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            del self._in_flight[key]
+        rendering.set_result(ret)
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def render_rule(
+    env: Environment,
+    event: Event,
+    rule,
+    on_error_template: Optional[str],
+    rendered: Optional[Dict[Tuple[int, str], str]] = None,
+    cache: Optional[RenderCache] = None,
+) -> str:
+    """Renders the event with the templates of the rule, unless it was already rendered (see render_stage) or is
+    in the cache"""
+    if rendered:
+        ret = rendered.get((event.log_index, rule.template))
+        if ret is not None:
+            return ret
+    if cache is None:
+        return render(env, event, rule.templates_to_render(on_error_template))
+    return cache.get_or_render(
+        event, rule.template, lambda: render(env, event, rule.templates_to_render(on_error_template))
+    )
+
+
 def render(env: Environment, event: Event, templates):
-    if isinstance(templates, str):
+    """Renders the event with the first template that doesn't fail. The templates can be names or Template objects.
+
+    If the environment has a render budget, it applies to all the templates but the last one (the fallback).
+    """
+    if isinstance(templates, (str, Template)):
         templates = [templates]
+    # Without on-error template, the rules have None as fallback
+    templates = [template for template in templates if template is not None]
+    budget: Optional[RenderBudget] = getattr(env, "render_budget", None)
 
-    for template_name in templates:
+    for i, template in enumerate(templates):
+        template_name = template.name if isinstance(template, Template) else template
+        budgeted = budget is not None and i < len(templates) - 1
+        if budgeted and budget.is_quarantined(template_name):
+            _quarantine_skips.inc(template=template_name)
+            continue
         try:
-            template = env.get_template(template_name)
+            if not isinstance(template, Template):
+                template = env.get_template(template_name)
+            if budgeted:
+                return budget.render(template, event)
             return template.render(evt=event)
         except Exception:
             _logger.warning(
@@ -0,0 +1,133 @@
+"""Rendering stage, between the decoding and the outputs: renders the events of each transaction on a pool of
+workers and stores the results in `DecodedTxLogs.rendered`, where the outputs look for them before rendering.
+
+With a process pool the events are decoded again in the workers (the ABI types aren't picklable), and each worker
+builds its own rendering environment once, using `renv_factory`.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from . import token_metadata
+from .decode_events import decode_events_from_raw_logs
+from .event_filter import TemplateRule, TemplateRuleSet
+from .outputs import DecodedTxLogs
+from .render import render
+
+_logger = logging.getLogger(__name__)
+
+Rendered = Dict[Tuple[int, str], str]
+
+_worker_renv = None
+
+
+def _init_process_worker(renv_factory: Callable, renv_factory_args: tuple):
+    global _worker_renv
+    _worker_renv = renv_factory(*renv_factory_args)
+
+
+def _render_jobs(env, events, jobs, on_error_template) -> Rendered:
+    ret = {}
+    for position, template_name, templates in jobs:
+        event = events[position]
+        try:
+            ret[(event.log_index, template_name)] = render(env, event, templates or [template_name, on_error_template])
+        except Exception:
+            # Left for the output, that will fail on its own way
+            _logger.warning(f"Render stage failed for tx: {event.tx.hash}, log_index: {event.log_index}")
+    return ret
+
+
+def _render_in_process(tx, raw_logs, jobs, tokens) -> Rendered:
+    # The token metadata is prefetched in the main process, the one loaded by the worker may be outdated
+    token_metadata.get_default().update(tokens)
+    events = list(decode_events_from_raw_logs(tx.block, tx, raw_logs))
+    return _render_jobs(_worker_renv.jinja_env, events, jobs, _worker_renv.args.on_error_template)
+
+
+class RenderStage:
+    def __init__(
+        self,
+        renv,
+        rule_sets: Sequence[TemplateRuleSet],
+        workers: int,
+        pool: str = "process",
+        renv_factory: Callable = None,
+        renv_factory_args: tuple = (),
+    ):
+        self.renv = renv
+        self.rule_sets = rule_sets
+        self.pool = pool
+        if pool == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_process_worker, initargs=(renv_factory, renv_factory_args)
+            )
+        elif pool == "thread":
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="render")
+        else:
+            raise ValueError(f"Unknown render pool '{pool}'")
+        # Transactions being rendered ahead of the one the outputs are waiting for
+        self.window = 4 * workers
+
+    def _jobs(self, tx_logs: DecodedTxLogs) -> List[Tuple[int, str, TemplateRule]]:
+        jobs = {}
+        for position, event in enumerate(tx_logs.decoded_logs):
+            if event is None:
+                continue
+            for rules in self.rule_sets:
+                for rule in rules.find_all(event):
+                    jobs.setdefault((position, rule.template), rule)
+        return [(position, template, rule) for (position, template), rule in jobs.items()]
+
+    def submit(self, tx_logs: DecodedTxLogs) -> concurrent.futures.Future:
+        # Decoded only once, shared by all the outputs
+        tx_logs.decoded_logs = list(tx_logs.decoded_logs)
+        jobs = self._jobs(tx_logs)
+        if self.pool == "process":
+            # The workers resolve the templates by name
+            jobs = [(position, template, None) for position, template, _ in jobs]
+            tokens = token_metadata.get_default().entries(
+                tx_logs.tx.block.chain.id, token_metadata.event_addresses([tx_logs])
+            )
+            return self.executor.submit(_render_in_process, tx_logs.tx, tx_logs.raw_logs, jobs, tokens)
+        on_error_template = self.renv.args.on_error_template
+        jobs = [(position, template, rule.templates_to_render(on_error_template)) for position, template, rule in jobs]
+        return self.executor.submit(_render_jobs, self.renv.jinja_env, tx_logs.decoded_logs, jobs, on_error_template)
+
+    def _set_rendered(self, tx_logs: DecodedTxLogs, future: concurrent.futures.Future) -> DecodedTxLogs:
+        try:
+            tx_logs.rendered = future.result()
+        except Exception:
+            _logger.exception(f"Render stage failed for tx {tx_logs.tx.hash}, the outputs will render it")
+        return tx_logs
+
+    def render(self, decoded_tx_logs: Iterable[DecodedTxLogs]) -> Iterator[DecodedTxLogs]:
+        """Yields the same transactions, in order, once rendered"""
+        pending = deque()
+        for tx_logs in decoded_tx_logs:
+            pending.append((tx_logs, self.submit(tx_logs)))
+            if len(pending) >= self.window:
+                yield self._set_rendered(*pending.popleft())
+        while pending:
+            yield self._set_rendered(*pending.popleft())
+
+    async def forward_rendered(self, in_flight: asyncio.Queue, queues: Sequence[asyncio.Queue]):
+        """Async version of `render`: takes the (tx_logs, future) pairs submitted to `in_flight` and puts the
+        transactions in the queues, in order, once rendered. Bound `in_flight` to `window` to limit the
+        transactions being rendered ahead"""
+        while True:
+            tx_logs, future = await in_flight.get()
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass  # Logged by _set_rendered
+            tx_logs = self._set_rendered(tx_logs, future)
+            for queue in queues:
+                await queue.put(tx_logs)
+            in_flight.task_done()
+
+    def close(self):
+        self.executor.shutdown()
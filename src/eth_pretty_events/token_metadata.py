@@ -0,0 +1,186 @@
+"""Cache of the ERC-20 metadata (decimals and symbol) of the tokens, by chain and address.
+
+The metadata is fetched in bulk (one Multicall3 `eth_call` for all the new addresses of a block) before the
+events are rendered, so the template filters (`token_amount`, `token_symbol`) only read memory.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+from .types import Address
+
+if TYPE_CHECKING:
+    from .outputs import DecodedTxLogs
+
+_logger = logging.getLogger(__name__)
+
+# Same address in most EVM chains, see https://www.multicall3.com/
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+DECIMALS_SELECTOR = bytes.fromhex("313ce567")
+SYMBOL_SELECTOR = bytes.fromhex("95d89b41")
+
+MULTICALL_BATCH_SIZE = 200
+
+
+class TokenMetadata(NamedTuple):
+    decimals: Optional[int]
+    symbol: Optional[str]
+
+
+def _decode_decimals(data: bytes) -> Optional[int]:
+    if len(data) != 32:
+        return None
+    decimals = int.from_bytes(data, "big")
+    return decimals if decimals <= 255 else None
+
+
+def _decode_symbol(data: bytes) -> Optional[str]:
+    try:
+        return decode(["string"], data)[0]
+    except Exception:
+        pass
+    if len(data) == 32:  # Old tokens (like MKR) return bytes32
+        return data.rstrip(b"\0").decode("utf-8", errors="replace") or None
+    return None
+
+
+class TokenMetadataCache:
+    def __init__(self, entries: Optional[Dict[Tuple[int, Address], TokenMetadata]] = None):
+        self._entries: Dict[Tuple[int, Address], TokenMetadata] = entries or {}
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, chain_id: int, address: Address) -> Optional[TokenMetadata]:
+        return self._entries.get((chain_id, address))
+
+    def set(self, chain_id: int, address: Address, metadata: TokenMetadata):
+        with self._lock:
+            self._entries[(chain_id, address)] = metadata
+            self.dirty = True
+
+    def entries(self, chain_id: int, addresses: Iterable[Address]) -> Dict[Tuple[int, Address], TokenMetadata]:
+        """The cached metadata of the addresses, to send it to other processes (see update)"""
+        keys = ((chain_id, address) for address in addresses)
+        return {key: self._entries[key] for key in keys if key in self._entries}
+
+    def update(self, entries: Dict[Tuple[int, Address], TokenMetadata]):
+        with self._lock:
+            self._entries.update(entries)
+
+    def missing(self, chain_id: int, addresses: Iterable[Address]) -> List[Address]:
+        return [address for address in dict.fromkeys(addresses) if (chain_id, address) not in self._entries]
+
+    def prefetch(self, w3: Web3, chain_id: int, addresses: Iterable[Address]) -> int:
+        """Fetches the metadata of the addresses that aren't in the cache. Returns the number of addresses fetched.
+
+        The addresses that aren't tokens are cached with empty metadata, to avoid fetching them again.
+        """
+        missing = self.missing(chain_id, addresses)
+        for i in range(0, len(missing), MULTICALL_BATCH_SIZE):
+            batch = missing[i : i + MULTICALL_BATCH_SIZE]
+            try:
+                results = _multicall(w3, batch)
+            except Exception:
+                _logger.warning("Multicall3 failed, fetching the token metadata one by one", exc_info=True)
+                results = [_fetch_one(w3, address) for address in batch]
+            for address, metadata in zip(batch, results):
+                self.set(chain_id, address, metadata)
+        return len(missing)
+
+    @classmethod
+    def load(cls, path: str) -> "TokenMetadataCache":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(
+            {(int(chain_id), Address(address)): TokenMetadata(*metadata) for chain_id, address, *metadata in data}
+        )
+
+    def save(self, path: str):
+        with self._lock:
+            data = [[chain_id, address, *metadata] for (chain_id, address), metadata in self._entries.items()]
+            self.dirty = False
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def _multicall(w3: Web3, addresses: List[Address]) -> List[TokenMetadata]:
+    calls = []
+    for address in addresses:
+        calls.append((address, True, DECIMALS_SELECTOR))
+        calls.append((address, True, SYMBOL_SELECTOR))
+    data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+    response = w3.eth.call({"to": MULTICALL3_ADDRESS, "data": data})
+    (results,) = decode(["(bool,bytes)[]"], response)
+    ret = []
+    for (decimals_ok, decimals), (symbol_ok, symbol) in zip(results[::2], results[1::2]):
+        ret.append(
+            TokenMetadata(
+                _decode_decimals(decimals) if decimals_ok else None, _decode_symbol(symbol) if symbol_ok else None
+            )
+        )
+    return ret
+
+
+def _fetch_one(w3: Web3, address: Address) -> TokenMetadata:
+    ret = []
+    for selector, decode_fn in ((DECIMALS_SELECTOR, _decode_decimals), (SYMBOL_SELECTOR, _decode_symbol)):
+        try:
+            ret.append(decode_fn(bytes(w3.eth.call({"to": address, "data": selector}))))
+        except Exception:
+            ret.append(None)
+    return TokenMetadata(*ret)
+
+
+def event_addresses(decoded_tx_logs: Iterable["DecodedTxLogs"]) -> List[Address]:
+    """Addresses of the contracts that emitted the events (the candidates to be tokens)"""
+    return list(dict.fromkeys(event.address for tx_logs in decoded_tx_logs for event in tx_logs.decoded_logs if event))
+
+
+def prefetch_by_block(
+    cache: TokenMetadataCache, w3: Web3, chain_id: int, decoded_tx_logs: Iterable["DecodedTxLogs"]
+) -> Iterator["DecodedTxLogs"]:
+    """Yields the same transactions, fetching the token metadata of each block before yielding its transactions"""
+    block_txs: List["DecodedTxLogs"] = []
+    for tx_logs in decoded_tx_logs:
+        tx_logs.decoded_logs = list(tx_logs.decoded_logs)
+        if block_txs and block_txs[0].tx.block.hash != tx_logs.tx.block.hash:
+            cache.prefetch(w3, chain_id, event_addresses(block_txs))
+            yield from block_txs
+            block_txs = []
+        block_txs.append(tx_logs)
+    if block_txs:
+        cache.prefetch(w3, chain_id, event_addresses(block_txs))
+        yield from block_txs
+
+
+_default_cache = TokenMetadataCache()
+
+
+def setup_default(cache: TokenMetadataCache):
+    global _default_cache
+    _default_cache = cache
+
+
+def get_default() -> TokenMetadataCache:
+    return _default_cache
@@ -0,0 +1,94 @@
+"""Enrichment of the transactions with the data that isn't in the logs (sender, recipient, value, gas).
+
+All the transactions of a block are fetched in one round trip, with a JSON-RPC batch of `eth_getTransactionByHash`
+(mode "batch") or with `eth_getBlockByHash` with the full transactions (mode "block"). The results are cached and
+attached to `Tx.details`.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Sequence
+
+from web3 import Web3
+
+from .outputs import DecodedTxLogs
+from .types import Address, Hash, Tx, TxDetails
+
+_logger = logging.getLogger(__name__)
+
+
+def tx_details(w3_tx) -> TxDetails:
+    return TxDetails(
+        from_=Address(w3_tx["from"]),
+        to=Address(w3_tx["to"]) if w3_tx.get("to") else None,
+        value=w3_tx["value"],
+        gas=w3_tx["gas"],
+        gas_price=w3_tx.get("gasPrice"),
+        nonce=w3_tx["nonce"],
+    )
+
+
+class TxEnricher:
+    def __init__(self, w3: Web3, mode: str = "batch", cache_size: int = 10000):
+        if mode not in ("batch", "block"):
+            raise ValueError(f"Unknown enrichment mode '{mode}'")
+        self.w3 = w3
+        self.mode = mode
+        self.cache_size = cache_size
+        self._cache: OrderedDict[Hash, TxDetails] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fetch(self, txs: Sequence[Tx]) -> List[TxDetails]:
+        if self.mode == "block":
+            block_txs = {}
+            for block in dict.fromkeys(tx.block for tx in txs):
+                w3_block = self.w3.eth.get_block(block.hash, full_transactions=True)
+                block_txs.update((Hash.from_bytes32(w3_tx["hash"]), w3_tx) for w3_tx in w3_block["transactions"])
+            return [tx_details(block_txs[tx.hash]) for tx in txs]
+        with self.w3.batch_requests() as batch:
+            for tx in txs:
+                batch.add(self.w3.eth.get_transaction(tx.hash))
+            return [tx_details(w3_tx) for w3_tx in batch.execute()]
+
+    def enrich(self, txs: Iterable[Tx]) -> int:
+        """Sets the details of the transactions, fetching the ones that aren't cached. Returns the number fetched"""
+        missing = []
+        with self._lock:
+            for tx in txs:
+                details = self._cache.get(tx.hash)
+                if details is None:
+                    missing.append(tx)
+                else:
+                    self._cache.move_to_end(tx.hash)
+                    tx.details = details
+        if not missing:
+            return 0
+        try:
+            fetched = self._fetch(missing)
+        except Exception:
+            _logger.warning(f"Failed to fetch the details of {len(missing)} transactions", exc_info=True)
+            return 0
+        with self._lock:
+            for tx, details in zip(missing, fetched):
+                tx.details = self._cache[tx.hash] = details
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return len(missing)
+
+    def enrich_tx_logs(self, decoded_tx_logs: Iterable[DecodedTxLogs]) -> int:
+        return self.enrich(tx_logs.tx for tx_logs in decoded_tx_logs)
+
+
+def enrich_by_block(enricher: TxEnricher, decoded_tx_logs: Iterable[DecodedTxLogs]) -> Iterator[DecodedTxLogs]:
+    """Yields the same transactions, enriching the ones of each block together before yielding them"""
+    block_txs: List[DecodedTxLogs] = []
+    for tx_logs in decoded_tx_logs:
+        if block_txs and block_txs[0].tx.block.hash != tx_logs.tx.block.hash:
+            enricher.enrich_tx_logs(block_txs)
+            yield from block_txs
+            block_txs = []
+        block_txs.append(tx_logs)
+    if block_txs:
+        enricher.enrich_tx_logs(block_txs)
+        yield from block_txs
@@ -3,6 +3,8 @@ import re
 import types
 from collections import namedtuple
 from dataclasses import dataclass
+from dataclasses import field as dataclass_field
+from functools import total_ordering
 from typing import (
     Any,
     ClassVar,
@@ -37,31 +39,111 @@ class Address(str):
         return str.__new__(cls, value)
 
 
+HASH_REGEX = re.compile(r"0x[0-9a-f]{64}")
+
+
 class Hash(str):
     def __new__(cls, value: Union[HexBytes, str, bytes]):
-        if isinstance(value, HexBytes) or isinstance(value, bytes):
+        if type(value) is cls:
+            return value
+        if isinstance(value, bytes):  # HexBytes is a subclass of bytes
+            if len(value) != 32:
+                raise ValueError(f"'0x{value.hex()}' is not a valid hash")
             value = "0x" + value.hex()
-            if len(value) != 66:
-                raise ValueError(f"'{value}' is not a valid hash")
         elif isinstance(value, str):
-            if len(value) == 64 and not value.startswith("0x"):
+            if len(value) == 64:
                 value = "0x" + value
             elif len(value) != 66:
                 raise ValueError(f"'{value}' is not a valid hash")
-            if value != value.lower():
+            if HASH_REGEX.fullmatch(value) is None:
                 value = value.lower()
-            if value[0:2] != "0x":
-                raise ValueError(f"'{value}' is not a valid hash")
-            else:
-                try:
-                    int(value, 16)
-                except ValueError:
+                if HASH_REGEX.fullmatch(value) is None:
                     raise ValueError(f"'{value}' is not a valid hash")
         else:
             raise ValueError("Only HexBytes, bytes or str accepted")
 
         return str.__new__(cls, value)
 
+    @classmethod
+    def from_bytes32(cls, value: bytes) -> "Hash":
+        """Builds the hash skipping the validations, only for 32 bytes values that come from trusted sources
+        (the ABI decoder or the RPC responses)"""
+        return str.__new__(cls, "0x" + value.hex())
+
+
+@total_ordering
+class Bytes:
+    """Value of a `bytes` or `bytesN` argument.
+
+    Keeps a view over the original buffer and hex-encodes it lazily, but behaves like the hex string (without
+    0x prefix) for comparisons and templates.
+    """
+
+    __slots__ = ("_buffer", "_hex")
+
+    def __init__(self, value: Union[bytes, bytearray, memoryview, "Bytes"]):
+        if isinstance(value, Bytes):
+            self._buffer, self._hex = value._buffer, value._hex
+            return
+        self._buffer = value if isinstance(value, memoryview) else memoryview(value)
+        self._hex = None
+
+    def hex(self) -> str:
+        if self._hex is None:
+            self._hex = self._buffer.hex()
+        return self._hex
+
+    def to_0x_hex(self) -> str:
+        return "0x" + self.hex()
+
+    def __bytes__(self) -> bytes:
+        return self._buffer.tobytes()
+
+    def __str__(self) -> str:
+        return self.hex()
+
+    def __repr__(self) -> str:
+        return f"Bytes('{self.hex()}')"
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Bytes):
+            return self._buffer == other._buffer
+        if isinstance(other, str):
+            return len(other) == 2 * self._buffer.nbytes and self.hex() == other
+        return NotImplemented
+
+    def __lt__(self, other) -> bool:
+        if isinstance(other, (Bytes, str)):
+            return self.hex() < str(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.hex())
+
+    def __len__(self) -> int:
+        return 2 * self._buffer.nbytes
+
+    def __getitem__(self, key):
+        return self.hex()[key]
+
+    def __contains__(self, item) -> bool:
+        return str(item) in self.hex()
+
+    def __add__(self, other):
+        return self.hex() + other
+
+    def __radd__(self, other):
+        return other + self.hex()
+
+    def __reduce__(self):
+        return (Bytes, (bytes(self),))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        # Any other str method (startswith, upper, ...) works on the hex representation
+        return getattr(self.hex(), name)
+
 
 @dataclass
 class Chain:
@@ -81,11 +163,23 @@ class Block:
         return hash(self.hash)
 
 
+class TxDetails(NamedTuple):
+    """Transaction data that isn't in the logs, set by the enrichment (see tx_enrichment)"""
+
+    from_: Address
+    to: Optional[Address]
+    value: int
+    gas: int
+    gas_price: Optional[int]
+    nonce: int
+
+
 @dataclass
 class Tx:
     hash: Hash
     index: int
     block: Block
+    details: Optional[TxDetails] = dataclass_field(default=None, compare=False, repr=False)
 
 
 @dataclass
@@ -116,7 +210,9 @@ class Event:
 
     @property
     def topic(self) -> Hash:
-        return Hash(event_abi_to_log_topic({"inputs": self.args._components, "name": self.name, "type": "event"}))
+        return Hash.from_bytes32(
+            event_abi_to_log_topic({"inputs": self.args._components, "name": self.name, "type": "event"})
+        )
 
 
 INT_TYPE_REGEX = re.compile(r"int\d+|uint\d+")
@@ -137,10 +233,10 @@ def arg_from_solidity_type(type_: str) -> Type:
     if type_ == "bytes32":
         return Hash
     if type_ == "bytes":
-        return lambda x: x.hex()
+        return Bytes
     if BYTES_TYPE_REGEX.match(type_):
         # TODO: handle bytes4 or other special cases
-        return lambda x: x.hex()
+        return Bytes
     if type_ == "address":
         return Address
     raise RuntimeError(f"Unsupported type {type_}")
@@ -10,17 +10,24 @@ from web3 import Web3
 from web3.exceptions import ExtraDataLengthError
 from web3.middleware import ExtraDataToPOAMiddleware
 
-from eth_pretty_events import address_book
+from eth_pretty_events import address_book, metrics
 from eth_pretty_events.cli import (
+    _block_chunks,
     _env_alchemy_keys,
     _env_globals,
     _env_int,
     _env_list,
+    _export_rules_profile,
     _setup_address_book,
     _setup_web3,
     load_events,
     main,
+    render_events,
 )
+from eth_pretty_events.outputs import DecodedTxLogs
+from eth_pretty_events.render import RenderCache
+
+from . import factories
 
 __author__ = "Guillermo M. Narvaja"
 __copyright__ = "Guillermo M. Narvaja"
@@ -190,6 +197,7 @@ def test_env_globals(bytes32_rainbow_file, chains_file, expected_subset_b32, exp
         bytes32_rainbow=Path(bytes32_rainbow_file) if bytes32_rainbow_file else None,
         chains_file=Path(chains_file) if chains_file else None,
         chain_id="1",
+        cache_dir=None,
     )
 
     ret = _env_globals(args, None)
@@ -273,3 +281,85 @@ def test_load_alchemy_keys():
         _env_alchemy_keys({"ALCHEMY_WEBHOOK_MYKEY1_ID": "wh_6kmi7uom6hn97voi"})
 
     assert _env_alchemy_keys({"SOME_VARIABLE": "foobar"}) == {}
+
+
+def test_export_rules_profile_replaces_collector():
+    collectors = len(metrics.REGISTRY._collectors)
+    _export_rules_profile([])
+    _export_rules_profile([])
+    assert len(metrics.REGISTRY._collectors) == collectors + 1
+
+
+def _render_events_to_outputs(tmp_path, renv=None, render_cache=None):
+    """Renders two blocks with two outputs and returns what each output received and the resume file"""
+    blocks = {n: factories.Block(number=n) for n in (1, 2)}
+    txs = {n: [DecodedTxLogs(factories.Tx(block=blocks[n]), [], []) for _ in range(2)] for n in blocks}
+    received = [[], []]
+    outputs = [MagicMock(render_cache=render_cache), MagicMock(render_cache=render_cache)]
+    for output, output_received in zip(outputs, received):
+        output.run_sync.side_effect = output_received.extend
+    if renv is None:
+        renv = MagicMock(tx_enricher=None)
+        renv.args.token_metadata = None
+    renv.args.subscriptions_resume_file = str(tmp_path / "resume.txt")
+    renv.args.profile_rules = False
+    render_stage = MagicMock()
+    # One-shot generators, like the ones of the render stage
+    render_stage.render.side_effect = lambda logs: (tx_logs for tx_logs in logs)
+
+    with patch("eth_pretty_events.cli.build_outputs", return_value=outputs), patch(
+        "eth_pretty_events.cli.build_render_stage", return_value=render_stage
+    ), patch(
+        "eth_pretty_events.cli.decode_events.decode_events_from_block",
+        side_effect=lambda number, w3, chain: iter(txs[number]),
+    ):
+        render_events(renv, "1-2")
+    assert received == [txs[1] + txs[2]] * 2
+    return outputs, (tmp_path / "resume.txt").read_text()
+
+
+def test_render_events_multiple_outputs(tmp_path):
+    outputs, resume = _render_events_to_outputs(tmp_path)
+    # Sent block by block
+    assert outputs[0].run_sync.call_count == 2
+    assert resume == "3\n"
+
+
+def test_render_events_shared_render_cache(tmp_path):
+    render_cache = RenderCache(maxsize=1)
+    render_cache.get_or_render(factories.Event(), "template.j2", lambda: "rendered")
+    outputs, _ = _render_events_to_outputs(tmp_path, render_cache=render_cache)
+    # Cleared after all the outputs used it (see test_block_chunks for the chunks sized by the cache)
+    assert outputs[0].run_sync.call_count == 2
+    assert len(render_cache) == 0
+
+
+def test_block_chunks():
+    blocks = [factories.Block(), factories.Block()]
+    txs = [
+        DecodedTxLogs(factories.Tx(block=block), [{}] * n_events, [])
+        for block, n_events in [(blocks[0], 2), (blocks[0], 3), (blocks[0], 1), (blocks[1], 1)]
+    ]
+    assert list(_block_chunks(txs)) == [txs[:3], txs[3:]]
+    assert list(_block_chunks(txs, max_txs=2)) == [txs[:2], txs[2:3], txs[3:]]
+    assert list(_block_chunks(txs, max_events=4)) == [txs[:1], txs[1:3], txs[3:]]
+    assert list(_block_chunks(txs, max_events=1)) == [txs[:1], txs[1:2], txs[2:3], txs[3:]]
+
+
+def test_render_events_token_metadata_multiple_outputs(tmp_path):
+    renv = MagicMock(tx_enricher=None)
+    renv.args.token_metadata = "on"
+    cache = MagicMock()
+    with patch("eth_pretty_events.cli.token_metadata.get_default", return_value=cache), patch(
+        "eth_pretty_events.cli._save_token_metadata"
+    ) as save:
+        _render_events_to_outputs(tmp_path, renv)
+    assert cache.prefetch.call_count == 2  # Once per block
+    save.assert_called_once_with(renv.args)
+
+
+def test_render_events_tx_enrichment_multiple_outputs(tmp_path):
+    renv = MagicMock()
+    renv.args.token_metadata = None
+    _render_events_to_outputs(tmp_path, renv)
+    assert renv.tx_enricher.enrich_tx_logs.call_count == 2  # Once per block
@@ -0,0 +1,74 @@
+import numpy as np
+
+from eth_pretty_events.columnar import AddressColumn, to_columnar
+from eth_pretty_events.outputs import DecodedTxLogs
+
+from . import factories
+
+
+def _tx_logs(events):
+    tx = factories.Tx()
+    for evt in filter(None, events):
+        evt.tx = tx
+    return DecodedTxLogs(tx=tx, raw_logs=[{} for _ in events], decoded_logs=events)
+
+
+def test_to_columnar_groups_by_event_type():
+    transfers = [factories.Event(name="Transfer") for _ in range(3)]
+    approval = factories.Event(name="Approval")
+    logs = [_tx_logs(transfers[:2] + [None]), _tx_logs([approval, transfers[2]])]
+
+    batches = list(to_columnar(logs))
+
+    assert [(batch.name, len(batch)) for batch in batches] == [("Transfer", 3), ("Approval", 1)]
+    transfer_batch = batches[0]
+    assert transfer_batch.block_number.dtype == np.int64
+    assert list(transfer_batch.block_number) == [evt.tx.block.number for evt in transfers]
+    assert list(transfer_batch.log_index) == [evt.log_index for evt in transfers]
+    assert list(transfer_batch.tx_hash) == [evt.tx.hash for evt in transfers]
+    assert transfer_batch.address.to_list() == [evt.address for evt in transfers]
+    assert isinstance(transfer_batch.args["from"], AddressColumn)
+    assert transfer_batch.args["from"].to_list() == [evt.args.from_ for evt in transfers]
+    assert list(transfer_batch.args["value"]) == [evt.args.value for evt in transfers]
+
+
+def test_to_columnar_batch_size():
+    events = [factories.Event(name="Transfer") for _ in range(5)]
+
+    batches = list(to_columnar([_tx_logs(events)], batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_to_columnar_uint256_fallback():
+    small = factories.Event(name="Transfer", args=factories.TransferArgs(value=10**6))
+    big = factories.Event(name="Transfer", args=factories.TransferArgs(value=2**255))
+
+    (batch,) = to_columnar([_tx_logs([small])])
+    assert batch.args["value"].dtype == np.uint64
+
+    (batch,) = to_columnar([_tx_logs([small, big])])
+    assert batch.args["value"].dtype == object
+    assert list(batch.args["value"]) == [10**6, 2**255]
+
+
+def test_to_columnar_flattens_structs():
+    events = [factories.Event(name="NewPolicy") for _ in range(2)]
+
+    (batch,) = to_columnar([_tx_logs(events)])
+
+    assert batch.args["policy.start"].dtype == np.uint64  # uint40
+    assert list(batch.args["policy.start"]) == [evt.args.policy.start for evt in events]
+    assert batch.args["policy.riskModule"].to_list() == [evt.args.policy.riskModule for evt in events]
+
+
+def test_address_column_interning():
+    addresses = [factories.Event().address for _ in range(2)]
+    events = [factories.Event(name="Approval", address=addresses[i % 2]) for i in range(4)]
+
+    (batch,) = to_columnar([_tx_logs(events)])
+
+    assert batch.address.values == addresses
+    assert list(batch.address.codes) == [0, 1, 0, 1]
+    assert list(batch.address.mask(addresses[1])) == [False, True, False, True]
+    assert not batch.address.mask("0x0000000000000000000000000000000000000001").any()
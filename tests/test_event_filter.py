@@ -5,7 +5,8 @@ from eth_utils import keccak, to_checksum_address
 from web3.constants import ADDRESS_ZERO
 
 from eth_pretty_events import address_book, event_filter
-from eth_pretty_events.types import Address
+from eth_pretty_events.event_parser import EventDefinition
+from eth_pretty_events.types import Address, Bytes
 
 from . import factories
 
@@ -279,3 +280,388 @@ def test_get_topic0_with_hash():
     event_string = "Transfer(address from, address to, uint256 value)"
     expected_topic = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
     assert event_filter.get_topic0(event_string) == expected_topic
+
+
+def test_template_rule_set_index():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {"template": "usdc-transfer", "match": [{"name": "Transfer"}, {"address": "USDC"}]},
+                {"template": "ensuro", "match": [{"address": "ENSURO"}]},
+                {"template": "approval", "match": [{"name": "Approval"}]},
+                {"template": "transfer", "match": [{"name": "Transfer"}]},
+                {"template": "generic", "match": [{"filter_type": "true"}]},
+                {"template": "never", "match": [{"name": "Transfer"}]},
+            ]
+        }
+    )
+    assert isinstance(rules, event_filter.TemplateRuleSet)
+    assert [rule.template for rule in rules] == [
+        "usdc-transfer",
+        "ensuro",
+        "approval",
+        "transfer",
+        "generic",
+        "never",
+    ]
+
+    transfer = factories.Event(name="Transfer", address=ADDRESSES["ENSURO"])
+    assert [rule.template for rule in rules.candidates(transfer)] == [
+        "usdc-transfer",
+        "ensuro",
+        "transfer",
+        "generic",
+        "never",
+    ]
+    assert event_filter.find_template(rules, transfer) == "ensuro"
+    assert event_filter.find_template(rules, factories.Event(name="Transfer")) == "transfer"
+
+    new_policy = factories.Event(name="NewPolicy")
+    assert [rule.template for rule in rules.candidates(new_policy)] == ["generic"]
+    assert event_filter.find_template(rules, new_policy) == "generic"
+
+
+def test_template_rule_set_with_tags():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {"template": "alert-transfer", "match": [{"name": "Transfer"}], "tags": ["alerts"]},
+                {"template": "transfer", "match": [{"name": "Transfer"}]},
+                {"template": "generic", "match": [{"filter_type": "true"}], "tags": ["alerts", "logs"]},
+            ]
+        }
+    )
+    assert rules.with_tags(None) is rules
+
+    alerts = rules.with_tags(["alerts"])
+    assert [rule.template for rule in alerts] == ["alert-transfer", "generic"]
+    assert rules.with_tags(["alerts"]) is alerts
+    assert alerts[0] is rules[0]
+    assert event_filter.find_template(alerts, factories.Event(name="Approval")) == "generic"
+
+    assert [rule.template for rule in rules.with_tags(["logs", "other"])] == ["generic"]
+    assert len(rules.with_tags([])) == 0
+
+    plain = event_filter.rules_for_tags(list(rules), ["alerts"])
+    assert isinstance(plain, event_filter.TemplateRuleSet)
+    assert list(plain) == list(alerts)
+
+
+def test_template_rule_set_topic_index():
+    transfer_topic = event_filter.get_topic0("Transfer(address from, address to, uint256 value)")
+    EventDefinition.from_abi({"type": "event", "name": "Transfer", "inputs": factories.TRANSFER_ABI})
+    try:
+        rules = event_filter.read_template_rules(
+            {
+                "rules": [
+                    {"template": "transfer", "match": [{"filter_type": "topic", "value": transfer_topic}]},
+                    {"template": "unknown", "match": [{"filter_type": "topic", "value": "Unknown(uint256 value)"}]},
+                ]
+            }
+        )
+    finally:
+        EventDefinition.reset_registry()
+
+    assert [rule.template for rule in rules.candidates(factories.Event(name="Transfer"))] == ["transfer", "unknown"]
+    assert [rule.template for rule in rules.candidates(factories.Event(name="Approval"))] == ["unknown"]
+    assert event_filter.find_template(rules, factories.Event(name="Transfer")) == "transfer"
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"name": "Transfer"},
+        {"address": "USDC"},
+        {"filter_type": "known_address", "is_known": True},
+        {"filter_type": "topic", "value": "Transfer(address from, address to, uint256 value)"},
+        {"filter_type": "arg", "arg_name": "value", "arg_value": "10", "operator": "gt", "transform": "amount"},
+        {"filter_type": "arg_exists", "arg_name": "policy.payout"},
+        {"filter_type": "known_address_arg", "arg_name": "from", "arg_value": True},
+        {"not": {"name": "Transfer"}},
+        {"or": [{"name": "Approval"}, {"and": [{"address": "USDC"}, {"filter_type": "true"}]}]},
+        {"and": [{"name": "Transfer"}, {"filter_type": "arg", "arg_name": "to", "arg_value": ADDRESSES["ENSURO"]}]},
+        {"and": []},
+        {"or": []},
+    ],
+)
+def test_compiled_filter_matches_interpreted(config):
+    filter_ = event_filter.EventFilter.from_config(config)
+    compiled = filter_.compile()
+    events = [
+        factories.Event(name="Transfer", address=ADDRESSES["USDC"]),
+        factories.Event(name="Transfer", args=factories.TransferArgs(from_=ADDRESSES["USDC"], to=ADDRESSES["ENSURO"])),
+        factories.Event(name="Approval"),
+    ]
+    for event in events:
+        try:
+            expected = filter_.filter(event)
+        except KeyError:
+            with pytest.raises(KeyError):
+                compiled(event)
+        else:
+            assert compiled(event) == expected
+
+
+def test_compiled_filter_custom_filters():
+    class NoneFilter(event_filter.NameEventFilter):
+        def filter(self, evt):
+            return None  # Neither True nor False
+
+    and_filter = event_filter.AndEventFilter([NoneFilter("Transfer"), event_filter.NameEventFilter("Transfer")])
+    or_filter = event_filter.OrEventFilter([NoneFilter("Transfer")])
+    event = factories.Event(name="Transfer")
+
+    assert and_filter.compile()(event) is and_filter.filter(event) is True
+    assert or_filter.compile()(event) is or_filter.filter(event) is False
+
+
+def test_adaptive_and_reorders_by_selectivity():
+    name_filter = event_filter.NameEventFilter("Transfer")
+    adaptive = event_filter.AdaptiveAndEventFilter(
+        [event_filter.TrueEventFilter(), name_filter], sample_every=1, reorder_every=10
+    )
+    for _ in range(10):
+        assert adaptive.filter(factories.Event(name="Approval")) is False
+    assert adaptive.order[0] is name_filter
+    assert adaptive.filter(factories.Event(name="Transfer")) is True
+
+
+def test_adaptive_and_keeps_impure_filters_in_place():
+    calls = []
+
+    class CountingFilter(event_filter.EventFilter):
+        def filter(self, evt):
+            calls.append(evt)
+            return True
+
+    counting = CountingFilter()
+    name_filter = event_filter.NameEventFilter("Transfer")
+    adaptive = event_filter.AdaptiveAndEventFilter(
+        [event_filter.TrueEventFilter(), counting, event_filter.TrueEventFilter(), name_filter],
+        sample_every=1,
+        reorder_every=5,
+    )
+    for _ in range(20):
+        adaptive.filter(factories.Event(name="Approval"))
+    assert adaptive.order[1] is counting
+    assert adaptive.order[2] is name_filter
+    assert len(calls) == 20
+
+
+def test_adaptive_and_falls_back_to_config_order():
+    adaptive = event_filter.AdaptiveAndEventFilter(
+        [
+            event_filter.NameEventFilter("Transfer"),
+            event_filter.ArgEventFilter(arg_name="value", arg_value=0, operator="gt"),
+        ]
+    )
+    adaptive._order = (1, 0)
+    # The arg filter raises for events without `value`, but in config order the name rejects it first
+    assert adaptive.filter(factories.Event(name="NewPolicy")) is False
+
+
+def test_adaptive_filters_keep_template_choice():
+    rules = [
+        {"template": "big-transfer", "match": [{"address": "USDC"}, {"name": "Transfer"}]},
+        {
+            "template": "ensuro",
+            "match": [
+                {"filter_type": "known_address", "is_known": True},
+                {"or": [{"name": "Transfer"}, {"name": "Approval"}]},
+                {"filter_type": "arg", "arg_name": "value", "arg_value": "100", "operator": "gt", "transform": "wad"},
+            ],
+        },
+        {"template": "not-transfer", "match": [{"filter_type": "true"}, {"not": {"name": "Transfer"}}]},
+        {"template": "generic", "match": [{"filter_type": "true"}]},
+    ]
+    plain = event_filter.read_template_rules({"rules": rules})
+    adaptive = event_filter.read_template_rules(
+        {"rules": rules, "adaptive_filters": {"sample_every": 3, "reorder_every": 7}}
+    )
+    assert isinstance(adaptive[1].match, event_filter.AdaptiveAndEventFilter)
+
+    addresses = list(ADDRESSES.values()) + [factories.Event().address]
+    for i in range(200):
+        event = factories.Event(name=["Transfer", "Approval"][i % 2], address=addresses[i % len(addresses)])
+        assert event_filter.find_template(adaptive, event) == event_filter.find_template(plain, event)
+
+
+def test_rules_profiler():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {"template": "transfer", "match": [{"name": "Transfer"}], "tags": ["alerts"]},
+                {"template": "never", "match": [{"name": "Transfer"}, {"address": "USDC"}]},
+                {"template": "generic", "match": [{"filter_type": "true"}]},
+            ]
+        },
+        profile=True,
+    )
+    events = [
+        factories.Event(name="Transfer", tx=factories.Tx(block=factories.Block(number=number)))
+        for number in (30, 10, 20)
+    ] + [factories.Event(name="Approval")]
+    for event in events:
+        event_filter.find_template(rules, event)
+    # Subsets share the stats
+    event_filter.find_template(rules.with_tags(["alerts"]), events[0])
+
+    transfer, never, generic = (rule.stats for rule in rules)
+    assert (transfer.evaluations, transfer.matches) == (4, 4)
+    assert (transfer.first_match_block, transfer.last_match_block) == (10, 30)
+    assert (never.evaluations, never.matches, never.first_match_block) == (0, 0, None)
+    assert (generic.evaluations, generic.matches) == (1, 1)
+    assert transfer.time_ns > 0
+
+    table = event_filter.format_rules_profile(rules).splitlines()
+    assert table[0].split() == [
+        "#",
+        "template",
+        "evaluations",
+        "matches",
+        "match",
+        "%",
+        "total",
+        "ms",
+        "avg",
+        "us",
+        "first",
+        "block",
+        "last",
+        "block",
+    ]
+    assert table[2].split()[:5] == ["0", "transfer", "4", "4", "100.0"]
+    assert table[2].split()[-2:] == ["10", "30"]
+    assert table[3].split()[-2:] == ["-", "-"]
+
+    lines = event_filter.rules_profile_metrics(rules)
+    assert 'eth_pretty_events_rule_matches_total{rule="0",template="transfer"} 4' in lines
+    assert 'eth_pretty_events_rule_last_match_block{rule="0",template="transfer"} 30' in lines
+
+
+def test_rules_profiler_disabled():
+    rules = event_filter.read_template_rules({"rules": [{"template": "generic", "match": [{"filter_type": "true"}]}]})
+    event_filter.find_template(rules, factories.Event())
+    assert rules[0].stats is None
+
+
+def test_template_rule_set_memoization():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {
+                    "template": "big-transfer",
+                    "match": [
+                        {"name": "Transfer"},
+                        {"filter_type": "arg", "arg_name": "value", "arg_value": 100, "operator": "gt"},
+                    ],
+                },
+                {"template": "usdc", "match": [{"address": "USDC"}]},
+                {"template": "policy", "match": [{"filter_type": "arg_exists", "arg_name": "policy.payout"}]},
+            ],
+            "memo_size": 2,
+        }
+    )
+    evaluations = []
+    for rule in rules:
+        rule.matches = (lambda matches, template: lambda evt: evaluations.append(template) or matches(evt))(
+            rule.matches, rule.template
+        )
+
+    def transfer(value, address=ADDRESSES["USDC"]):
+        return factories.Event(name="Transfer", address=address, args=factories.TransferArgs(value=value))
+
+    assert rules.find(transfer(1000)).template == "big-transfer"
+    assert rules.find(transfer(1000)).template == "big-transfer"
+    assert evaluations == ["big-transfer"]
+
+    # The key includes the values of the args read by the rules
+    assert rules.find(transfer(5)).template == "usdc"
+    assert evaluations == ["big-transfer", "big-transfer", "usdc"]
+    assert rules.find(transfer(5, ADDRESSES["ENSURO"])) is None
+
+    # LRU eviction (memo_size=2)
+    evaluations.clear()
+    rules.find(transfer(1000))
+    assert evaluations == ["big-transfer"]
+    assert len(rules._memo) == 2
+
+    new_policy = factories.Event(name="NewPolicy")
+    assert rules.find(new_policy).template == "policy"
+    assert rules.find(factories.Event(name="NewPolicy", address=new_policy.address)).template == "policy"
+
+
+def test_template_rule_set_memoization_keeps_bytes_lazy():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {
+                    "template": "data",
+                    "match": [{"filter_type": "arg", "arg_name": "data", "arg_value": "0102", "operator": "eq"}],
+                }
+            ]
+        }
+    )
+
+    def event(data):
+        return factories.Event(name="Data", address=ADDRESSES["USDC"], args={"data": Bytes(data)})
+
+    assert rules.find(event(b"\x01\x02")).template == "data"
+    memoized = event(b"\x01\x02")
+    assert rules.find(memoized).template == "data"
+    assert memoized.args["data"]._hex is None  # Not hex-encoded
+    assert rules.find(event(b"\x01\x03")) is None
+
+
+def test_template_rule_set_memoization_disabled_with_custom_filters():
+    class CustomFilter(event_filter.EventFilter):
+        def filter(self, evt):
+            return evt.tx.index % 2 == 0
+
+    rules = event_filter.TemplateRuleSet([event_filter.TemplateRule(template="even", match=CustomFilter())])
+    assert rules._memo is None
+    event = factories.Event(tx=factories.Tx(index=2))
+    assert rules.find(event).template == "even"
+    event.tx.index = 3
+    assert rules.find(event) is None
+
+    assert event_filter.TemplateRuleSet([], memo_size=0)._memo is None
+
+
+def test_find_all_templates():
+    rules = event_filter.read_template_rules(
+        {
+            "rules": [
+                {"template": "short", "match": [{"name": "Transfer"}], "continue": True},
+                {"template": "usdc-audit", "match": [{"address": "USDC"}], "continue": True},
+                {"template": "detailed", "match": [{"name": "Transfer"}]},
+                {"template": "generic", "match": [{"filter_type": "true"}]},
+            ]
+        }
+    )
+    assert rules[0].continue_ and not rules[2].continue_
+
+    usdc_transfer = factories.Event(name="Transfer", address=ADDRESSES["USDC"])
+    assert event_filter.find_templates(rules, usdc_transfer) == ["short", "usdc-audit", "detailed"]
+    assert event_filter.find_templates(rules, usdc_transfer) == ["short", "usdc-audit", "detailed"]  # memoized
+    assert event_filter.find_template(rules, usdc_transfer) == "short"
+    assert event_filter.find_templates(rules, factories.Event(name="Transfer")) == ["short", "detailed"]
+    assert event_filter.find_templates(rules, factories.Event(name="Approval")) == ["generic"]
+    assert event_filter.find_templates(list(rules), factories.Event(name="Approval")) == ["generic"]
+    assert event_filter.find_templates([], factories.Event(name="Approval")) == []
+
+
+def test_adaptive_and_sampling_keeps_results():
+    adaptive = event_filter.AdaptiveAndEventFilter(
+        [
+            event_filter.ArgEventFilter(arg_name="value", arg_value=0, operator="gt"),
+            event_filter.NameEventFilter("Transfer"),
+        ],
+        sample_every=4,
+        reorder_every=1000,
+    )
+    adaptive._order = (1, 0)
+    event = factories.Event(name="NewPolicy")
+    # The arg filter raises for events without `value`, but the name filter runs first in the adapted order
+    assert [adaptive.filter(event) for _ in range(10)] == [False] * 10
+    assert adaptive._samples[0] == 2
@@ -2,9 +2,18 @@ import pytest
 from eth_utils.crypto import keccak
 
 from eth_pretty_events import address_book
-from eth_pretty_events.event_subscriptions import TopicTransforms, load_subscriptions
+from eth_pretty_events.event_filter import get_topic0, read_template_rules
+from eth_pretty_events.event_parser import EventDefinition
+from eth_pretty_events.event_subscriptions import (
+    SubscriptionPlan,
+    TopicTransforms,
+    load_subscriptions,
+    plan_subscriptions,
+)
 from eth_pretty_events.types import Address, Hash
 
+from . import factories
+
 ADDRESSES = {
     "USDC": Address("0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174"),
     "NATIVE_USDC": Address("0x3c499c542cEF5E3811e1192ce70d8cC03d5c3359"),
@@ -117,3 +126,92 @@ def test_load_subscriptions_unknown_address(addr_book):
     }
     with pytest.raises(RuntimeError, match=f"Address not found for name {name}"):
         list(load_subscriptions(subscriptions_config, addr_book))
+
+
+TRANSFER_TOPIC = Hash(get_topic0("Transfer(address from, address to, uint256 value)"))
+APPROVAL_TOPIC = Hash(get_topic0("Approval(address owner, address spender, uint256 value)"))
+
+
+@pytest.fixture
+def transfer_and_approval():
+    EventDefinition.from_abi({"type": "event", "name": "Transfer", "inputs": factories.TRANSFER_ABI})
+    EventDefinition.from_abi({"type": "event", "name": "Approval", "inputs": factories.APPROVAL_ABI})
+    yield
+    EventDefinition.reset_registry()
+
+
+def _plan(addr_book, rules):
+    return SubscriptionPlan.from_rules(read_template_rules({"rules": rules}))
+
+
+def test_subscription_plan_from_rules(addr_book, transfer_and_approval):
+    plan = _plan(
+        addr_book,
+        [
+            {"template": "usdc-transfer", "match": [{"name": "Transfer"}, {"address": "USDC"}]},
+            {"template": "approval", "match": [{"filter_type": "topic", "value": APPROVAL_TOPIC}]},
+        ],
+    )
+    assert plan.topics == {TRANSFER_TOPIC, APPROVAL_TOPIC}
+    assert plan.addresses is None
+
+    plan = _plan(
+        addr_book,
+        [
+            {"template": "a", "match": [{"name": "Transfer"}, {"or": [{"address": "USDC"}, {"address": "ENSURO"}]}]},
+            {"template": "b", "match": [{"name": "Transfer"}, {"address": "USDC"}]},
+        ],
+    )
+    assert plan.topics == {TRANSFER_TOPIC}
+    assert plan.addresses == {ADDRESSES["USDC"], ADDRESSES["ENSURO"]}
+
+    # Unknown event names can't match, generic rules match anything
+    assert _plan(addr_book, [{"template": "a", "match": [{"name": "Unknown"}]}]).topics == frozenset()
+    plan = _plan(addr_book, [{"template": "a", "match": [{"not": {"name": "Transfer"}}]}])
+    assert (plan.topics, plan.addresses) == (None, None)
+
+
+def test_subscription_plan_narrow(addr_book, transfer_and_approval):
+    plan = _plan(addr_book, [{"template": "usdc-transfer", "match": [{"name": "Transfer"}, {"address": "USDC"}]}])
+
+    assert plan.narrow(("all", [], [])) == ("all", [ADDRESSES["USDC"]], [[TRANSFER_TOPIC]])
+    assert plan.narrow(("usdc", [ADDRESSES["USDC"], ADDRESSES["ENSURO"]], [[TRANSFER_TOPIC, APPROVAL_TOPIC]])) == (
+        "usdc",
+        [ADDRESSES["USDC"]],
+        [[TRANSFER_TOPIC]],
+    )
+    assert plan.narrow(("deposit", [ADDRESSES["USDC"]], [TRANSFER_TOPIC, None])) == (
+        "deposit",
+        [ADDRESSES["USDC"]],
+        [TRANSFER_TOPIC, None],
+    )
+    assert plan.narrow(("ensuro", [ADDRESSES["ENSURO"]], [])) is None
+    assert plan.narrow(("approvals", [], [APPROVAL_TOPIC])) is None
+    # Raw topics that aren't hashes are kept
+    assert plan.narrow(("raw", [ADDRESSES["USDC"]], ["Deposit"])) == ("raw", [ADDRESSES["USDC"]], ["Deposit"])
+
+    subscriptions = [("ensuro", [ADDRESSES["ENSURO"]], []), ("usdc", [ADDRESSES["USDC"]], [TRANSFER_TOPIC])]
+    assert list(plan_subscriptions(subscriptions, plan)) == subscriptions[1:]
+
+
+def test_subscription_plan_narrow_nothing_matches(addr_book, transfer_and_approval, caplog):
+    plan = _plan(addr_book, [{"template": "a", "match": [{"name": "NotLoadedEvent"}]}])
+    assert plan.topics == frozenset()
+    assert plan.narrow(("all", [], [])) is None
+    assert plan.narrow(("usdc", [ADDRESSES["USDC"]], [TRANSFER_TOPIC])) is None
+    assert "No template rule can match any log" in caplog.text
+    assert _plan(addr_book, []).narrow(("all", [], [])) is None
+
+
+def test_subscription_plan_report(addr_book, transfer_and_approval):
+    plan = _plan(addr_book, [{"template": "transfer", "match": [{"name": "Transfer"}]}])
+    plan.observe(
+        [
+            {"address": ADDRESSES["USDC"], "topics": [bytes.fromhex(TRANSFER_TOPIC[2:])]},
+            {"address": ADDRESSES["USDC"], "topics": [bytes.fromhex(APPROVAL_TOPIC[2:])]},
+            {"address": ADDRESSES["ENSURO"], "topics": []},
+            {"address": ADDRESSES["ENSURO"], "topics": [TRANSFER_TOPIC]},
+        ]
+    )
+    assert (plan.seen, plan.skipped) == (4, 2)
+    assert "2 of 4 logs (50.0%)" in plan.summary()
@@ -7,7 +7,7 @@ import pytest
 from jinja2 import Environment, FunctionLoader
 from web3.datastructures import ReadableAttributeDict
 
-from eth_pretty_events import jinja2_ext
+from eth_pretty_events import jinja2_ext, metrics
 from eth_pretty_events.address_book import AddrToNameAddressBook
 from eth_pretty_events.address_book import setup_default as setup_addr_book
 from eth_pretty_events.cli import RenderingEnv
@@ -194,3 +194,13 @@ def test_alchemy_webhook_with_failed_messages(test_client, renv):
         )
         assert response.status_code == 200
         assert response.json == {"status": "OK", "ok_count": 0, "failed_count": 1}
+
+
+def test_metrics_endpoint(test_client):
+    counter = metrics.counter("eth_pretty_events_test_total", "Test counter")
+    counter.inc()
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert "eth_pretty_events_test_total 1" in response.text.splitlines()
@@ -1,4 +1,5 @@
 import json
+from unittest.mock import patch
 
 import pytest
 from jinja2 import Environment
@@ -7,12 +8,15 @@ from web3.constants import ADDRESS_ZERO
 from eth_pretty_events.address_book import AddrToNameAddressBook, setup_default
 from eth_pretty_events.jinja2_ext import (
     _explorer_url,
+    add_filters,
     address,
     address_explorer_link,
     address_link,
     autoformat_arg,
+    bind_link_filters,
     block_explorer_link,
     block_link,
+    explorer_urls,
     is_struct,
     ratio_wad,
     role,
@@ -231,3 +235,41 @@ def test_autoformat_arg(setup_environment, arg_value, arg_abi, expected_output):
 )
 def test_ratio_wad(input_value, expected_output):
     assert ratio_wad(input_value) == expected_output
+
+
+def test_bind_link_filters(setup_environment):
+    env = setup_environment
+    env.globals["chain_id"] = 137
+    env.globals["chains"] = {chain["chainId"]: chain for chain in env.globals["chains"]}
+    env.globals["explorer_urls"] = explorer_urls(env.globals["chains"])
+    assert env.globals["explorer_urls"][137] == "https://polygonscan.com"
+    assert env.globals["explorer_urls"][1] == "https://etherscan.io"
+    add_filters(env)
+    bind_link_filters(env)
+
+    addr = "0x1234567890abcdef1234567890abcdef12345678"
+    setup_default(AddrToNameAddressBook({addr: "Mocked Name"}))
+    with patch("eth_pretty_events.jinja2_ext._explorer_url", side_effect=AssertionError("Already resolved")):
+        template = env.from_string(
+            "{{ tx | tx_link }} {{ block | block_link }} {{ addr | address_link }} {{ zero | address_link }}"
+        )
+        assert template.render(tx="0xabcd", block=12, addr=addr, zero=ADDRESS_ZERO) == (
+            "[0xabcd](https://polygonscan.com/tx/0xabcd) [12](https://polygonscan.com/block/12) "
+            f"[Mocked Name](https://polygonscan.com/address/{addr}) 0x0"
+        )
+        assert (
+            autoformat_arg(env, addr, {"type": "address"}) == f"[Mocked Name](https://polygonscan.com/address/{addr})"
+        )
+
+    # Cached by address book
+    setup_default(AddrToNameAddressBook({addr: "Other Name"}))
+    assert env.from_string("{{ addr | address_link }}").render(addr=addr).startswith("[Other Name]")
+
+
+def test_bind_link_filters_unknown_chain():
+    env = Environment()
+    env.globals["chain_id"] = 1
+    env.globals["chains"] = {}
+    add_filters(env)
+    bind_link_filters(env)
+    assert env.filters["tx_link"] is tx_link
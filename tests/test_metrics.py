@@ -0,0 +1,79 @@
+import asyncio
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from eth_pretty_events import metrics
+
+
+def test_counter_and_gauge():
+    registry = metrics.Registry()
+    counter = registry.counter("test_events_total", "Events seen", ["output"])
+    counter.inc(output="print")
+    counter.inc(2, output="print")
+    counter.inc(output='dis"cord')
+    assert counter.get(output="print") == 3
+    with pytest.raises(ValueError, match="Counters can only increase"):
+        counter.inc(-1, output="print")
+    with pytest.raises(ValueError, match="expects labels"):
+        counter.inc(other="x")
+
+    gauge = registry.gauge("test_queue_depth", "Queue depth")
+    gauge.set(5)
+    gauge.dec()
+    assert gauge.get() == 4
+
+    assert registry.counter("test_events_total", "Events seen", ["output"]) is counter
+    with pytest.raises(ValueError, match="already registered"):
+        registry.gauge("test_events_total", "Events seen", ["output"])
+
+    assert registry.render().splitlines() == [
+        "# HELP test_events_total Events seen",
+        "# TYPE test_events_total counter",
+        'test_events_total{output="dis\\"cord"} 1',
+        'test_events_total{output="print"} 3',
+        "# HELP test_queue_depth Queue depth",
+        "# TYPE test_queue_depth gauge",
+        "test_queue_depth 4",
+    ]
+
+
+def test_collectors():
+    registry = metrics.Registry()
+
+    def collector():
+        return ["# TYPE test_dynamic gauge", "test_dynamic 42"]
+
+    registry.add_collector(collector)
+    assert registry.render() == "# TYPE test_dynamic gauge\ntest_dynamic 42\n"
+    registry.remove_collector(collector)
+    assert registry.render() == "\n"
+
+
+@pytest.mark.asyncio
+async def test_monitor_loop_lag():
+    monitor = asyncio.create_task(metrics.monitor_loop_lag(interval=0.01))
+    await asyncio.sleep(0.02)
+    time.sleep(0.2)  # Blocks the event loop
+    await asyncio.sleep(0.02)
+    monitor.cancel()
+
+    assert metrics.REGISTRY.gauge(
+        "eth_pretty_events_event_loop_lag_max_seconds", "Max delay of the event loop wake ups"
+    ).get() == pytest.approx(0.2, abs=0.1)
+
+
+def test_start_http_server():
+    registry = metrics.Registry()
+    registry.counter("test_events_total", "Events seen").inc()
+    server = metrics.start_http_server(0, "127.0.0.1", registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
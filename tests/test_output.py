@@ -1,13 +1,23 @@
 import asyncio
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from urllib.parse import urlparse
 
 import pytest
 from web3 import types as web3types
 
-from eth_pretty_events.outputs import DecodedTxLogs, DummyOutput, OutputBase
+from eth_pretty_events.event_filter import TemplateRule, TrueEventFilter
+from eth_pretty_events.outputs import (
+    DecodedTxLogs,
+    DummyOutput,
+    OutputBase,
+    name_outputs,
+    share_render_cache,
+)
+from eth_pretty_events.print_output import PrintOutput
 from eth_pretty_events.types import Hash, Tx
 
+from . import factories
+
 
 @pytest.fixture
 def queue():
@@ -126,3 +136,189 @@ def test_outputbase_tags():
 def test_outputbase_tags_none():
     output = DummyOutput(urlparse("dummy://localhost"))
     assert output.tags is None
+
+
+def test_outputbase_template_rules_filtered_by_tags():
+    rules = [
+        TemplateRule(template=f"{name}.md.j2", match=TrueEventFilter(), tags=tags)
+        for name, tags in [("a", ["foo"]), ("b", ["bar"]), ("c", ["foo", "baz"])]
+    ]
+    renv = MagicMock(template_rules=rules)
+    output = DummyOutput(urlparse("dummy://localhost?tags=foo"), renv)
+
+    assert [rule.template for rule in output.template_rules] == ["a.md.j2", "c.md.j2"]
+    assert output.template_rules is output.template_rules
+
+    # Rebuilt only when the rules of the environment change
+    renv.template_rules = rules[1:]
+    assert [rule.template for rule in output.template_rules] == ["c.md.j2"]
+
+    no_tags = DummyOutput(urlparse("dummy://localhost"), renv)
+    assert list(no_tags.template_rules) == rules[1:]
+
+
+def test_share_render_cache(tmp_path):
+    renv = MagicMock()
+    outputs = [
+        DummyOutput(urlparse("dummy://url")),
+        PrintOutput(urlparse(f"print://?file={tmp_path / 'a.txt'}"), renv),
+    ]
+    assert share_render_cache(outputs) is None
+    assert outputs[1].render_cache is None
+
+    outputs.append(PrintOutput(urlparse(f"print://?file={tmp_path / 'b.txt'}"), renv))
+    assert share_render_cache(outputs, maxsize=0) is None
+
+    cache = share_render_cache(outputs, maxsize=10)
+    assert cache.maxsize == 10
+    assert outputs[0].render_cache is None
+    assert outputs[1].render_cache is cache and outputs[2].render_cache is cache
+
+
+class BatchRecorderOutput(OutputBase):
+    def __init__(self, url):
+        super().__init__(url)
+        self.batches = []
+
+    def send_to_output_sync(self, log: DecodedTxLogs):
+        self.batches.append([log])
+
+    async def send_batch(self, logs):
+        self.batches.append(logs)
+
+
+def _tx_logs(data_size=0):
+    tx = Tx(block=None, hash=Hash("0xd77c733e1884cd516c042549861c93cad8b998f691c38682c6100d7872761d4a"), index=1)
+    return DecodedTxLogs(tx=tx, raw_logs=[{"data": "0" * data_size, "topics": []}], decoded_logs=[None])
+
+
+async def _run_output(output, queue, feed):
+    worker = asyncio.create_task(output.run(queue))
+    await feed(queue)
+    await queue.join()
+    worker.cancel()
+
+
+@pytest.mark.asyncio
+async def test_run_batches_by_items_and_bytes():
+    logs = [_tx_logs(10) for _ in range(7)]
+
+    async def feed(queue):
+        for log in logs:
+            queue.put_nowait(log)
+
+    output = BatchRecorderOutput(urlparse("dummy://url?batch_max_items=3"))
+    await _run_output(output, asyncio.Queue(), feed)
+    assert [len(batch) for batch in output.batches] == [3, 3, 1]
+    assert sum(output.batches, []) == logs
+
+    output = BatchRecorderOutput(urlparse("dummy://url?batch_max_items=10&batch_max_bytes=25"))
+    await _run_output(output, asyncio.Queue(), feed)
+    assert [len(batch) for batch in output.batches] == [3, 3, 1]
+
+
+@pytest.mark.asyncio
+async def test_run_batches_linger():
+    async def feed(queue):
+        queue.put_nowait(_tx_logs())
+        await asyncio.sleep(0.01)
+        queue.put_nowait(_tx_logs())
+        await asyncio.sleep(0.2)
+        queue.put_nowait(_tx_logs())
+
+    # Without linger, only takes what's already in the queue
+    output = BatchRecorderOutput(urlparse("dummy://url?batch_max_items=10"))
+    await _run_output(output, asyncio.Queue(), feed)
+    assert [len(batch) for batch in output.batches] == [1, 1, 1]
+
+    output = BatchRecorderOutput(urlparse("dummy://url?batch_max_items=10&batch_linger=0.1"))
+    await _run_output(output, asyncio.Queue(), feed)
+    assert [len(batch) for batch in output.batches] == [2, 1]
+
+
+def test_send_batch_default(dummy_output):
+    logs = [_tx_logs(), _tx_logs()]
+    with patch("pprint.pprint") as mock_pprint:
+        asyncio.run(dummy_output.send_batch(logs))
+    assert [call.args[0] for call in mock_pprint.call_args_list] == logs
+
+
+def test_build_queue_spill(tmp_path):
+    output = DummyOutput(urlparse(f"dummy://url?max_queue=1&queue_policy=spill&spill_dir={tmp_path}&name=spilled"))
+    queue = output.build_queue()
+    block = factories.Block()
+    logs = [DecodedTxLogs(tx=factories.Tx(block=block), raw_logs=[], decoded_logs=[], rendered={}) for _ in range(3)]
+    for log in logs:
+        queue.put_nowait(log)
+    assert [queue.get_nowait() for _ in logs] == logs
+
+
+def test_invalid_queue_policy():
+    with pytest.raises(RuntimeError, match="Invalid queue_policy"):
+        DummyOutput(urlparse("dummy://url?max_queue=10&queue_policy=drop_newest"))
+
+
+class SlowRecorderOutput(OutputBase):
+    def __init__(self, url):
+        super().__init__(url)
+        self.sent = []
+        self.in_flight = self.max_in_flight = 0
+
+    def send_to_output_sync(self, log: DecodedTxLogs):
+        raise NotImplementedError()
+
+    async def send_to_output(self, log: DecodedTxLogs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # The first transaction of each block is the slowest
+        await asyncio.sleep(0.02 if log.tx.index == 0 else 0.001)
+        self.sent.append(log)
+        self.in_flight -= 1
+
+
+async def _run_workers(output, logs):
+    queue = asyncio.Queue()
+    worker = asyncio.create_task(output.run_workers(queue))
+    for log in logs:
+        queue.put_nowait(log)
+    await asyncio.wait_for(queue.join(), 1)
+    worker.cancel()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("ordering", ["tx", "block"])
+async def test_run_workers(ordering):
+    blocks = [factories.Block() for _ in range(6)]
+    logs = [
+        DecodedTxLogs(tx=factories.Tx(block=block, index=i), raw_logs=[], decoded_logs=[])
+        for block in blocks
+        for i in range(3)
+    ]
+    output = SlowRecorderOutput(urlparse(f"dummy://url?workers=3&ordering={ordering}"))
+    await _run_workers(output, logs)
+
+    assert sorted(output.sent, key=logs.index) == logs
+    assert output.max_in_flight > 1
+    if ordering == "block":
+        for block in blocks:
+            assert [log for log in output.sent if log.tx.block == block] == [
+                log for log in logs if log.tx.block == block
+            ]
+    else:
+        # The slow first transaction is overtaken by the other ones of its block
+        assert [log for log in output.sent if log.tx.block == blocks[0]][-1] is logs[0]
+
+
+def test_invalid_ordering():
+    with pytest.raises(RuntimeError, match="Invalid ordering"):
+        DummyOutput(urlparse("dummy://url?workers=2&ordering=global"))
+
+
+def test_name_outputs():
+    outputs = [DummyOutput(urlparse(url)) for url in ["dummy://a", "dummy://b", "dummy://c?name=alerts"]]
+    outputs.append(PrintOutput(urlparse("print://"), MagicMock()))
+    name_outputs(outputs)
+    assert [output.name for output in outputs] == ["dummy-0", "dummy-1", "alerts", "print"]
+
+    with pytest.raises(RuntimeError, match="Duplicate output names"):
+        name_outputs([DummyOutput(urlparse(f"dummy://{host}?name=alerts")) for host in "ab"])
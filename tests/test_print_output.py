@@ -139,3 +139,26 @@ def test_printoutput_no_printing_event(dummy_renv, template_loader, mock_tx, moc
     output_value = captured.out
 
     assert output_value == ""
+
+
+def test_printoutput_prints_all_matching_templates(
+    dummy_renv, template_loader, mock_tx, mock_event, mock_raw_log, capfd
+):
+    dummy_renv.template_rules = read_template_rules(
+        {
+            "rules": [
+                {"match": [{"event": "Transfer"}], "template": "ERC20-transfer.md.j2", "continue": True},
+                {"match": [{"event": "Transfer"}], "template": "generic-event-on-error.md.j2"},
+                {"match": [{"event": "Transfer"}], "template": "never-rendered.md.j2"},
+            ]
+        }
+    )
+    dummy_renv.jinja_env = Environment(loader=FunctionLoader(template_loader))
+    output = PrintOutput(urlparse("print://"), dummy_renv)
+
+    output.send_to_output_sync(DecodedTxLogs(tx=mock_tx, raw_logs=[mock_raw_log], decoded_logs=[mock_event]))
+
+    output_value = capfd.readouterr().out
+    assert output_value.count("--------------------------") == 2
+    assert "Transfer 1000 from" in output_value
+    assert "## Transfer" in output_value
@@ -1,5 +1,8 @@
 import asyncio
+import concurrent.futures
 import json
+import threading
+import time
 from unittest.mock import MagicMock, patch
 from urllib.parse import urlparse
 
@@ -7,18 +10,29 @@ import pytest
 
 from eth_pretty_events.outputs import DecodedTxLogs
 from eth_pretty_events.pubsub import (
+    JsonEncoder,
     PrintToScreenPublisher,
     PubSubDecodedLogsOutput,
     PubSubRawLogsOutput,
+    RetryScheduler,
+)
+from eth_pretty_events.types import (
+    Block,
+    Bytes,
+    Chain,
+    Event,
+    Hash,
+    Tx,
+    make_abi_namedtuple,
 )
-from eth_pretty_events.types import Block, Chain, Event, Hash, Tx, make_abi_namedtuple
 
 
 @pytest.fixture
 def mock_future():
-    class MockFuture:
-        def result(self):
-            return "mock-message-id"
+    class MockFuture(concurrent.futures.Future):
+        def __init__(self):
+            super().__init__()
+            self.set_result("mock-message-id")
 
     return MockFuture
 
@@ -336,3 +350,162 @@ def test_print_to_screen_publisher_non_byte_message(caplog):
         publisher.publish(topic_path, message)
         assert "Publishing to projects/test_project/topics/test_topic:" in caplog.text
         assert str(message) in caplog.text
+
+
+def test_json_encoder_bytes():
+    assert json.dumps({"data": Bytes(b"\x12\x34")}, cls=JsonEncoder) == '{"data": "1234"}'
+
+
+def _logs(n):
+    block = Block(hash=Hash("0x" + "11" * 32), timestamp=1635600000, number=123456, chain=Chain(id=1, name="ETH"))
+    return [
+        DecodedTxLogs(tx=Tx(hash=Hash("0x" + f"{i:02x}" * 32), index=i, block=block), raw_logs=[], decoded_logs=[])
+        for i in range(n)
+    ]
+
+
+def _production_output(url, dummy_renv):
+    with patch("eth_pretty_events.pubsub.pubsub_v1.PublisherClient") as mock_publisher:
+        publisher = mock_publisher.return_value
+        publisher.topic_path.return_value = "projects/test_project/topics/test_topic"
+        return PubSubRawLogsOutput(urlparse(url), dummy_renv), mock_publisher
+
+
+def test_pubsub_send_batch(dummy_renv):
+    output, mock_publisher = _production_output(
+        "pubsubrawlogs://?project_id=test_project&topic=test_topic&batch_max_items=10"
+        "&publish_batch_messages=50&max_outstanding_messages=20",
+        dummy_renv,
+    )
+    assert output.batch_max_items == 10
+    client_kwargs = mock_publisher.call_args.kwargs
+    assert client_kwargs["batch_settings"].max_messages == 50
+    assert client_kwargs["publisher_options"].flow_control.message_limit == 20
+
+    publisher = mock_publisher.return_value
+    futures = [concurrent.futures.Future() for _ in range(3)]
+    publisher.publish.side_effect = futures
+
+    # All published before waiting for the acknowledgements
+    sending = concurrent.futures.ThreadPoolExecutor(1).submit(asyncio.run, output.send_batch(_logs(3)))
+    for _ in range(100):
+        if publisher.publish.call_count == 3:
+            break
+        time.sleep(0.01)
+    messages = [json.loads(call.args[1]) for call in publisher.publish.call_args_list]
+    assert [message["transactionIndex"] for message in messages] == [0, 1, 2]
+
+    for i, future in enumerate(futures):
+        assert not sending.done()
+        future.set_result(f"id-{i}")
+    sending.result(timeout=1)
+
+
+def _failed_future():
+    future = concurrent.futures.Future()
+    future.set_exception(RuntimeError("Unavailable"))
+    return future
+
+
+def test_pubsub_publish_retries(dummy_renv, mock_future, caplog):
+    output, mock_publisher = _production_output(
+        "pubsubrawlogs://?project_id=test_project&topic=test_topic&publish_retries=2&publish_retry_backoff=0.01",
+        dummy_renv,
+    )
+    publisher = mock_publisher.return_value
+
+    publisher.publish.side_effect = [_failed_future(), _failed_future(), mock_future()]
+    output.run_sync(_logs(1))
+    assert publisher.publish.call_count == 3
+    assert "retrying (2/2)" in caplog.text
+
+    publisher.publish.side_effect = lambda *args: _failed_future()
+    with pytest.raises(RuntimeError, match="Failed to publish 1 messages"):
+        output.run_sync(_logs(1))
+    assert publisher.publish.call_count == 6
+
+    # Also in the async mode
+    with pytest.raises(RuntimeError, match="Failed to publish 1 messages"):
+        asyncio.run(output.send_to_output(_logs(1)[0]))
+
+
+def test_pubsub_run_sync_waits_when_build_message_fails(dummy_renv, caplog):
+    output, mock_publisher = _production_output(
+        "pubsubrawlogs://?project_id=test_project&topic=test_topic&publish_retries=0", dummy_renv
+    )
+    futures = [concurrent.futures.Future() for _ in range(2)]
+    mock_publisher.return_value.publish.side_effect = futures
+    logs = _logs(3)
+    logs[2] = None  # build_message fails on the third one
+
+    running = concurrent.futures.ThreadPoolExecutor(1).submit(output.run_sync, logs)
+    for _ in range(100):
+        if mock_publisher.return_value.publish.call_count == 2:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert not running.done()  # Waiting for the published ones
+    futures[0].set_result("id-0")
+    futures[1].set_exception(RuntimeError("Unavailable"))
+    with pytest.raises(AttributeError):
+        running.result(timeout=1)
+    assert "Failed to publish to Pub/Sub (Unavailable)" in caplog.text
+
+
+def test_pubsub_retry_backoff(dummy_renv):
+    output, _ = _production_output(
+        "pubsubrawlogs://?project_id=test_project&topic=test_topic&publish_retry_backoff=1&publish_retry_max_backoff=5",
+        dummy_renv,
+    )
+    for attempt, (low, high) in enumerate([(0.5, 1), (1, 2), (2, 4), (2.5, 5), (2.5, 5)], 1):
+        assert low <= output._retry_delay(attempt) <= high
+
+
+def test_retry_scheduler():
+    scheduler = RetryScheduler("test-retry")
+    calls = []
+    done = threading.Event()
+    scheduler.schedule(0.05, lambda: calls.append("late") or done.set())
+    scheduler.schedule(0, calls.append, "soon")
+    scheduler.schedule(0.01, lambda: 1 / 0)  # Logged, doesn't stop the scheduler
+    assert done.wait(1)
+    assert calls == ["soon", "late"]
+
+
+@pytest.mark.asyncio
+async def test_pubsub_run_pipelines_publishes(dummy_renv):
+    output, mock_publisher = _production_output(
+        "pubsubrawlogs://?project_id=test_project&topic=test_topic&publish_retries=0", dummy_renv
+    )
+    publisher = mock_publisher.return_value
+    futures = [concurrent.futures.Future() for _ in range(4)]
+    publisher.publish.side_effect = futures
+    queue = asyncio.Queue()
+    for log in _logs(3):
+        queue.put_nowait(log)
+    running = asyncio.create_task(output.run(queue))
+
+    # All published before any acknowledgement
+    for _ in range(100):
+        if publisher.publish.call_count == 3:
+            break
+        await asyncio.sleep(0.01)
+    assert publisher.publish.call_count == 3
+    joining = asyncio.create_task(queue.join())
+    await asyncio.sleep(0.05)
+    assert not joining.done()
+    for i, future in enumerate(futures[:3]):
+        future.set_result(f"id-{i}")
+    await asyncio.wait_for(joining, 1)
+
+    # A failure is raised on the next transaction
+    queue.put_nowait(_logs(1)[0])
+    for _ in range(100):
+        if publisher.publish.call_count == 4:
+            break
+        await asyncio.sleep(0.01)
+    futures[3].set_exception(RuntimeError("Unavailable"))
+    await asyncio.wait_for(queue.join(), 1)
+    queue.put_nowait(_logs(1)[0])
+    with pytest.raises(RuntimeError, match="Failed to publish 1 messages"):
+        await asyncio.wait_for(running, 1)
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from eth_pretty_events import queues
+
+
+def _drain(queue):
+    ret = []
+    while not queue.empty():
+        ret.append(queue.get_nowait())
+        queue.task_done()
+    return ret
+
+
+def test_block_policy():
+    queue = queues.build_queue("test-block", 2, "block")
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(3)
+    assert queues._depth.get(queue="test-block") == 2
+
+
+def test_drop_oldest_policy():
+    queue = queues.build_queue("test-drop", 2, "drop_oldest")
+    for i in range(5):
+        queue.put_nowait(i)
+    assert queue.qsize() == 2
+    assert queues._drops.get(queue="test-drop") == 3
+    assert _drain(queue) == [3, 4]
+    # join doesn't wait for the dropped items
+    asyncio.run(asyncio.wait_for(queue.join(), 1))
+
+
+def test_spill_policy(tmp_path):
+    queue = queues.build_queue(
+        "test-spill", 2, "spill", dump=lambda item: item["n"], load=lambda n: {"n": n}, spill_dir=str(tmp_path)
+    )
+    for i in range(5):
+        queue.put_nowait({"n": i})
+    assert queue.qsize() == 5
+    assert len(queue._queue) == 2
+    assert queues._spills.get(queue="test-spill") == 3
+
+    assert queue.get_nowait() == {"n": 0}
+    queue.task_done()
+    queue.put_nowait({"n": 5})
+    assert _drain(queue) == [{"n": i} for i in range(1, 6)]
+    assert queue._write_pos == 0  # The spill file is reused
+    asyncio.run(asyncio.wait_for(queue.join(), 1))
+
+
+def test_unbounded_and_unknown_policy():
+    assert type(queues.build_queue("test-unbounded", 0, "spill")) is queues.MeteredQueue
+    with pytest.raises(ValueError, match="Unknown queue policy"):
+        queues.build_queue("test-unknown", 10, "drop_newest")
@@ -0,0 +1,55 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from eth_pretty_events import rainbow
+
+GUARDIAN_HASH = "0x55435dd261a4b9b3364963f7738a7a662ad9c84396d64be3365284bb7f0a5041"
+LEVEL1_HASH = "0xbf372ca3ebecfe59ac256f17697941bbe63302aced610e8b0e3646f743c7beb2"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        ["GUARDIAN_ROLE", "LEVEL1_ROLE", "GUARDIAN_ROLE"],
+        {GUARDIAN_HASH: "GUARDIAN_ROLE", LEVEL1_HASH: "LEVEL1_ROLE"},
+        {"GUARDIAN_ROLE": GUARDIAN_HASH, "LEVEL1_ROLE": LEVEL1_HASH.upper().replace("0X", "0x")},
+        {GUARDIAN_HASH: "GUARDIAN_ROLE", "LEVEL1_ROLE": LEVEL1_HASH},
+    ],
+)
+def test_build_rainbow(data):
+    assert rainbow.build_rainbow(data) == {GUARDIAN_HASH: "GUARDIAN_ROLE", LEVEL1_HASH: "LEVEL1_ROLE"}
+
+
+def test_build_rainbow_invalid_hash():
+    with pytest.raises(ValueError):
+        rainbow.build_rainbow({"GUARDIAN_ROLE": "not a hash"})
+
+
+def test_hash_names_parallel():
+    names = [f"ROLE_{i}" for i in range(30)]
+    with patch.object(rainbow, "PARALLEL_MIN_NAMES", 10), patch.object(rainbow, "CHUNK_SIZE", 7):
+        hashed = rainbow.hash_names(names, workers=2)
+    assert hashed == rainbow.hash_names(names, workers=1)
+    assert len(hashed) == 30
+
+
+def test_load_rainbow_cache(tmp_path):
+    input_file = tmp_path / "roles.json"
+    input_file.write_text(json.dumps(["GUARDIAN_ROLE"]))
+    cache_dir = tmp_path / "cache"
+
+    assert rainbow.load_rainbow(str(input_file), str(cache_dir)) == {GUARDIAN_HASH: "GUARDIAN_ROLE"}
+    assert len(list(cache_dir.iterdir())) == 1
+
+    with patch.object(rainbow, "build_rainbow", side_effect=AssertionError("Should use the cache")):
+        assert rainbow.load_rainbow(str(input_file), str(cache_dir)) == {GUARDIAN_HASH: "GUARDIAN_ROLE"}
+
+    # A different input file isn't read from the cache
+    input_file.write_text(json.dumps(["GUARDIAN_ROLE", "LEVEL1_ROLE"]))
+    assert rainbow.load_rainbow(str(input_file), str(cache_dir)) == {
+        GUARDIAN_HASH: "GUARDIAN_ROLE",
+        LEVEL1_HASH: "LEVEL1_ROLE",
+    }
+    assert len(list(cache_dir.iterdir())) == 2
@@ -1,10 +1,22 @@
+import concurrent.futures
+import threading
+import time
 from unittest.mock import patch
 
 import pytest
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import DictLoader, Environment, FileSystemLoader, Template
 
+from eth_pretty_events.event_filter import read_template_rules
 from eth_pretty_events.jinja2_ext import add_filters, add_tests
-from eth_pretty_events.render import init_environment, render
+from eth_pretty_events.render import (
+    RenderBudget,
+    RenderCache,
+    init_environment,
+    precompile,
+    render,
+    render_rule,
+    resolve_templates,
+)
 
 from . import factories
 
@@ -44,7 +56,7 @@ def test_render_event():
     env.globals.update(env_globals)
     add_filters(env)
     add_tests(env)
-    transfer_event = factories.Event()
+    transfer_event = factories.Event(name="Transfer")
 
     result = render(env, transfer_event, template_name)
 
@@ -68,7 +80,7 @@ def test_render_uses_second_template_when_first_fails(caplog):
     add_filters(env)
     add_tests(env)
 
-    transfer_event = factories.Event()
+    transfer_event = factories.Event(name="Transfer")
     generic_template = "generic-event.md.j2"
     on_error_template = "generic-event-on-error.md.j2"
     templates = [generic_template, on_error_template]
@@ -104,7 +116,7 @@ def test_render_raises_runtimeerror_on_all_templates_failure():
     add_filters(env)
     add_tests(env)
 
-    transfer_event = factories.Event()
+    transfer_event = factories.Event(name="Transfer")
 
     generic_template = "generic-event.md.j2"
     on_error_template = "generic-event-on-error.md.j2"
@@ -115,3 +127,178 @@ def test_render_raises_runtimeerror_on_all_templates_failure():
             render(env, transfer_event, templates)
 
         assert f"Failed to render all provided templates: {templates}" in str(exc_info.value)
+
+
+def test_precompile_with_bytecode_cache(tmp_path, caplog):
+    search_path = "src/eth_pretty_events/templates/"
+    cache_dir = tmp_path / "templates-cache"
+    env = init_environment(search_path, {}, cache_dir)
+
+    with caplog.at_level("WARNING"):
+        loaded = precompile(env, ["generic-event.md.j2", "generic-event-on-error.md.j2", "missing.md.j2"])
+
+    assert loaded == 2
+    assert "Failed to precompile template 'missing.md.j2'" in caplog.text
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # A new environment (another process) loads the compiled code from the cache
+    other_env = init_environment(search_path, {}, cache_dir)
+    with patch.object(other_env, "compile", side_effect=AssertionError("Shouldn't compile")):
+        assert precompile(other_env, ["generic-event.md.j2"]) == 1
+
+
+def test_resolve_templates(caplog):
+    env_globals = {
+        "b32_rainbow": {},
+        "chain_id": 137,
+        "chains": {137: {"explorers": [{"url": "https://polygonscan.com"}]}},
+    }
+    env = init_environment("src/eth_pretty_events/templates/", env_globals)
+    assert not env.auto_reload
+    rules = read_template_rules(
+        {
+            "rules": [
+                {"template": "generic-event.md.j2", "match": [{"name": "Transfer"}]},
+                {"template": "missing.md.j2", "match": [{"filter_type": "true"}]},
+            ]
+        }
+    )
+    assert rules[0].templates_to_render("generic-event-on-error.md.j2") == [
+        "generic-event.md.j2",
+        "generic-event-on-error.md.j2",
+    ]
+
+    with caplog.at_level("WARNING"):
+        resolve_templates(env, rules, "generic-event-on-error.md.j2")
+    assert "Failed to load template 'missing.md.j2'" in caplog.text
+
+    generic, on_error = rules[0].templates_to_render("ignored.md.j2")
+    assert isinstance(generic, Template) and generic.name == "generic-event.md.j2"
+    assert on_error is rules[1].resolved_templates[1]
+    assert rules[1].resolved_templates[0] == "missing.md.j2"
+
+    # Without on-error template
+    caplog.clear()
+    with caplog.at_level("WARNING"):
+        resolve_templates(env, rules[:1], None)
+    assert rules[0].resolved_templates[1] is None
+    assert not caplog.text
+
+    # Rendering with resolved templates doesn't go through the environment
+    event = factories.Event(name="Approval")
+    with patch.object(env, "get_template", side_effect=AssertionError("Shouldn't be called")):
+        assert "## Approval" in render(env, event, rules[0].resolved_templates)
+        assert "## Approval" in render(env, event, on_error)
+
+
+def test_render_cache():
+    env = Environment(loader=DictLoader({"approval.md.j2": "Approval {{ evt.log_index }}"}))
+    rules = read_template_rules({"rules": [{"template": "approval.md.j2", "match": [{"name": "Approval"}]}]})
+    cache = RenderCache(maxsize=2)
+    events = [factories.Event(name="Approval") for _ in range(3)]
+
+    first = render_rule(env, events[0], rules[0], None, cache=cache)
+    with patch.object(env, "get_template", side_effect=AssertionError("Shouldn't be called")):
+        assert render_rule(env, events[0], rules[0], None, cache=cache) == first
+
+    render_rule(env, events[1], rules[0], None, cache=cache)
+    render_rule(env, events[2], rules[0], None, cache=cache)
+    assert len(cache) == 2
+    # The least recently used was evicted
+    with patch.object(env, "get_template", wraps=env.get_template) as get_template:
+        assert render_rule(env, events[0], rules[0], None, cache=cache) == first
+        get_template.assert_called_once()
+
+
+def test_render_cache_single_flight():
+    cache = RenderCache()
+    event = factories.Event()
+    renders = []
+    started = threading.Event()
+
+    def render_fn():
+        renders.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "rendered"
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        first = executor.submit(cache.get_or_render, event, "t.j2", render_fn)
+        started.wait(1)
+        second = executor.submit(cache.get_or_render, event, "t.j2", render_fn)
+        assert first.result() == second.result() == "rendered"
+    assert len(renders) == 1
+
+    # Failed renders aren't cached
+    with pytest.raises(ValueError):
+        cache.get_or_render(event, "other.j2", lambda: int("x"))
+    assert cache.get_or_render(event, "other.j2", lambda: "ok") == "ok"
+
+
+def test_render_budget(caplog):
+    class SlowEvent:
+        tx = "0x00"
+        log_index = 3
+        delay = 0.0
+
+        @property
+        def slow(self):
+            time.sleep(self.delay)
+            return "slow"
+
+    budget = RenderBudget(0.05, quarantine_after=2, quarantine_seconds=60)
+    env = init_environment([], {}, render_budget=budget)
+    env.loader = DictLoader(
+        {"slow.md.j2": "{% for i in range(3) %}{{ evt.slow }} {% endfor %}", "fallback.md.j2": "fallback"}
+    )
+    templates = ["slow.md.j2", "fallback.md.j2"]
+    event = SlowEvent()
+
+    assert render(env, event, templates) == "slow slow slow "
+    # Stopped after the first overrun, doesn't wait for the whole render
+    event.delay = 0.1
+    start = time.monotonic()
+    assert render(env, event, templates) == "fallback"
+    assert time.monotonic() - start < 0.2
+    assert not budget.is_quarantined("slow.md.j2")
+
+    # The fallback isn't budgeted
+    assert render(env, event, ["fallback.md.j2", "slow.md.j2"]) == "fallback"
+    assert render(env, event, "slow.md.j2") == "slow slow slow "
+
+    with caplog.at_level("WARNING"):
+        assert render(env, event, templates) == "fallback"
+    assert "Template 'slow.md.j2' quarantined for 60 seconds" in caplog.text
+    assert budget.is_quarantined("slow.md.j2")
+
+    event.delay = 0
+    with patch.object(env, "get_template", wraps=env.get_template) as get_template:
+        assert render(env, event, templates) == "fallback"
+        get_template.assert_called_once_with("fallback.md.j2")
+
+    with patch("time.monotonic", return_value=time.monotonic() + 61):
+        assert not budget.is_quarantined("slow.md.j2")
+    assert render(env, event, templates) == "slow slow slow "
+
+
+def test_render_budget_without_on_error_template():
+    class SlowEvent:
+        tx = "0x00"
+        log_index = 3
+
+        @property
+        def slow(self):
+            time.sleep(0.1)
+            return "slow"
+
+    budget = RenderBudget(0.05, quarantine_after=1, quarantine_seconds=60)
+    env = init_environment([], {}, render_budget=budget)
+    env.loader = DictLoader({"slow.md.j2": "{{ evt.slow }}"})
+    rules = read_template_rules({"rules": [{"template": "slow.md.j2", "match": [{"filter_type": "true"}]}]})
+    resolve_templates(env, rules, None)
+
+    # The only real template isn't budgeted, there's no fallback to use instead
+    for _ in range(2):
+        assert render(env, SlowEvent(), rules[0].templates_to_render(None)) == "slow"
+        assert render(env, SlowEvent(), ["slow.md.j2", None]) == "slow"
+    assert not budget.is_quarantined("slow.md.j2")
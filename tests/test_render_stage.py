@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from eth_pretty_events import render_stage, token_metadata
+from eth_pretty_events.event_filter import read_template_rules
+from eth_pretty_events.outputs import DecodedTxLogs
+from eth_pretty_events.render import render_rule
+from eth_pretty_events.render_stage import RenderStage, _render_in_process
+from eth_pretty_events.token_metadata import TokenMetadata, TokenMetadataCache
+
+from . import factories
+
+TEMPLATES = {
+    "transfer.j2": "transfer {{ evt.log_index }}",
+    "any.j2": "any {{ evt.name }}",
+    "broken.j2": "{{ evt.missing.attr }}",
+    "on-error.j2": "error {{ evt.log_index }}",
+}
+
+
+@pytest.fixture
+def renv():
+    rules = read_template_rules(
+        {
+            "rules": [
+                {"template": "transfer.j2", "match": [{"name": "Transfer"}], "continue": True},
+                {"template": "broken.j2", "match": [{"name": "NewPolicy"}]},
+                {"template": "any.j2", "match": [{"filter_type": "true"}]},
+            ]
+        }
+    )
+    return SimpleNamespace(
+        jinja_env=Environment(loader=DictLoader(TEMPLATES)),
+        template_rules=rules,
+        args=SimpleNamespace(on_error_template="on-error.j2"),
+    )
+
+
+def _tx_logs(names):
+    tx = factories.Tx()
+    events = [factories.Event(name=name, tx=tx, log_index=i) if name else None for i, name in enumerate(names)]
+    # A generator, as returned by the decoder
+    return DecodedTxLogs(tx=tx, raw_logs=[{} for _ in names], decoded_logs=(evt for evt in events))
+
+
+def test_render_stage_thread_pool(renv):
+    stage = RenderStage(renv, [renv.template_rules], workers=2, pool="thread")
+    stage.window = 2
+    txs = [_tx_logs(["Transfer", None, "Approval"]), _tx_logs(["NewPolicy"]), _tx_logs([]), _tx_logs(["Transfer"])]
+
+    rendered = list(stage.render(iter(txs)))
+    stage.close()
+
+    assert rendered == txs
+    assert txs[0].rendered == {
+        (0, "transfer.j2"): "transfer 0",
+        (0, "any.j2"): "any Transfer",
+        (2, "any.j2"): "any Approval",
+    }
+    assert txs[1].rendered == {(0, "broken.j2"): "error 0"}
+    assert txs[2].rendered == {}
+    assert isinstance(txs[3].decoded_logs, list)
+
+    # The outputs take the rendered text instead of rendering again
+    event = txs[0].decoded_logs[2]
+    rule = renv.template_rules[2]
+    with patch.object(renv.jinja_env, "get_template", side_effect=AssertionError("Shouldn't render")):
+        assert render_rule(renv.jinja_env, event, rule, "on-error.j2", txs[0].rendered) == "any Approval"
+    assert render_rule(renv.jinja_env, event, rule, "on-error.j2", {}) == "any Approval"
+
+
+def test_render_stage_failure_leaves_rendering_to_outputs(renv, caplog):
+    stage = RenderStage(renv, [renv.template_rules], workers=1, pool="thread")
+    tx_logs = _tx_logs(["Approval"])
+
+    with patch.object(stage.executor, "submit", side_effect=lambda *args: _failed_future()):
+        (result,) = stage.render([tx_logs])
+    stage.close()
+
+    assert result.rendered is None
+    assert "Render stage failed for tx" in caplog.text
+
+
+def _failed_future():
+    future = concurrent.futures.Future()
+    future.set_exception(RuntimeError("boom"))
+    return future
+
+
+@pytest.mark.asyncio
+async def test_render_stage_forward_rendered(renv):
+    stage = RenderStage(renv, [renv.template_rules], workers=3, pool="thread")
+    txs = [_tx_logs(["Approval"]) for _ in range(3)]
+    futures = [concurrent.futures.Future() for _ in txs]
+    in_flight, output = asyncio.Queue(stage.window), asyncio.Queue()
+    forwarder = asyncio.create_task(stage.forward_rendered(in_flight, [output]))
+
+    # All submitted without waiting for the previous ones
+    for tx_logs, future in zip(txs, futures):
+        await asyncio.wait_for(in_flight.put((tx_logs, future)), 1)
+    for i in (2, 1, 0):
+        futures[i].set_result({(0, "any.j2"): f"rendered {i}"})
+    await asyncio.wait_for(in_flight.join(), 1)
+    forwarder.cancel()
+    stage.close()
+
+    assert [output.get_nowait() for _ in txs] == txs
+    assert txs[2].rendered == {(0, "any.j2"): "rendered 2"}
+
+
+def test_render_stage_process_pool_sends_token_metadata(renv):
+    tx_logs = _tx_logs(["Transfer"])
+    event = next(iter(tx_logs.decoded_logs))
+    tx_logs.decoded_logs = [event]
+    key = (tx_logs.tx.block.chain.id, event.address)
+    token_metadata.setup_default(TokenMetadataCache({key: TokenMetadata(6, "USDC")}))
+    stage = RenderStage(renv, [renv.template_rules], workers=1, pool="thread")
+    stage.pool = "process"  # Without starting the processes
+    try:
+        with patch.object(stage.executor, "submit") as submit:
+            stage.submit(tx_logs)
+        fn, *args = submit.call_args.args
+        assert fn is _render_in_process
+        assert args[-1] == {key: TokenMetadata(6, "USDC")}
+
+        # The worker, with the cache it loaded on startup
+        token_metadata.setup_default(TokenMetadataCache())
+        with patch.object(render_stage, "_worker_renv", renv), patch.object(
+            render_stage, "decode_events_from_raw_logs", return_value=[event]
+        ):
+            assert _render_in_process(*args) == {(0, "transfer.j2"): "transfer 0", (0, "any.j2"): "any Transfer"}
+        assert token_metadata.get_default().get(*key) == TokenMetadata(6, "USDC")
+    finally:
+        stage.close()
+        token_metadata.setup_default(TokenMetadataCache())
+
+
+def test_render_stage_unknown_pool(renv):
+    with pytest.raises(ValueError, match="Unknown render pool"):
+        RenderStage(renv, [], workers=1, pool="fibers")
@@ -0,0 +1,104 @@
+from unittest.mock import MagicMock
+
+import pytest
+from eth_abi import decode, encode
+from jinja2 import Environment
+
+from eth_pretty_events import token_metadata
+from eth_pretty_events.jinja2_ext import add_filters
+from eth_pretty_events.outputs import DecodedTxLogs
+from eth_pretty_events.token_metadata import TokenMetadata, TokenMetadataCache
+from eth_pretty_events.types import Address
+
+from . import factories
+
+USDC = factories.Event().address
+MKR = factories.Event().address
+NOT_TOKEN = factories.Event().address
+
+RESPONSES = {
+    (USDC, token_metadata.DECIMALS_SELECTOR): encode(["uint8"], [6]),
+    (USDC, token_metadata.SYMBOL_SELECTOR): encode(["string"], ["USDC"]),
+    (MKR, token_metadata.DECIMALS_SELECTOR): encode(["uint8"], [18]),
+    (MKR, token_metadata.SYMBOL_SELECTOR): b"MKR".ljust(32, b"\0"),
+}
+
+
+def _multicall(tx):
+    assert tx["to"] == token_metadata.MULTICALL3_ADDRESS
+    assert tx["data"][:4] == token_metadata.AGGREGATE3_SELECTOR
+    (calls,) = decode(["(address,bool,bytes)[]"], tx["data"][4:])
+    results = []
+    for address, _, data in calls:
+        response = RESPONSES.get((Address(address), data))
+        results.append((response is not None, response or b""))
+    return encode(["(bool,bytes)[]"], [results])
+
+
+def _single_call(tx):
+    response = RESPONSES.get((tx["to"], tx["data"]))
+    if response is None:
+        raise ValueError("execution reverted")
+    return response
+
+
+@pytest.mark.parametrize("call", [_multicall, _single_call])
+def test_prefetch(call):
+    w3 = MagicMock()
+    w3.eth.call.side_effect = call
+    cache = TokenMetadataCache()
+
+    assert cache.prefetch(w3, 137, [USDC, MKR, NOT_TOKEN, USDC]) == 3
+    assert cache.get(137, USDC) == TokenMetadata(6, "USDC")
+    assert cache.get(137, MKR) == TokenMetadata(18, "MKR")
+    assert cache.get(137, NOT_TOKEN) == TokenMetadata(None, None)
+    assert cache.get(1, USDC) is None
+
+    calls = w3.eth.call.call_count
+    assert cache.prefetch(w3, 137, [USDC, NOT_TOKEN]) == 0
+    assert w3.eth.call.call_count == calls
+
+
+def test_save_and_load(tmp_path):
+    cache = TokenMetadataCache()
+    cache.set(137, USDC, TokenMetadata(6, "USDC"))
+    cache.set(137, NOT_TOKEN, TokenMetadata(None, None))
+    assert cache.dirty
+    cache.save(str(tmp_path / "tokens.json"))
+    assert not cache.dirty
+
+    loaded = TokenMetadataCache.load(str(tmp_path / "tokens.json"))
+    assert len(loaded) == 2
+    assert loaded.get(137, USDC) == TokenMetadata(6, "USDC")
+    assert loaded.get(137, NOT_TOKEN) == TokenMetadata(None, None)
+
+
+def test_prefetch_by_block():
+    blocks = [factories.Block(), factories.Block()]
+    txs = [factories.Tx(block=blocks[0]), factories.Tx(block=blocks[0]), factories.Tx(block=blocks[1])]
+    tx_logs = [
+        DecodedTxLogs(tx, [{}], [factories.Event(tx=tx, address=address)])
+        for tx, address in zip(txs, [USDC, MKR, USDC])
+    ]
+    cache = MagicMock()
+
+    result = token_metadata.prefetch_by_block(cache, "w3", 137, iter(tx_logs))
+    assert next(result) is tx_logs[0]
+    cache.prefetch.assert_called_once_with("w3", 137, [USDC, MKR])
+    assert list(result) == tx_logs[1:]
+    cache.prefetch.assert_called_with("w3", 137, [USDC])
+
+
+def test_token_filters():
+    cache = TokenMetadataCache({(137, USDC): TokenMetadata(6, "USDC"), (137, NOT_TOKEN): TokenMetadata(None, None)})
+    token_metadata.setup_default(cache)
+    env = Environment()
+    env.globals["chain_id"] = 137
+    add_filters(env)
+    template = env.from_string("{{ value | token_amount(token) }} {{ token | token_symbol }}")
+    try:
+        assert template.render(value=15 * 10**17, token=USDC) == "1500000000000 USDC"
+        assert template.render(value=15 * 10**17, token=NOT_TOKEN) == f"1.5 {NOT_TOKEN}"
+        assert template.render(value=15 * 10**5, token=MKR) == f"1.5 {MKR}"
+    finally:
+        token_metadata.setup_default(TokenMetadataCache())
@@ -0,0 +1,87 @@
+from unittest.mock import MagicMock
+
+import pytest
+from hexbytes import HexBytes
+
+from eth_pretty_events.outputs import DecodedTxLogs
+from eth_pretty_events.tx_enrichment import TxEnricher, enrich_by_block
+from eth_pretty_events.types import TxDetails
+
+from . import factories
+
+SENDER = factories.Event().address
+RECIPIENT = factories.Event().address
+
+
+def _w3_tx(tx, to=RECIPIENT):
+    return {
+        "hash": HexBytes(tx.hash),
+        "from": SENDER,
+        "to": to,
+        "value": 10**18,
+        "gas": 21000,
+        "gasPrice": 30 * 10**9,
+        "nonce": tx.index,
+    }
+
+
+@pytest.fixture
+def txs():
+    block = factories.Block()
+    return [factories.Tx(block=block) for _ in range(3)]
+
+
+def test_enrich_batch(txs):
+    w3 = MagicMock()
+    batch = w3.batch_requests.return_value.__enter__.return_value
+    batch.execute.return_value = [_w3_tx(tx, to=None if i == 2 else RECIPIENT) for i, tx in enumerate(txs)]
+    enricher = TxEnricher(w3, "batch")
+
+    assert enricher.enrich(txs) == 3
+    assert batch.add.call_count == 3
+    assert txs[0].details == TxDetails(SENDER, RECIPIENT, 10**18, 21000, 30 * 10**9, txs[0].index)
+    assert txs[2].details.to is None
+
+    # Served from the cache
+    again = factories.Tx(hash=txs[1].hash, index=txs[1].index, block=txs[1].block)
+    assert enricher.enrich([again]) == 0
+    assert again.details == txs[1].details
+    assert w3.batch_requests.call_count == 1
+
+
+def test_enrich_block(txs):
+    w3 = MagicMock()
+    w3.eth.get_block.return_value = {"transactions": [_w3_tx(tx) for tx in reversed(txs)] + [_w3_tx(factories.Tx())]}
+    enricher = TxEnricher(w3, "block", cache_size=2)
+
+    assert enricher.enrich(txs) == 3
+    w3.eth.get_block.assert_called_once_with(txs[0].block.hash, full_transactions=True)
+    assert [tx.details.nonce for tx in txs] == [tx.index for tx in txs]
+    assert len(enricher._cache) == 2
+
+
+def test_enrich_failure_leaves_details_empty(txs, caplog):
+    w3 = MagicMock()
+    w3.eth.get_block.side_effect = RuntimeError("Connection error")
+    enricher = TxEnricher(w3, "block")
+
+    assert enricher.enrich(txs) == 0
+    assert txs[0].details is None
+    assert "Failed to fetch the details of 3 transactions" in caplog.text
+
+
+def test_enrich_by_block():
+    blocks = [factories.Block(), factories.Block()]
+    tx_logs = [DecodedTxLogs(factories.Tx(block=block), [], []) for block in [blocks[0], blocks[0], blocks[1]]]
+    enricher = MagicMock()
+
+    result = enrich_by_block(enricher, iter(tx_logs))
+    assert next(result) is tx_logs[0]
+    enricher.enrich_tx_logs.assert_called_once_with(tx_logs[:2])
+    assert list(result) == tx_logs[1:]
+    enricher.enrich_tx_logs.assert_called_with(tx_logs[2:])
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError, match="Unknown enrichment mode"):
+        TxEnricher(MagicMock(), "lazy")
@@ -1,5 +1,6 @@
 import json
 import os
+import pickle
 from pathlib import Path
 
 import pytest
@@ -45,6 +46,42 @@ def test_hash_type():
         types.Hash("0x2791BCA")
     with pytest.raises(ValueError, match="Only HexBytes, bytes or str"):
         types.Hash(0x37A50AC80E26CBF0005469713177E3885800188D80B92134F150685E931AA4BF)
+    assert SOME_HASH == types.Hash(SOME_HASH[2:])
+    with pytest.raises(ValueError, match="is not a valid hash"):
+        types.Hash("0x" + "g" * 64)
+    some_hash = types.Hash(SOME_HASH)
+    assert types.Hash(some_hash) is some_hash
+
+
+def test_hash_from_bytes32():
+    value = types.Hash.from_bytes32(HexBytes(SOME_HASH))
+    assert isinstance(value, types.Hash)
+    assert value == SOME_HASH
+    assert types.Hash.from_bytes32(bytes.fromhex(SOME_HASH[2:])) == SOME_HASH
+
+
+def test_bytes_type():
+    buffer = b"\x12\x34\x56"
+    value = types.Bytes(buffer)
+    assert value._hex is None  # Not encoded until needed
+    assert value == "123456"
+    assert "123456" == value
+    assert value != "1234"
+    assert value == types.Bytes(bytearray(buffer))
+    assert str(value) == "123456"
+    assert value.to_0x_hex() == "0x123456"
+    assert bytes(value) == buffer
+    assert len(value) == 6
+    assert value.startswith("12")
+    assert value[:2] == "12"
+    assert "0x" + value == "0x123456"
+    assert hash(value) == hash("123456")
+    assert value > "000000"
+    assert pickle.loads(pickle.dumps(value)) == value
+
+    view = memoryview(b"\xab\xcd\xef")[1:]
+    assert types.Bytes(view)._buffer is view
+    assert types.Bytes(view) == "cdef"
 
 
 def test_address_type():
@@ -65,6 +102,8 @@ def test_args_registry():
     assert types.arg_from_solidity_type("address") is types.Address
     bytes_ = b"\x12\x34\x56"
     assert types.arg_from_solidity_type("bytes")(bytes_) == bytes_.hex()
+    assert types.arg_from_solidity_type("bytes4")(bytes_) == bytes_.hex()
+    assert isinstance(types.arg_from_solidity_type("bytes")(bytes_), types.Bytes)
     address_array = ["0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174", "0x625E7708f30cA75bfd92586e17077590C60eb4cD"]
     assert types.arg_from_solidity_type("address[]")(address_array) == address_array
     int_array = [1, 2, 3, 4, 5]